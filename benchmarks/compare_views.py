@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for odoo_updates.compare_views
+
+Builds synthetic original/modified view lists (10% updated, 5% added, 5% deleted) and times
+the comparison at growing sizes. The time per view should stay roughly constant, which means
+the comparison scales linearly with the number of views.
+
+Usage::
+
+    python benchmarks/compare_views.py [size [size ...]]
+"""
+
+import sys
+import timeit
+
+from odoo_updates.odoo_updates import compare_views
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def build_views(size):
+    arch = '<form><field name="name"/><field name="field_{0}"/></form>'
+    original = list()
+    modified = list()
+    for index in range(size):
+        view = {'xml_id': 'module_{0}.view_{1}'.format(index % 300, index),
+                'arch': arch.format(index)}
+        if index % 20 != 0:
+            original.append(view)
+        if index % 20 != 1:
+            modified.append(view if index % 10 != 2 else {
+                'xml_id': view['xml_id'],
+                'arch': view['arch'].replace('form', 'tree')})
+    return original, modified
+
+
+def main(sizes):
+    print('{0:>10} {1:>12} {2:>14}'.format('views', 'seconds', 'usec/view'))
+    for size in sizes:
+        original, modified = build_views(size)
+        elapsed = min(timeit.repeat(lambda: compare_views(original, modified),
+                                    repeat=3, number=1))
+        print('{0:>10} {1:>12.4f} {2:>14.3f}'.format(size, elapsed, elapsed * 1e6 / size))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic Odoo database generator for the benchmarks
+
+Creates (or replaces) a database with the ir_model_data, ir_ui_view, ir_ui_menu,
+ir_translation and ir_model_fields tables filled with *scale* rows each. The rows are built by
+PostgreSQL itself with generate_series so even a million rows take seconds.
+
+The *updated* variant is the same database after an upgrade with the given change rate: out of
+every 1/rate rows one is modified and one is deleted, and scale * rate new rows are added. The
+view archs are QWeb-like templates with repeated blocks, the menus form a tree ten levels deep.
+
+Usage::
+
+    python benchmarks/generate.py database scale [--updated] [--rate 0.1]
+"""
+
+import argparse
+
+import psycopg2
+
+SCHEMA = """
+DROP TABLE IF EXISTS ir_model_data, ir_ui_view, ir_ui_menu, ir_translation, ir_model_fields;
+CREATE TABLE ir_model_data (name varchar, model varchar, res_id integer, module varchar);
+CREATE TABLE ir_ui_view (id integer, arch text, create_date timestamp, write_date timestamp);
+CREATE TABLE ir_ui_menu (id integer, name varchar, parent_id integer, create_date timestamp,
+                         write_date timestamp);
+CREATE TABLE ir_translation (id integer, value text, name varchar, module varchar, lang varchar,
+                             type varchar, create_date timestamp, write_date timestamp);
+CREATE TABLE ir_model_fields (id integer, model varchar, name varchar, ttype varchar,
+                              field_description varchar, create_date timestamp,
+                              write_date timestamp);
+"""
+
+# {rows} is the generate_series of the row numbers (i) present in the variant and {changed}
+# is true for the rows modified by the upgrade
+DATA = """
+INSERT INTO ir_model_data (name, model, res_id, module)
+    SELECT 'view_' || i, 'ir.ui.view', i, 'module_' || i % 300 FROM {rows}
+    UNION ALL
+    SELECT 'menu_' || i, 'ir.ui.menu', i, 'module_' || i % 300 FROM {rows};
+INSERT INTO ir_ui_view (id, arch, create_date, write_date)
+    SELECT i, '<t t-name="module_' || i % 300 || '.view_' || i || '"><div class="page">' ||
+        repeat('<div class="row"><span t-field="o.name"/><span t-field="o.date"/></div>', 5) ||
+        '<field name="' || CASE WHEN {changed} THEN 'updated_' ELSE 'field_' END || i ||
+        '"/></div></t>', now(), now() FROM {rows};
+INSERT INTO ir_ui_menu (id, name, parent_id, create_date, write_date)
+    SELECT i, CASE WHEN {changed} THEN 'Renamed ' ELSE 'Menu ' END || i,
+        CASE WHEN i <= 10 THEN NULL ELSE i / 10 END, now(), now() FROM {rows};
+INSERT INTO ir_translation (id, value, name, module, lang, type, create_date, write_date)
+    SELECT i, CASE WHEN {changed} THEN 'Valor actualizado ' ELSE 'Valor ' END || i,
+        'ir.ui.view,arch_db', 'module_' || i % 300,
+        (ARRAY['es_MX', 'es_ES', 'fr_FR', 'pt_BR'])[i % 4 + 1], 'model', now(), now()
+    FROM {rows};
+INSERT INTO ir_model_fields (id, model, name, ttype, field_description, create_date,
+                             write_date)
+    SELECT i, 'model.' || i % 1000, 'field_' || i,
+        CASE WHEN {changed} THEN 'float' ELSE (ARRAY['char', 'integer', 'many2one'])[i % 3 + 1]
+        END, 'Field ' || i, now(), now() FROM {rows};
+ANALYZE;
+"""
+
+
+def generate(database, scale, updated=False, rate=0.1):
+    """ Create the database (dropping it if it exists) and fill it with the synthetic data
+
+    :param database: Name of the database
+    :param scale: Number of rows in each table
+    :param updated: Build the upgraded variant instead of the original one
+    :param rate: Fraction of the rows modified, deleted and added by the upgrade
+    """
+    admin = psycopg2.connect(dbname='postgres')
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute('DROP DATABASE IF EXISTS "{0}"'.format(database))
+            cursor.execute('CREATE DATABASE "{0}"'.format(database))
+    finally:
+        admin.close()
+    step = max(int(round(1 / rate)), 3) if rate else 0
+    if updated and step:
+        rows = ("(SELECT i FROM generate_series(1, {scale}) i WHERE i % {step} != 2 UNION ALL "
+                "SELECT i FROM generate_series({scale} + 1, {scale} + {added}) i) rows"
+                .format(scale=scale, step=step, added=scale // step))
+        changed = 'i % {0} = 1'.format(step)
+    else:
+        rows = 'generate_series(1, {0}) i'.format(scale)
+        changed = 'false'
+    conn = psycopg2.connect(dbname=database)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(SCHEMA)
+            cursor.execute(DATA.format(rows=rows, changed=changed))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('database')
+    parser.add_argument('scale', type=int)
+    parser.add_argument('--updated', action='store_true')
+    parser.add_argument('--rate', type=float, default=0.1)
+    args = parser.parse_args()
+    generate(args.database, args.scale, args.updated, args.rate)
+
+
+if __name__ == '__main__':
+    main()
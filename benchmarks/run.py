@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the extractors (get_*), comparators (compare_*) and the whole diffs
+(get_*_diff)
+
+For every scale a pair of synthetic databases is generated (see generate.py) and every case
+runs in its own process so the memory of one does not hide the peak of the next. The time is
+the best of *repeat* runs; the memory is the peak traced by tracemalloc on Python 3 or the
+growth of the peak resident set size (VmHWM) on Python 2.
+
+The results are stored as json in benchmarks/results/<label>.json (the package version by
+default) and can be compared with the ones of a previous release::
+
+    python benchmarks/run.py --scales 1000 10000 --label 0.0.2 --compare 0.0.1
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from datetime import datetime
+from functools import partial
+
+from odoo_updates import __version__
+from odoo_updates import odoo_updates
+
+from generate import generate
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # pylint: disable=C0103
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def database_args(database):
+    return (database,)
+
+
+def compared_args(extractor, original, updated):
+    return extractor(original), extractor(updated)
+
+
+def menus_args(original, updated):
+    return (odoo_updates.get_menus(original), odoo_updates.get_menus(updated),
+            odoo_updates.menus_hierarchy(original), odoo_updates.menus_hierarchy(updated))
+
+
+def diff_args(original, updated):
+    return original, updated
+
+
+def cases(original, updated):
+    """ Get the benchmark cases: (name, setup, function) where setup returns the arguments of
+    the function, so the setup (the extraction for the comparators) is not measured
+    """
+    res = list()
+    for name in ('get_views', 'get_translations', 'get_fields', 'get_menus', 'menus_hierarchy'):
+        res.append((name, partial(database_args, original), getattr(odoo_updates, name)))
+    for name in ('get_views', 'get_translations', 'get_fields'):
+        res.append((name + '_copy', partial(database_args, original),
+                    partial(getattr(odoo_updates, name), copy=True)))
+    for name, extractor in (('compare_views', odoo_updates.get_views),
+                            ('compare_translations', odoo_updates.get_translations),
+                            ('compare_fields', odoo_updates.get_fields)):
+        res.append((name, partial(compared_args, extractor, original, updated),
+                    getattr(odoo_updates, name)))
+    res.append(('compare_menus', partial(menus_args, original, updated),
+                odoo_updates.compare_menus))
+    for name in ('get_views_diff', 'get_translations_diff', 'get_fields_diff',
+                 'get_menus_diff'):
+        res.append((name, partial(diff_args, original, updated), getattr(odoo_updates, name)))
+    # One language at a time, the peak memory is the one of the biggest language
+    res.append(('get_translations_diff_partitioned', partial(diff_args, original, updated),
+                partial(odoo_updates.get_translations_diff, jobs=1, partition='lang')))
+    return res
+
+
+def _status(key):
+    """ Get a value in bytes of /proc/self/status (Linux only)
+    """
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(key + ':'):
+                return int(line.split()[1]) * 1024
+    raise IOError(key)
+
+
+def peak_memory(function, args):
+    """ Get the peak memory allocated while running the function
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+        function(*args)
+        memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return memory
+    try:
+        # Reset the peak resident set size (VmHWM) to the current one
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        before = _status('VmRSS')
+        function(*args)
+        return _status('VmHWM') - before
+    except (IOError, OSError):
+        # ru_maxrss is in KB on Linux, the peak reached by the setup may hide the one of the
+        # function
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        function(*args)
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024
+
+
+def measure(case, repeat):
+    """ Run a case in the current process, called in a fresh child process for every case
+
+    :return: dict with the best time in seconds and the peak memory in bytes
+    """
+    dummy, setup, function = case
+    args = setup()
+    memory = peak_memory(function, args)
+    timings = list()
+    for dummy in range(repeat):
+        start = time.time()
+        function(*args)
+        timings.append(time.time() - start)
+    return {'seconds': min(timings), 'memory': memory}
+
+
+def child(sender, case, repeat):
+    sender.send(measure(case, repeat))
+    sender.close()
+
+
+def run(scales, rate, repeat, reuse=False):
+    res = dict()
+    for scale in scales:
+        original = 'bench_original_{0}'.format(scale)
+        updated = 'bench_updated_{0}'.format(scale)
+        if not reuse:
+            generate(original, scale)
+            generate(updated, scale, updated=True, rate=rate)
+        res[str(scale)] = dict()
+        for case in cases(original, updated):
+            # A new process per case so the peak memory is not shared between cases
+            receiver, sender = multiprocessing.Pipe(False)
+            worker = multiprocessing.Process(target=child, args=(sender, case, repeat))
+            worker.start()
+            result = receiver.recv()
+            worker.join()
+            res[str(scale)][case[0]] = result
+            print('{0:>10} {1:<24} {2:>10.4f} s {3:>10.1f} MB'.format(
+                scale, case[0], result['seconds'], result['memory'] / 1024.0 / 1024))
+            sys.stdout.flush()
+    return res
+
+
+def report(results, previous):
+    """ Print the ratio of every case against a previous run, > 1 means slower or bigger
+    """
+    print('\n{0:>10} {1:<24} {2:>10} {3:>10}'.format('scale', 'case', 'time', 'memory'))
+    for scale, scale_results in sorted(results.items(), key=lambda item: int(item[0])):
+        for name, result in sorted(scale_results.items()):
+            old = previous.get(scale, {}).get(name)
+            if not old:
+                continue
+            print('{0:>10} {1:<24} {2:>9.2f}x {3:>9.2f}x'.format(
+                scale, name, result['seconds'] / max(old['seconds'], 1e-9),
+                float(result['memory']) / max(old['memory'], 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--rate', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--label', default=__version__)
+    parser.add_argument('--compare', help='Label of the results to compare with')
+    parser.add_argument('--reuse', action='store_true',
+                        help='Use the databases generated by a previous run')
+    args = parser.parse_args()
+    previous = None
+    if args.compare:
+        with open(os.path.join(RESULTS, '{0}.json'.format(args.compare))) as stored:
+            previous = json.load(stored)['results']
+    results = run(args.scales, args.rate, args.repeat, args.reuse)
+    if not os.path.isdir(RESULTS):
+        os.makedirs(RESULTS)
+    filename = os.path.join(RESULTS, '{0}.json'.format(args.label))
+    with open(filename, 'w') as output:
+        json.dump({'label': args.label,
+                   'generated_at': datetime.now().strftime("%Y%m%d %H%M%S"),
+                   'python': platform.python_version(),
+                   'rate': args.rate,
+                   'results': results}, output, indent=4, sort_keys=True,
+                  separators=(',', ': '))
+    print('\nResults stored in {0}'.format(filename))
+    if previous is not None:
+        report(results, previous)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from .utils import PostgresConnector
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+logger = logging.getLogger('deployv')  # pylint: disable=C0103
+
+
+class SnapshotCache(object):
+    """ On disk cache for the data extracted from a database, meant for the original
+    (production) database which is compared many times without changes.
+
+    Every snapshot is keyed by the identity of the database (name, server and oid) plus a change
+    indicator of the tables the data comes from: their number of rows and the sum of the
+    transaction ids (xmin) of their rows. Any insert, update or delete gives the written rows a
+    new xmin or changes the count, so the stale snapshot is never read again and ends up
+    evicted. Unlike the write_date of the records or the statistics counters, it does not depend
+    on what the writer sets, on the statistics collector or on the commit order. Computing it
+    scans the table, so every table (and the identity) is probed once per run and shared by all
+    the snapshots that read it: a run is the life of the cache or the time since :meth:`reset`.
+
+    The snapshots are zlib compressed pickles, once the directory grows over *max_size* bytes the
+    least recently used ones are removed.
+    """
+
+    def __init__(self, path=None, max_size=1024 * 1024 * 1024):
+        self.path = path or os.path.expanduser('~/.cache/odoo_updates')
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.probes = dict()
+        self.probes_lock = threading.Lock()
+
+    def reset(self):
+        """ Start a new run, the tables are probed again
+        """
+        with self.probes_lock:
+            self.probes.clear()
+
+    def _probed(self, key, probe):
+        """ Get the result of a probe of this run, only the first caller runs it (the others wait
+        for it)
+        """
+        with self.probes_lock:
+            entry = self.probes.setdefault(key, [threading.Lock(), None])
+        with entry[0]:
+            if entry[1] is None:
+                entry[1] = (probe(),)
+        return entry[1][0]
+
+    def identity(self, database):
+        """ Get what identifies the database: its name, server and oid (a dropped and restored
+        database gets a new oid). The server is given by the host and port of the connection as
+        well, the server address is unknown over a Unix socket
+
+        :param database: database name to query on
+        :return: A tuple that identifies the database
+        """
+        def probe():
+            with PostgresConnector({'dbname': database}) as conn:
+                identity = conn.execute_select(
+                    """SELECT current_database(), inet_server_addr()::text, inet_server_port(),
+                    oid FROM pg_database WHERE datname = current_database()""").fetchone()
+                address = conn.server_address()
+            return tuple(identity) + address
+        return self._probed((database, None), probe)
+
+    def table_state(self, database, table):
+        """ Get the change indicator of a table: its name, number of rows and sum of their xmin,
+        the table is scanned once per run but only its row headers are read
+
+        :param database: database name to query on
+        :param table: The table name
+        :return: A tuple, None if the table does not exist
+        """
+        def probe():
+            with PostgresConnector({'dbname': database}) as conn:
+                exists = conn.execute_select(
+                    """SELECT 1 FROM pg_tables WHERE schemaname = 'public'
+                    AND tablename = %s""", table).fetchone()
+                if not exists:
+                    return None
+                row = conn.execute_select('SELECT count(*), sum(xmin::text::bigint) '
+                                          'FROM public."{0}"'.format(table)).fetchone()
+            return (table,) + tuple(row)
+        return self._probed((database, table), probe)
+
+    def probe(self, database, tables):
+        """ Get the identity and change indicator of the database for the given tables
+
+        :param database: database name to query on
+        :param tables: The tables whose changes invalidate the snapshot
+        :return: A tuple that identifies the current state of the tables
+        """
+        states = (self.table_state(database, table) for table in sorted(set(tables)))
+        return self.identity(database), tuple(state for state in states if state is not None)
+
+    def snapshot(self, database, tables, key, extract):
+        """ Return the snapshot for the key if the tables did not change since it was stored,
+        otherwise call *extract* and store its result
+
+        :param database: database name the data is extracted from
+        :param tables: The tables the data comes from
+        :param key: Anything that can be pickled and identifies what is extracted
+        :param extract: Callable without arguments that returns the data to be cached
+        :return: The cached or just extracted data
+        """
+        filename = self.filename((self.probe(database, tables), key))
+        res = self.load(filename)
+        if res is not None:
+            logger.debug('Snapshot cache hit: %s %s', database, filename)
+            return res
+        logger.debug('Snapshot cache miss: %s %s', database, filename)
+        res = extract()
+        self.store(filename, res)
+        return res
+
+    def index(self, data, build):
+        """ Get the index of snapshot data, e.g. the original records by key
+
+        :param data: Data returned by :meth:`snapshot`
+        :param build: Callable that receives the data and returns its index
+        :return: The index
+        """
+        return build(data)
+
+    def filename(self, key):
+        """ Get the snapshot file for the key
+
+        :param key: Anything that can be pickled
+        :return: The path of the snapshot
+        """
+        digest = hashlib.sha1(pickle.dumps(key, 2)).hexdigest()
+        return os.path.join(self.path, '{0}.snapshot'.format(digest))
+
+    def load(self, filename):
+        """ Read a snapshot, its access time is updated so it is evicted last
+
+        :param filename: The snapshot file
+        :return: The cached data or None if there is no (valid) snapshot
+        """
+        try:
+            with open(filename, 'rb') as snapshot:
+                res = pickle.loads(zlib.decompress(snapshot.read()))
+        except (IOError, OSError):
+            return None
+        except Exception as error:  # pylint: disable=W0703
+            logger.debug('Discarding unreadable snapshot %s: %s', filename, error)
+            return None
+        os.utime(filename, None)
+        return res
+
+    def store(self, filename, data):
+        """ Write a snapshot atomically and evict the old ones if the size limit is exceeded
+
+        :param filename: The snapshot file
+        :param data: The data to be stored
+        """
+        handle, tmp_name = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as snapshot:
+            snapshot.write(zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)))
+        os.rename(tmp_name, filename)
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used snapshots until the cache fits in *max_size*
+        """
+        snapshots = list()
+        for name in os.listdir(self.path):
+            if not name.endswith('.snapshot'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            snapshots.append((stat.st_mtime, stat.st_size, name))
+        total = sum(snapshot[1] for snapshot in snapshots)
+        for dummy, size, name in sorted(snapshots):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """ Remove all the snapshots
+        """
+        for name in os.listdir(self.path):
+            if name.endswith('.snapshot'):
+                os.remove(os.path.join(self.path, name))
+
+
+class MemorySnapshotCache(SnapshotCache):
+    """ Snapshot cache that also keeps the last *entries* snapshots in memory, for a long running
+    process (see worker.DiffWorker) that compares the same original database again and again:
+    a hit is served without reading and unpickling the file. The key of a snapshot changes with
+    any write in its tables so the snapshots in memory are never stale either. The indexes of
+    the snapshots in memory are kept as well, so they are built once instead of by every job.
+    """
+
+    def __init__(self, path=None, max_size=1024 * 1024 * 1024, entries=16):
+        super(MemorySnapshotCache, self).__init__(path, max_size)
+        self.entries = entries
+        self.memory = OrderedDict()
+        self.indexes = dict()
+        self.lock = threading.Lock()
+
+    def remember(self, filename, data):
+        with self.lock:
+            self.memory.pop(filename, None)
+            self.memory[filename] = data
+            while len(self.memory) > self.entries:
+                dummy, evicted = self.memory.popitem(last=False)
+                if not any(kept is evicted for kept in self.memory.values()):
+                    self.indexes.pop(id(evicted), None)
+
+    def index(self, data, build):
+        with self.lock:
+            # Keyed by the identity of the data, the object served by every hit
+            indexed = self.indexes.get(id(data))
+            if indexed is not None and indexed[0] is data:
+                return indexed[1]
+        res = build(data)
+        with self.lock:
+            if any(kept is data for kept in self.memory.values()):
+                self.indexes[id(data)] = (data, res)
+        return res
+
+    def load(self, filename):
+        with self.lock:
+            res = self.memory.pop(filename, None)
+            if res is not None:
+                self.memory[filename] = res
+                return res
+        res = super(MemorySnapshotCache, self).load(filename)
+        if res is not None:
+            self.remember(filename, res)
+        return res
+
+    def store(self, filename, data):
+        super(MemorySnapshotCache, self).store(filename, data)
+        self.remember(filename, data)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.indexes.clear()
+        super(MemorySnapshotCache, self).clear()
+
+
+class IncrementalStore(SnapshotCache):
+    """ On disk store of the state of a domain (its records and the high-water mark of their
+    write_date) as left by the last comparison, so the next one only needs to fetch the rows
+    written since then. Unlike the snapshots, the state is keyed only by the database identity
+    and the domain, it is updated after every run. The same size based eviction applies.
+    """
+
+    def __init__(self, path=None, max_size=1024 * 1024 * 1024):
+        super(IncrementalStore, self).__init__(
+            path or os.path.expanduser('~/.cache/odoo_updates/incremental'), max_size)
+
+    def state(self, database, domain):
+        """ Get the state stored by the last run
+
+        :param database: database name
+        :param domain: The domain (views, translations, ...)
+        :return: dict with the *hwm* (high-water mark) and the *records* (dict by key), or None
+            if there was no previous run
+        """
+        return self.load(self.filename((self.identity(database), domain)))
+
+    def save(self, database, domain, state):
+        """ Store the state of the domain for the next run
+
+        :param database: database name
+        :param domain: The domain (views, translations, ...)
+        :param state: dict with the *hwm* and the *records*
+        """
+        self.store(self.filename((self.identity(database), domain)), state)
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Line diff engines used to show the updated records.
+
+An engine is a callable ``engine(a, b, deadline)`` that receives two lists of lines and returns
+the matching blocks between them as a list of ``(i, j, size)`` tuples (``a[i:i + size] ==
+b[j:j + size]``) in increasing order, like ``difflib.SequenceMatcher.get_matching_blocks``
+without the final dummy block. Engines that can be interrupted raise :class:`BudgetExceeded`
+once ``time.time()`` goes past the deadline (None means no limit).
+"""
+
+import bisect
+import difflib
+import time
+
+
+class BudgetExceeded(Exception):
+    """ Raised by the engines when the time budget of the entry is exhausted
+    """
+
+
+def _check(deadline):
+    if deadline is not None and time.time() > deadline:
+        raise BudgetExceeded()
+
+
+def _hash_lines(a, b):
+    """ Replace every line by an integer, equal lines get the same one, so the engines compare
+    integers instead of strings
+    """
+    ids = dict()
+    return ([ids.setdefault(line, len(ids)) for line in a],
+            [ids.setdefault(line, len(ids)) for line in b])
+
+
+def difflib_engine(a, b, deadline=None):  # pylint: disable=W0613
+    """ The engine of difflib.unified_diff, it can not be interrupted
+    """
+    return difflib.SequenceMatcher(None, a, b).get_matching_blocks()[:-1]
+
+
+def myers_engine(a, b, deadline=None):
+    """ Myers O(ND) diff on the hashed lines after removing the common prefix and suffix, the
+    result is a minimal diff
+    """
+    a, b = _hash_lines(a, b)
+    blocks = list()
+    _myers(a, b, 0, len(a), 0, len(b), deadline, blocks)
+    return _merge(blocks)
+
+
+def patience_engine(a, b, deadline=None):
+    """ Patience diff: the lines that are unique in both sides are matched first (the longest
+    increasing sequence of them) and the ranges between those anchors are diffed recursively,
+    falling back to Myers when a range has no unique lines. Repeated blocks (as in big QWeb
+    templates) do not mislead it and it is fast on large inputs
+    """
+    a, b = _hash_lines(a, b)
+    blocks = list()
+    _patience(a, b, 0, len(a), 0, len(b), deadline, blocks)
+    return _merge(blocks)
+
+
+ENGINES = {
+    'difflib': difflib_engine,
+    'myers': myers_engine,
+    'patience': patience_engine,
+}
+
+
+def _trim(a, b, alo, ahi, blo, bhi, blocks):
+    """ Add the common prefix to the blocks and return the range left and the common suffix
+    """
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        blocks.append((alo, blo, 1))
+        alo += 1
+        blo += 1
+    suffix = 0
+    while alo < ahi - suffix and blo < bhi - suffix and a[ahi - suffix - 1] == b[bhi - suffix - 1]:
+        suffix += 1
+    return alo, ahi - suffix, blo, bhi - suffix, suffix
+
+
+def _myers(a, b, alo, ahi, blo, bhi, deadline, blocks):
+    alo, ahi, blo, bhi, suffix = _trim(a, b, alo, ahi, blo, bhi, blocks)
+    n = ahi - alo
+    m = bhi - blo
+    if n and m:
+        trace = _myers_trace(a, b, alo, blo, n, m, deadline)
+        blocks.extend(_myers_matches(trace, alo, blo, n, m))
+    blocks.extend((ahi + index, bhi + index, 1) for index in range(suffix))
+
+
+def _myers_trace(a, b, alo, blo, n, m, deadline):
+    """ Forward pass: the furthest reaching x of every diagonal k for each edit distance d,
+    until the end of both sequences is reached
+    """
+    trace = list()
+    v = {1: 0}
+    for d in range(n + m + 1):
+        _check(deadline)
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return trace
+    return trace
+
+
+def _myers_matches(trace, alo, blo, n, m):
+    """ Backtrack the trace from the end: the matching lines (snakes) in order
+    """
+    matches = list()
+    x, y = n, m
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((alo + x, blo + y, 1))
+        x, y = prev_x, prev_y
+    matches.reverse()
+    return matches
+
+
+def _patience(a, b, alo, ahi, blo, bhi, deadline, blocks):
+    _check(deadline)
+    alo, ahi, blo, bhi, suffix = _trim(a, b, alo, ahi, blo, bhi, blocks)
+    if alo < ahi and blo < bhi:
+        anchors = _unique_anchors(a, b, alo, ahi, blo, bhi)
+        if not anchors:
+            _myers(a, b, alo, ahi, blo, bhi, deadline, blocks)
+        else:
+            for i, j in anchors:
+                _patience(a, b, alo, i, blo, j, deadline, blocks)
+                blocks.append((i, j, 1))
+                alo, blo = i + 1, j + 1
+            _patience(a, b, alo, ahi, blo, bhi, deadline, blocks)
+    blocks.extend((ahi + index, bhi + index, 1) for index in range(suffix))
+
+
+def _unique_anchors(a, b, alo, ahi, blo, bhi):
+    """ Get the (i, j) pairs of the lines that appear once in each range, the longest sequence of
+    them that is increasing in both sides (patience sorting)
+    """
+    counts = dict()
+    for i in range(alo, ahi):
+        counts[a[i]] = (i, -1) if a[i] not in counts else (None, -1)
+    for j in range(blo, bhi):
+        position = counts.get(b[j])
+        if position is None or position[0] is None:
+            continue
+        counts[b[j]] = (position[0], j if position[1] == -1 else None)
+    pairs = sorted((i, j) for i, j in counts.values() if i is not None and j not in (-1, None))
+    tops = list()
+    tails = list()
+    previous = dict()
+    for i, j in pairs:
+        pile = bisect.bisect_left(tops, j)
+        if pile == len(tops):
+            tops.append(j)
+            tails.append((i, j))
+        else:
+            tops[pile] = j
+            tails[pile] = (i, j)
+        previous[(i, j)] = tails[pile - 1] if pile else None
+    res = list()
+    pair = tails[-1] if tails else None
+    while pair is not None:
+        res.append(pair)
+        pair = previous[pair]
+    return list(reversed(res))
+
+
+def _merge(blocks):
+    """ Join the consecutive blocks
+    """
+    res = list()
+    for i, j, size in blocks:
+        if res and res[-1][0] + res[-1][2] == i and res[-1][1] + res[-1][2] == j:
+            res[-1] = (res[-1][0], res[-1][1], res[-1][2] + size)
+        else:
+            res.append((i, j, size))
+    return res
+
+
+def get_opcodes(blocks, len_a, len_b):
+    """ Convert the matching blocks into opcodes, see difflib.SequenceMatcher.get_opcodes
+    """
+    i = j = 0
+    res = list()
+    for ai, bj, size in list(blocks) + [(len_a, len_b, 0)]:
+        tag = ''
+        if i < ai and j < bj:
+            tag = 'replace'
+        elif i < ai:
+            tag = 'delete'
+        elif j < bj:
+            tag = 'insert'
+        if tag:
+            res.append((tag, i, ai, j, bj))
+        i, j = ai + size, bj + size
+        if size:
+            res.append(('equal', ai, i, bj, j))
+    return res
+
+
+def group_opcodes(opcodes, context=3):
+    """ Group the opcodes in hunks with up to *context* lines of context, see
+    difflib.SequenceMatcher.get_grouped_opcodes
+    """
+    codes = list(opcodes) or [('equal', 0, 1, 0, 1)]
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+    group = list()
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = list()
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def _format_range(start, stop):
+    length = stop - start
+    beginning = start + 1
+    if length == 1:
+        return '{0}'.format(beginning)
+    if not length:
+        beginning -= 1
+    return '{0},{1}'.format(beginning, length)
+
+
+class Differ(object):
+    """ Build unified diffs (as difflib.unified_diff with lineterm='') with the given engine, a
+    name of :data:`ENGINES` or a callable.
+
+    Every diff has a budget: once the lines of both sides are more than *max_lines* or the
+    engine runs for more than *timeout* seconds the diff falls back to a coarse one where all the
+    original lines are removed and all the modified ones added, so a pathological entry can not
+    stall the whole report.
+    """
+
+    def __init__(self, engine='patience', timeout=1.0, max_lines=200000, context=3):
+        self.engine = ENGINES[engine] if not callable(engine) else engine
+        self.timeout = timeout
+        self.max_lines = max_lines
+        self.context = context
+
+    def unified_diff(self, a, b):
+        """ Diff two lists of lines
+
+        :param a: The original lines
+        :param b: The modified lines
+        :return: A list with the lines of the unified diff
+        """
+        if self.max_lines is not None and len(a) + len(b) > self.max_lines:
+            return self.replaced(a, b)
+        deadline = time.time() + self.timeout if self.timeout is not None else None
+        try:
+            blocks = self.engine(a, b, deadline)
+        except (BudgetExceeded, RuntimeError):
+            # RuntimeError: maximum recursion depth exceeded on deeply nested ranges
+            return self.replaced(a, b)
+        res = list()
+        for group in group_opcodes(get_opcodes(blocks, len(a), len(b)), self.context):
+            if not res:
+                res.extend(['--- ', '+++ '])
+            first, last = group[0], group[-1]
+            res.append('@@ -{0} +{1} @@'.format(_format_range(first[1], last[2]),
+                                                _format_range(first[3], last[4])))
+            for tag, i1, i2, j1, j2 in group:
+                if tag == 'equal':
+                    res.extend(' ' + line for line in a[i1:i2])
+                    continue
+                if tag in ('replace', 'delete'):
+                    res.extend('-' + line for line in a[i1:i2])
+                if tag in ('replace', 'insert'):
+                    res.extend('+' + line for line in b[j1:j2])
+        return res
+
+    def replaced(self, a, b):
+        """ The coarse diff used when the budget is exceeded
+        """
+        res = ['--- ', '+++ ', '@@ -{0} +{1} @@ replaced'.format(_format_range(0, len(a)),
+                                                                 _format_range(0, len(b)))]
+        res.extend('-' + line for line in a)
+        res.extend('+' + line for line in b)
+        return res
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import WRAPPER_ASSIGNMENTS, wraps
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None  # pylint: disable=C0103
+
+_profiler = None  # pylint: disable=C0103
+
+
+class Profiler(object):
+    """ Collect the metrics of a run: the wall time of every phase (extraction of a domain,
+    comparison, serialization, ...) and the duration, rows and bytes of every query executed
+    while it is active.
+
+    The phases are tracked per thread so the queries of the extractions running concurrently
+    are attributed to the right one. The memory of a phase is how much the resident set size of
+    the process grew over the one at its start, at its peak (see :class:`MemoryTracker`); the
+    bytes are the length of the values fetched (an approximation of the data transferred).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+        self.phases = OrderedDict()
+        self.queries = list()
+        self.memory = MemoryTracker()
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = list()
+        return self.local.stack
+
+    def current(self):
+        stack = self.stack()
+        return stack[-1] if stack else None
+
+    def _phase_metrics(self, name):
+        return self.phases.setdefault(name, {
+            'seconds': 0.0, 'calls': 0, 'queries': 0, 'query_seconds': 0.0, 'rows': 0,
+            'bytes': 0, 'peak_memory': 0})
+
+    @contextmanager
+    def phase(self, name):
+        """ Context manager that measures the phase
+
+        :param name: Name of the phase, the same name may be used many times
+        """
+        self.stack().append(name)
+        memory = self.memory.start()
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            growth = self.memory.stop(memory)
+            self.stack().pop()
+            with self.lock:
+                metrics = self._phase_metrics(name)
+                metrics['seconds'] += seconds
+                metrics['calls'] += 1
+                metrics['peak_memory'] = max(metrics['peak_memory'], growth)
+
+    def query(self, sql, seconds, rows, size):
+        """ Record an executed query in the current phase
+
+        :param sql: The sql executed
+        :param seconds: Time spent executing it and fetching its rows
+        :param rows: Number of rows fetched
+        :param size: Bytes fetched
+        """
+        phase = self.current()
+        self.local.query = {'phase': phase, 'sql': ' '.join(sql.split())[:200],
+                            'seconds': seconds, 'rows': rows, 'bytes': size}
+        with self.lock:
+            self.queries.append(self.local.query)
+            if phase is not None:
+                metrics = self._phase_metrics(phase)
+                metrics['queries'] += 1
+                metrics['query_seconds'] += seconds
+                metrics['rows'] += rows
+                metrics['bytes'] += size
+
+    def fetched(self, size):
+        """ Add the bytes of rows read after their query was recorded, to the last query of
+        the thread and its phase
+
+        :param size: Bytes fetched
+        """
+        query = getattr(self.local, 'query', None)
+        if query is None:
+            return
+        with self.lock:
+            query['bytes'] += size
+            if query['phase'] is not None:
+                self._phase_metrics(query['phase'])['bytes'] += size
+
+    def to_dict(self):
+        """ Get the metrics collected so far, the metrics section of the json envelope
+        """
+        with self.lock:
+            return {
+                'seconds': time.time() - self.started,
+                'peak_memory': max(self.memory.peak, peak_memory()),
+                'phases': OrderedDict((name, dict(metrics))
+                                      for name, metrics in self.phases.items()),
+                'queries': list(self.queries),
+            }
+
+
+class MemoryTracker(object):
+    """ Measure the peak resident set size of the process over spans of time that may overlap
+    (nested phases, phases of other threads).
+
+    On Linux the peak (VmHWM) is reset to the current size at the start and end of every span
+    (see /proc/self/clear_refs); before each reset the peak reached is added to all the spans
+    open, so each one knows the peak of its own lifetime. Elsewhere the lifetime peak of the
+    process is used, a span then only sees the growth over the largest one before it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = list()
+        self.peak = 0
+        self.resettable = _reset_peak()
+
+    def _checkpoint(self):
+        peak = _status('VmHWM') if self.resettable else peak_memory()
+        self.peak = max(self.peak, peak)
+        for span in self.spans:
+            span[1] = max(span[1], peak)
+        if self.resettable:
+            self.resettable = _reset_peak()
+
+    def start(self):
+        """ Start a span
+
+        :return: The span, to be given to :meth:`stop`
+        """
+        with self.lock:
+            self._checkpoint()
+            size = _status('VmRSS') if self.resettable else peak_memory()
+            span = [size, size]
+            self.spans.append(span)
+        return span
+
+    def stop(self, span):
+        """ Finish a span
+
+        :param span: The result of :meth:`start`
+        :return: Bytes the resident set size grew over the one at the start, at its peak
+        """
+        with self.lock:
+            self._checkpoint()
+            # Spans of the same size are equal, the one given is removed
+            self.spans = [other for other in self.spans if other is not span]
+        return span[1] - span[0]
+
+
+def _status(key):
+    """ Get a value in bytes of /proc/self/status (Linux only)
+    """
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(key + ':'):
+                return int(line.split()[1]) * 1024
+    raise IOError(key)
+
+
+def _reset_peak():
+    """ Reset the peak resident set size (VmHWM) to the current one
+
+    :return: False if it is not supported
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        _status('VmHWM')
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def peak_memory():
+    """ Peak resident set size of the process in bytes, 0 if it can not be known
+    """
+    if resource is None:
+        return 0
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def start_profiling():
+    """ Start collecting metrics, until :func:`stop_profiling` is called every query executed by
+    a PostgresConnector and every :func:`phase` are recorded
+
+    :return: The Profiler
+    """
+    global _profiler  # pylint: disable=W0603,C0103
+    _profiler = Profiler()
+    return _profiler
+
+
+def stop_profiling():
+    """ Stop collecting metrics
+
+    :return: The Profiler that was active, None if there was none
+    """
+    global _profiler  # pylint: disable=W0603,C0103
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def current_profiler():
+    return _profiler
+
+
+@contextmanager
+def phase(name):
+    """ Measure a phase in the active profiler, does nothing if profiling is not active
+
+    :param name: Name of the phase
+    """
+    if _profiler is None:
+        yield
+        return
+    with _profiler.phase(name):
+        yield
+
+
+def profiled(name, function):
+    """ Wrap the function so every call is measured as the phase *name*, used for the tasks that
+    run in other threads
+
+    :param name: Name of the phase
+    :param function: The function to wrap
+    :return: The wrapped function
+    """
+    # functools.partial objects have no __name__ nor __module__ on Python 2
+    @wraps(function, [attr for attr in WRAPPER_ASSIGNMENTS if hasattr(function, attr)])
+    def wrapper(*args, **kwargs):
+        with phase(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def payload_size(values):
+    """ Approximate number of bytes of the values of a row: the length of the strings and 8 for
+    anything else
+    """
+    return sum(len(value) if isinstance(value, (bytes, type(u''))) else 8 for value in values)
+
+
+def summary_lines(metrics):
+    """ Format the metrics as a table
+
+    :param metrics: The result of Profiler.to_dict
+    :return: List of lines
+    """
+    row = u'{0:<32} {1:>9} {2:>7} {3:>9} {4:>9} {5:>11} {6:>10}'
+    res = [row.format('phase', 'seconds', 'queries', 'sql secs', 'rows', 'bytes', 'peak MB')]
+    for name, values in metrics['phases'].items():
+        res.append(row.format(
+            name, '{0:.3f}'.format(values['seconds']), values['queries'],
+            '{0:.3f}'.format(values['query_seconds']), values['rows'], values['bytes'],
+            '{0:.1f}'.format(values['peak_memory'] / 1024.0 / 1024)))
+    res.append(row.format('total', '{0:.3f}'.format(metrics['seconds']), len(metrics['queries']),
+                          '', '', '', '{0:.1f}'.format(metrics['peak_memory'] / 1024.0 / 1024)))
+    return res
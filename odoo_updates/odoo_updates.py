@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 
-import difflib
 import click
+import hashlib
 import os
-from .utils import PostgresConnector, copy_list_dicts
-import json
-import shlex
-import spur
+import threading
+from collections import OrderedDict
+from functools import partial
+from .diff import Differ
+from . import repositories
+from .metrics import phase, profiled
+from .tables import KeyedTable, masked, xml_id_of
+from .utils import PostgresConnector, copy_list_dicts, run_parallel
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
 
 
 def menu_tree(menu_id, database):
@@ -31,57 +37,99 @@ def menu_tree(menu_id, database):
     return res[0]
 
 
-def get_menus(database):
-    sql = """SELECT ir_model_data.module || '.' || ir_model_data.name AS xml_id,
-                    res_id, ir_ui_menu.name
-                FROM ir_model_data
-                JOIN ir_ui_menu ON res_id = ir_ui_menu.id
-                WHERE ir_model_data.model = 'ir.ui.menu';  """
+def menus_hierarchy(database):
+    """
+    Compute the hierarchy path of every menu in the specified database at once. All the menus
+    are read with a single query and the paths are resolved in memory with a parent map, each
+    menu is visited once because the paths of the parents are reused by their children.
+    :param database: database name to query on
+    :return: A dict with the menu id as key and its hierarchy path (parent->child) as value
+    """
+    sql = """SELECT id, parent_id, name FROM ir_ui_menu;"""
     with PostgresConnector({'dbname': database}) as conn:
-        menus = conn.execute_select(sql)
-        menus = copy_list_dicts(menus)
+        cursor = conn.execute_select(sql)
+        parents = dict((menu['id'], (menu['parent_id'], menu['name'])) for menu in cursor)
     res = dict()
-    for menu in menus:
-        res.update({
-            menu['xml_id']: menu
-        })
+    for menu_id in parents:
+        chain = list()
+        current = menu_id
+        while current in parents and current not in res and current not in chain:
+            chain.append(current)
+            current = parents[current][0]
+        path = res.get(current)
+        for chain_id in reversed(chain):
+            name = parents[chain_id][1]
+            path = name if path is None else '{0}->{1}'.format(path, name)
+            res[chain_id] = path
     return res
 
 
-def get_views(database):
+def get_menus(database, modules=None):
+    """
+    Select the menus with an xml_id, their name and their parent
+    :param database: database name to query on
+    :param modules: If given, only the menus of these modules are selected
+    :return: dict with the xml_id as key and a dict with the xml_id, res_id, name, parent_id and
+        parent_xml_id as value
+    """
+    return dict((menu['xml_id'], menu.to_dict())
+                for menu in MENUS.extract(database, modules=modules))
+
+
+def get_views(database, xml_ids=None, itersize=None, copy=False, modules=None):
     """
     Select the views contents and xml_id from the specified database.
     The xml_id is formed by joining the module name and the id_model_data name so it
     can be used for the comparison and for the report at the end.
     :param database: database name to query on
-    :return: List of dicts with the xml_id and view content
+    :param xml_ids: If given, only the views with these xml_ids are selected
+    :param itersize: If given, the rows are streamed from a server side cursor fetching this
+        many rows per round-trip and a generator is returned instead of a list
+    :param copy: If True, the rows are transferred with COPY ... TO STDOUT and parsed straight
+        into records, faster and lighter than the cursor on big tables (*itersize* is ignored)
+    :param modules: If given, only the views of these modules are selected
+    :return: List of records (see utils.Record) with the xml_id and view content
     """
-    sql = """SELECT ir_model_data.module || '.' || ir_model_data.name xml_id, arch
-        FROM ir_model_data
-        JOIN ir_ui_view ON res_id = ir_ui_view.id
-        WHERE ir_model_data.model = 'ir.ui.view'
-        ORDER BY xml_id;"""
-    with PostgresConnector({'dbname': database}) as conn:
-        cursor = conn.execute_select(sql)
-        res = copy_list_dicts(cursor)
-    return res
+    return VIEWS.extract(database, xml_ids, itersize, copy, modules)
+
+
+def get_views_fingerprints(database, modules=None):
+    """
+    Select the xml_id and the md5 of the arch of every view, the hash is computed by PostgreSQL
+    so the arch itself never leaves the database server.
+    :param database: database name to query on
+    :param modules: If given, only the views of these modules are selected
+    :return: dict with the xml_id as key and the arch md5 as value
+    """
+    return VIEWS.fingerprints(database, modules)
 
 
-def get_branches():
-    json_filename = '/tmp/branches.json'
-    branches_file = os.path.expanduser('~/backupws/branches.py')
-    instance_path = os.path.expanduser('~/instance')
-    command = 'python {branches} -s -p {instance} -f {name}'.format(name=json_filename,
-                                                                    branches=branches_file,
-                                                                    instance=instance_path)
-    shell = spur.LocalShell()
-    shell.run(shlex.split(command))
-    with open(json_filename, "r") as dest:
-        branches = json.load(dest)
-    return branches
+def get_views_write_dates(database, modules=None):
+    """
+    Select the xml_id and the last write date of every view, used as a cheap probe by the
+    incremental mode
+    :param database: database name to query on
+    :param modules: If given, only the views of these modules are selected
+    :return: dict with the xml_id as key and the write date as value
+    """
+    return VIEWS.write_dates(database, modules)
 
 
-def get_translations(database):
+def get_branches(path=None, jobs=4):
+    """
+    Get the branch, last commit and remotes of every git repository of the instance. The git
+    metadata is read directly on a pool of threads and cached by repository until its HEAD,
+    refs or config change (see repositories.repository_info)
+    :param path: Directory with the repositories, ~/instance by default
+    :param jobs: Maximum number of repositories read at the same time
+    :return: List of dicts with the path, name, branch, commit and repo_url (dict with the url
+        of every remote) of each repository, sorted by path
+    """
+    return repositories.scan(path or os.path.expanduser('~/instance'), jobs)
+
+
+def get_translations(database, ids=None, itersize=None, copy=False, modules=None, langs=None,
+                     types=None):
     """
     Select the translation values, ids, translated fields name and modules that contain those
     fields from the specified database. The translation value is needed to compare the different
@@ -89,21 +137,59 @@ def get_translations(database):
     translated field of both databases and the translated field name and modules are just to
     display more information.
     :param database: database name to query on
-    :return: List of dicts with the information obtained from the database
+    :param ids: If given, only the translations with these ids are selected
+    :param itersize: If given, the rows are streamed from a server side cursor fetching this
+        many rows per round-trip and a generator is returned instead of a list
+    :param copy: If True, the rows are transferred with COPY ... TO STDOUT and parsed straight
+        into records, faster and lighter than the cursor on big tables (*itersize* is ignored)
+    :param modules: If given, only the translations of these modules are selected
+    :param langs: If given, only the translations to these languages are selected
+    :param types: If given, only the translations of these types (model, code, ...) are selected
+    :return: List of records (see utils.Record) with the information obtained from the database
     """
-    with PostgresConnector({'dbname': database}) as conn:
-        cursor = conn.execute_select("""SELECT value,id,name,module FROM ir_translation""")
-        res = copy_list_dicts(cursor)
-    return res
+    return TRANSLATIONS.extract(database, ids, itersize, copy, modules,
+                                {'lang': langs, 'type': types})
 
 
-def get_fields(database):
+def get_translations_fingerprints(database, modules=None, langs=None, types=None):
+    """
+    Select the id and the md5 of the value of every translation, the hash is computed by
+    PostgreSQL so the value itself never leaves the database server.
+    :param database: database name to query on
+    :param modules: If given, only the translations of these modules are selected
+    :param langs: If given, only the translations to these languages are selected
+    :param types: If given, only the translations of these types (model, code, ...) are selected
+    :return: dict with the translation id as key and the value md5 as value
+    """
+    return TRANSLATIONS.fingerprints(database, modules, {'lang': langs, 'type': types})
+
+
+def get_translations_write_dates(database, modules=None, langs=None, types=None):
+    """
+    Select the id and the last write date of every translation, used as a cheap probe by the
+    incremental mode
+    :param database: database name to query on
+    :param modules: If given, only the translations of these modules are selected
+    :param langs: If given, only the translations to these languages are selected
+    :param types: If given, only the translations of these types (model, code, ...) are selected
+    :return: dict with the translation id as key and the write date as value
+    """
+    return TRANSLATIONS.write_dates(database, modules, {'lang': langs, 'type': types})
+
+
+def get_fields(database, keys=None, itersize=None, copy=False, modules=None):
     """
     Selection fields model , name , field_description, ttype,
     to create a list of fields and their values
     :param database: database name to query on
-    :return: List of dicts with the information get from database.
-     List of dicts With the information get from the database as follows
+    :param keys: If given, only the fields with these (model, name) pairs are selected
+    :param itersize: If given, the rows are streamed from a server side cursor fetching this
+        many rows per round-trip and a generator is returned instead of a list
+    :param copy: If True, the rows are transferred with COPY ... TO STDOUT and parsed straight
+        into records, faster and lighter than the cursor on big tables (*itersize* is ignored)
+    :param modules: If given, only the fields defined or extended by these modules are selected
+    :return: List of records (see utils.Record) with the information get from database.
+     Each record has the information get from the database as follows
      {'model': model ('ir.model'),
       'name': field ('field_id'),
       'description': description ('Fields')
@@ -114,280 +200,1079 @@ def get_fields(database):
      description: column that has the description of the model fields
      type: column that has the data type of model fields
     """
-    sql = """
-          select model, name, field_description as description,
-          ttype as type from ir_model_fields;
-          """
+    return FIELDS.extract(database, keys, itersize, copy, modules)
+
+
+def get_fields_fingerprints(database, modules=None):
+    """
+    Select the (model, name) pair and the md5 of the type and description of every field, the
+    hash is computed by PostgreSQL.
+    :param database: database name to query on
+    :param modules: If given, only the fields of these modules are selected
+    :return: dict with the (model, name) tuple as key and the md5 as value
+    """
+    return FIELDS.fingerprints(database, modules)
+
+
+def get_fields_write_dates(database, modules=None):
+    """
+    Select the (model, name) pair and the last write date of every field, used as a cheap probe
+    by the incremental mode
+    :param database: database name to query on
+    :param modules: If given, only the fields of these modules are selected
+    :return: dict with the (model, name) tuple as key and the write date as value
+    """
+    return FIELDS.write_dates(database, modules)
+
+
+def get_modules(database):
+    """
+    Select the state and version of every module
+    :param database: database name to query on
+    :return: dict with the module name as key and a (state, latest_version) tuple as value
+    """
     with PostgresConnector({'dbname': database}) as conn:
-        cursor = conn.execute_select(sql)
-        res = copy_list_dicts(cursor)
+        cursor = conn.execute_select('SELECT name, state, latest_version FROM ir_module_module')
+        res = dict((row['name'], (row['state'], row['latest_version'])) for row in cursor)
     return res
 
 
-def compare_views(original_views, modified_views):
+def changed_modules(original_database, modified_database):
+    """
+    Get the modules whose state or version differ between the databases: the ones updated to a
+    new version, installed or uninstalled. After a targeted update (-u some_module) only their
+    records can change, so the extractions can be filtered by them (see KeyedTable.select)
+    :param original_database: The name of the unmodified database
+    :param modified_database: The name of the updated database, or a list of them to get the
+        modules changed in any of them
+    :return: Sorted list with the module names
+    """
+    if not isinstance(modified_database, (list, tuple)):
+        modified_database = [modified_database]
+    original = get_modules(original_database)
+    res = set()
+    for database in modified_database:
+        modified = get_modules(database)
+        res.update(name for name in set(original).union(modified)
+                   if original.get(name) != modified.get(name))
+    return sorted(res)
+
+
+def changed_keys(original_fingerprints, modified_fingerprints):
+    """
+    Compare the fingerprints of two databases and return the keys whose content changed or
+    that only exist in one of them, which are the only ones worth fetching entirely.
+    :param original_fingerprints: dict with key: hash from the original database
+    :param modified_fingerprints: dict with key: hash from the modified database
+    :return: set of keys that were added, deleted or have a different hash
+    """
+    res = set(original_fingerprints).symmetric_difference(modified_fingerprints)
+    for key, fingerprint in modified_fingerprints.items():
+        if key in original_fingerprints and original_fingerprints[key] != fingerprint:
+            res.add(key)
+    return res
+
+
+# Bytes of canonical forms kept by canonical_arch, the least recently used are dropped first
+CANONICAL_CACHE_BYTES = 64 * 1024 * 1024
+
+_canonical_archs = OrderedDict()  # pylint: disable=C0103
+_canonical_lock = threading.Lock()  # pylint: disable=C0103
+_canonical_size = [0]  # pylint: disable=C0103
+
+
+def canonical_arch(arch):
+    """
+    Get the canonical form of a view arch: one element per line indented by its depth, the
+    attributes sorted by name, the whitespace of the texts collapsed, empty elements self-closed
+    and the comments dropped, so two archs that only differ in those details have the same
+    canonical form. The result is cached by the md5 of the arch (up to CANONICAL_CACHE_BYTES of
+    canonical forms) so an arch compared many times is parsed only once.
+    :param arch: The arch of the view
+    :return: A tuple with the canonical arch and its md5
+    """
+    key = hashlib.md5(arch if isinstance(arch, bytes) else arch.encode('utf-8')).digest()
+    with _canonical_lock:
+        cached = _canonical_archs.pop(key, None)
+        if cached is not None:
+            _canonical_archs[key] = cached
+            return cached
+    try:
+        root = ElementTree.fromstring(arch if isinstance(arch, bytes) else arch.encode('utf-8'))
+    except ElementTree.ParseError:
+        # Not a valid xml, compare it as it is
+        canonical = arch.strip()
+    else:
+        lines = list()
+        _canonical_lines(root, 0, lines)
+        canonical = u'\n'.join(lines)
+    cached = (canonical, hashlib.md5(
+        canonical if isinstance(canonical, bytes) else canonical.encode('utf-8')).hexdigest())
+    with _canonical_lock:
+        if key not in _canonical_archs:
+            _canonical_archs[key] = cached
+            _canonical_size[0] += len(canonical)
+        while _canonical_size[0] > CANONICAL_CACHE_BYTES:
+            dummy, (evicted, dummy) = _canonical_archs.popitem(last=False)
+            _canonical_size[0] -= len(evicted)
+    return cached
+
+
+def _canonical_text(text):
+    return escape(u' '.join(text.split())) if text else u''
+
+
+def _canonical_lines(element, level, lines):
+    indent = u'    ' * level
+    tag = u'{0}{1}'.format(element.tag, u''.join(
+        u' {0}={1}'.format(name, quoteattr(value))
+        for name, value in sorted(element.attrib.items())))
+    text = _canonical_text(element.text)
+    if not len(element):
+        lines.append(u'{0}<{1}>{2}</{3}>'.format(indent, tag, text, element.tag) if text else
+                     u'{0}<{1}/>'.format(indent, tag))
+        return
+    lines.append(u'{0}<{1}>'.format(indent, tag))
+    if text:
+        lines.append(indent + u'    ' + text)
+    for child in element:
+        _canonical_lines(child, level + 1, lines)
+        tail = _canonical_text(child.tail)
+        if tail:
+            lines.append(indent + u'    ' + tail)
+    lines.append(u'{0}</{1}>'.format(indent, element.tag))
+
+
+def compare_views(original_views, modified_views, original_index=None):
     """
     Compare all the views from views_prod with the views_updates and returns a proper report
     :param original_views: This would be the views from production database (a copy of course)
     :param modified_views: This is are the views from the copy with
         all changes applied (-u all, -u app_module).
-    :return: a dict with the added and updated views. In the case of updated will return the diff
-        between the org_database and dst_database
+    :param original_index: The original views by xml_id, if given it is used instead of
+        indexing them again (the same original compared with many databases)
+    :return: a dict with the added, updated and deleted views. In the case of updated will return
+        the diff between the org_database and dst_database. The archs that differ are compared by
+        their canonical form (see canonical_arch) so only the real changes are reported, with
+        the canonical archs as original and modified
     """
-    pchecked = list()
-    res = {
-        'updated': list(),
-        'added': list()
-    }
-    for view_modified in modified_views:
-        for index, view_original in enumerate(original_views):
-            if view_original['xml_id'] == view_modified['xml_id'] and index not in pchecked:
-                if view_original['arch'] != view_modified['arch']:
-                    res.get('updated').append({
-                        'xml_id': view_original['xml_id'],
-                        'original': view_original['arch'],
-                        'modified': view_modified['arch']
-                    })
-                pchecked.append(index)
-                break
-        else:
-            res.get('added').append(view_modified)
-    return res
+    return VIEWS.compare(original_views, modified_views, original_index)
 
 
-def compare_translations(original_translations, modified_translations):
+def compare_translations(original_translations, modified_translations, original_index=None):
     """
     Compare all the translated fields from two databases and returns a proper report
     :param original_translations: The translations contained in the production
         database (copy of course).
     :param modified_translations: The translations contained in the updates database with all the
         changes that will be applied in the production database.
+    :param original_index: The original translations by id, if given it is used instead of
+        indexing them again (the same original compared with many databases)
     :return: A dict with the added, updated and removed translations between the production
         database and the updates database.
     """
-    checked = list()
-    res = {
-        'updated': list(),
-        'added': list(),
-        'deleted': list()
-    }
-    for modified_translation in modified_translations:
-        for original_translation in original_translations:
-            if original_translation['id'] == modified_translation['id']:
-                checked.append(original_translation)
-                if original_translation['value'] != modified_translation['value']:
-                    res.get('updated').append({
-                        'name': original_translation['name'],
-                        'module': original_translation['module'],
-                        'original': original_translation['value'],
-                        'modified': modified_translation['value']
-                    })
-                break
-        else:
-            res.get('added').append({
-                'name': modified_translation['name'],
-                'module': modified_translation['module'],
-                'value': modified_translation['value']
-            })
-    for original_translation in original_translations:
-        if original_translation not in checked:
-            res.get('deleted').append({
-                'name': original_translation['name'],
-                'module': original_translation['module'],
-                'value': original_translation['value'],
-            })
-    return res
+    return TRANSLATIONS.compare(original_translations, modified_translations,
+                                original_index)
 
 
-def compare_fields(original_fields, modified_fields):
+def compare_fields(original_fields, modified_fields, original_index=None):
     """
     compares the fields of tables in a database and returns the direfencias
     :param original_fields: This would be the fields from the point of
      view of production database
     :modified_fields: This are the changes made in the fields of
     the database, the argument after the -u (-u all, -u app_module).
+    :param original_index: The original fields by (model, name), if given it is used instead of
+        indexing them again (the same original compared with many databases)
     :return: a dict with the added, updated and deleted fields.
     In the case of updated will return the diff between the org_database
     and dst_database
     """
-    res = {
-        'updated': list(), 'added': list(), 'deleted': list(),
-    }
-    records_updates = list()
-    for modified in modified_fields:
-        for original in original_fields:
-            if modified['model'] == original['model']\
-               and modified['name'] == original['name']:
-                if modified['type'] != original['type']\
-                   or modified['description']\
-                   != original['description']:
-                    records_updates.append(original)
-                    records_updates.append(modified)
-                    updated = {'model': original['model'],
-                               'name': original['name'],
-                               'original': {'type': original['type'],
-                                            'description':
-                                            original['description']},
-                               'modified': {'type': modified['type'],
-                                            'description':
-                                            modified['description']},
-                               }
-                    res.get('updated').append(updated)
-    for original in original_fields:
-        if original not in modified_fields and original not in records_updates:
-            res.get('deleted').append(original)
-
-    for modified in modified_fields:
-        if modified not in original_fields and modified not in records_updates:
-            res.get('added').append(modified)
+    return FIELDS.compare(original_fields, modified_fields, original_index)
+
+
+def group_by_model(fields):
+    """
+    Group a list of fields (as returned in any state of compare_fields) by model, keeping the
+    order in which each model and field first appeared
+    :param fields: List of dicts with at least the model key
+    :return: An OrderedDict with the model name as key and the list of its fields as value
+    """
+    res = OrderedDict()
+    for field in fields:
+        res.setdefault(field.get('model'), list()).append(field)
     return res
 
 
-def get_fields_diff(original_database, modified_database):
-    original_fields = get_fields(original_database)
-    modified_fields = get_fields(modified_database)
-    res = compare_fields(original_fields, modified_fields)
+def get_keyed_diff(domain, original_database, modified_database, fingerprint=False,
+                   itersize=None, cache=None, incremental=None, jobs=4, copy=False,
+                   modules=None, filters=None, partition=None):
+    """
+    Receive the databases names and return a dict with the added, updated and deleted records
+    of one of the KEYED_DOMAINS (see tables.KeyedTable)
+    :param domain: Name of the domain: views, translations, fields, access, rules, ...
+    :param original_database: The name of the unmodified database
+    :param modified_database: The name of the updated database, or a list of them to get the
+        result of each one (see candidates_diff)
+    :param fingerprint: If True, the md5 of the compared columns of every record is fetched
+        first and then only the records that differ or exist in one side are fetched entirely
+    :param itersize: If given, the rows are streamed from server side cursors fetching this many
+        rows per round-trip, the modified rows are compared as they arrive
+    :param cache: If given (a cache.SnapshotCache), the data of the original database is read
+        from the snapshot taken by a previous run if its tables did not change since then
+    :param incremental: If given (a cache.IncrementalStore), both databases are extracted
+        incrementally: only the rows written since the last run are fetched
+    :param jobs: Maximum number of candidates extracted and compared at the same time
+    :param copy: If True, the rows are transferred with COPY instead of a cursor
+    :param modules: If given, only the records of these modules are compared, the filter is
+        applied by the queries (see changed_modules)
+    :param filters: dict with the values allowed for some of the filter columns of the domain
+        (see tables.KeyedTable), e.g. {'lang': ['es_MX']}, also applied by the queries
+    :param partition: Name of a filter column, if given the records are extracted and compared
+        one value of it at a time (see partitioned_diff)
+    :return: dict with the added, updated and deleted records
+    """
+    if partition is not None:
+        return partitioned_diff(domain, partition, original_database, modified_database,
+                                fingerprint, itersize, cache, incremental, jobs, copy, modules,
+                                filters)
+    if isinstance(modified_database, (list, tuple)):
+        return candidates_diff(domain, original_database, modified_database, fingerprint,
+                               itersize, cache, incremental, jobs, copy, modules, filters)
+    table = KEYED_DOMAINS[domain]
+    if incremental is not None:
+        with phase(domain + '.original'):
+            original = incremental_extract(incremental, original_database, domain, itersize,
+                                           copy, modules, filters)
+        with phase(domain + '.modified'):
+            modified = incremental_extract(incremental, modified_database, domain, itersize,
+                                           copy, modules, filters)
+        with phase(domain + '.compare'):
+            return table.compare(original, modified)
+    keys = None
+    if fingerprint:
+        with phase(domain + '.fingerprints'):
+            keys = changed_keys(
+                original_snapshot(cache, original_database, domain + '.fingerprints',
+                                  partial(table.fingerprints, original_database, modules,
+                                          filters), modules=modules, filters=filters),
+                table.fingerprints(modified_database, modules, filters))
+    # The comparison walks the original rows twice so they are kept in memory, the modified ones
+    # are walked once and can be consumed straight from the stream
+    with phase(domain + '.original'):
+        original = original_snapshot(
+            cache, original_database, domain,
+            partial(extract_all, partial(table.extract, filters=filters), original_database,
+                    keys, itersize, copy, modules), keys, modules, filters)
+    with phase(domain + '.modified'):
+        modified = table.extract(modified_database, keys, itersize, copy, modules, filters)
+    with phase(domain + '.compare'):
+        res = table.compare(original, modified, original_index(cache, table, original))
     return res
 
 
-def get_views_diff(original_database, modified_database):
+def get_fields_diff(original_database, modified_database, fingerprint=False, itersize=None,
+                    cache=None, incremental=None, jobs=4, copy=False, modules=None):
+    """
+    Receive the databases names, get the fields and return a dict with the added, updated and
+    deleted fields.
+    :param original_database: The name of the unmodified database
+    :param modified_database: The name of the updated database, or a list of them to get the
+        result of each one (see candidates_diff)
+    :param fingerprint: If True, only the fields whose fingerprint differs are fetched entirely
+    :param itersize: If given, the rows are streamed from server side cursors fetching this many
+        rows per round-trip, the modified rows are compared as they arrive
+    :param cache: If given (a cache.SnapshotCache), the data of the original database is read
+        from the snapshot taken by a previous run if its tables did not change since then
+    :param incremental: If given (a cache.IncrementalStore), both databases are extracted
+        incrementally: only the rows written since the last run are fetched
+    :param jobs: Maximum number of candidates extracted and compared at the same time
+    :param copy: If True, the rows are transferred with COPY instead of a cursor (see
+        get_fields)
+    :param modules: If given, only the records of these modules are compared (see
+        changed_modules)
+    :return: dict with the added, updated and deleted fields
+    """
+    return get_keyed_diff('fields', original_database, modified_database, fingerprint, itersize,
+                          cache, incremental, jobs, copy, modules)
+
+
+def get_views_diff(original_database, modified_database, fingerprint=False, itersize=None,
+                   cache=None, incremental=None, jobs=4, copy=False, modules=None):
     """
     Receive the databases names, get the views and return a dict with the original and
         corresponding modified view in case of a modification or the new view in case of an
         addition
     :param original_database: The name of the unmodified database
-    :param modified_database: The name of the updated database
+    :param modified_database: The name of the updated database, or a list of them to get the
+        result of each one (see candidates_diff)
+    :param fingerprint: If True, the (xml_id, md5(arch)) pairs are fetched first and then only
+        the archs of the views that differ or exist in one side are fetched
+    :param itersize: If given, the rows are streamed from server side cursors fetching this many
+        rows per round-trip, the modified rows are compared as they arrive
+    :param cache: If given (a cache.SnapshotCache), the data of the original database is read
+        from the snapshot taken by a previous run if its tables did not change since then
+    :param incremental: If given (a cache.IncrementalStore), both databases are extracted
+        incrementally: only the rows written since the last run are fetched
+    :param jobs: Maximum number of candidates extracted and compared at the same time
+    :param copy: If True, the rows are transferred with COPY instead of a cursor (see
+        get_views)
+    :param modules: If given, only the records of these modules are compared (see
+        changed_modules)
     :return:
     """
-    original_views = get_views(original_database)
-    modified_views = get_views(modified_database)
-    res = compare_views(original_views, modified_views)
-    return res
+    return get_keyed_diff('views', original_database, modified_database, fingerprint, itersize,
+                          cache, incremental, jobs, copy, modules)
 
 
-def get_translations_diff(original_database, modified_database):
+def get_translations_diff(original_database, modified_database, fingerprint=False,
+                          itersize=None, cache=None, incremental=None, jobs=4, copy=False,
+                          modules=None, langs=None, types=None, partition=None):
     """
     Receive the databases names, get the translations and return a dict with the added,
     modified and removed translations.
     :param original_database: The name of the unmodified database.
-    :param modified_database: The name of the updated database.
+    :param modified_database: The name of the updated database, or a list of them to get the
+        result of each one (see candidates_diff).
+    :param fingerprint: If True, the (id, md5(value)) pairs are fetched first and then only the
+        translations that differ or exist in one side are fetched.
+    :param itersize: If given, the rows are streamed from server side cursors fetching this many
+        rows per round-trip, the modified rows are compared as they arrive
+    :param cache: If given (a cache.SnapshotCache), the data of the original database is read
+        from the snapshot taken by a previous run if its tables did not change since then
+    :param incremental: If given (a cache.IncrementalStore), both databases are extracted
+        incrementally: only the rows written since the last run are fetched
+    :param jobs: Maximum number of candidates extracted and compared at the same time
+    :param copy: If True, the rows are transferred with COPY instead of a cursor (see
+        get_translations)
+    :param modules: If given, only the records of these modules are compared (see
+        changed_modules)
+    :param langs: If given, only the translations to these languages are selected
+    :param types: If given, only the translations of these types (model, code, ...) are selected
+    :param partition: lang or module to extract and compare the translations one language or
+        module at a time, so the memory is bounded by the biggest one (see partitioned_diff)
     :return: dict with the added, modified and removed translations.
     """
-    original_translations = get_translations(original_database)
-    modified_translations = get_translations(modified_database)
-    res = compare_translations(original_translations, modified_translations)
-    return res
+    return get_keyed_diff('translations', original_database, modified_database, fingerprint,
+                          itersize, cache, incremental, jobs, copy, modules,
+                          {'lang': langs, 'type': types}, partition)
 
 
-def get_menus_diff(original_database, modified_database):
-    original_menus = get_menus(original_database)
-    modified_menus = get_menus(modified_database)
+def get_menus_diff(original_database, modified_database, cache=None, jobs=4, modules=None):
+    """
+    Receive the databases names, get the menus and return a dict with the added, updated (renamed),
+    moved (different parent) and deleted menus. The hierarchy path of every menu is computed
+    once per database and reused for all the menus in the report.
+    :param original_database: The name of the unmodified database
+    :param modified_database: The name of the updated database, or a list of them to get the
+        result of each one (see candidates_diff)
+    :param cache: If given (a cache.SnapshotCache), the data of the original database is read
+        from the snapshot taken by a previous run if its tables did not change since then
+    :param jobs: Maximum number of candidates extracted and compared at the same time
+    :param modules: If given, only the menus of these modules are compared, the hierarchy paths
+        are computed with all of them
+    :return: dict with the added, updated, moved and deleted menus
+    """
+    with phase('menus.original'):
+        original_menus = original_snapshot(cache, original_database, 'menus',
+                                           partial(get_menus, original_database, modules),
+                                           modules=modules)
+        original_paths = original_snapshot(cache, original_database, 'menus.hierarchy',
+                                           partial(menus_hierarchy, original_database))
+
+    def candidate(database):
+        with phase('menus.modified'):
+            modified_menus = get_menus(database, modules)
+            modified_paths = menus_hierarchy(database)
+        with phase('menus.compare'):
+            return compare_menus(original_menus, modified_menus, original_paths, modified_paths)
+    if isinstance(modified_database, (list, tuple)):
+        return OrderedDict(zip(modified_database, run_parallel(
+            [(candidate, (database,)) for database in modified_database], jobs)))
+    return candidate(modified_database)
+
+
+def compare_menus(original_menus, modified_menus, original_paths, modified_paths):
+    """
+    Compare the menus of two databases and returns a proper report
+    :param original_menus: The menus of the original database, as returned by get_menus
+    :param modified_menus: The menus of the updated database, as returned by get_menus
+    :param original_paths: The hierarchy paths of the original database (see menus_hierarchy)
+    :param modified_paths: The hierarchy paths of the updated database (see menus_hierarchy)
+    :return: dict with the added, updated, moved and deleted menus
+    """
     res = {
         'updated': list(),
         'added': list(),
-        'deleted': list()
+        'deleted': list(),
+        'moved': list()
     }
 
     for uxml_id, urecord in modified_menus.items():
-        if uxml_id in original_menus \
-                and original_menus[uxml_id]['name'] != urecord['name']:
-            menu = menu_tree(urecord['res_id'], modified_database)
+        hierarchypath = modified_paths.get(urecord['res_id'])
+        precord = original_menus.get(uxml_id)
+        if precord is None:
+            res['added'].append({
+                'xml_id': uxml_id,
+                'name': urecord['name'],
+                'hierarchypath': hierarchypath
+            })
+            continue
+        if precord['name'] != urecord['name']:
             res['updated'].append({
                 'xml_id': uxml_id,
-                'original': original_menus[uxml_id]['name'],
+                'original': precord['name'],
                 'modified': urecord['name'],
-                'hierarchypath': menu['hierarchypath']
+                'hierarchypath': hierarchypath
             })
-        if uxml_id not in original_menus:
-            menu = menu_tree(urecord['res_id'], modified_database)
-            res['added'].append({
+        if precord['parent_xml_id'] != urecord['parent_xml_id']:
+            res['moved'].append({
                 'xml_id': uxml_id,
                 'name': urecord['name'],
-                'hierarchypath': menu['hierarchypath']
+                'original': original_paths.get(precord['res_id']),
+                'modified': hierarchypath,
+                'hierarchypath': hierarchypath
             })
     for pxml_id, precord in original_menus.items():
         if pxml_id not in modified_menus:
-            menu = menu_tree(precord['res_id'], original_database)
             res['deleted'].append({
                 'xml_id': precord['xml_id'],
                 'name': precord['name'],
-                'hierarchypath': menu['hierarchypath']
+                'hierarchypath': original_paths.get(precord['res_id'])
             })
+    return res
 
+
+def get_all_diff(original_database, modified_database, fingerprint=False, itersize=None,
+                 jobs=4, cache=None, incremental=None, copy=False, modules=None, langs=None,
+                 types=None):
+    """
+    Get the views, menus, translations, fields and branches report at once. The extractions are
+    independent so they run concurrently on at most *jobs* threads (both databases at the same
+    time), the comparisons are done once all of them finished.
+    :param original_database: The name of the unmodified database
+    :param modified_database: The name of the updated database, or a list of them to get the
+        result of each one (see candidates_diff)
+    :param fingerprint: If True, only the records whose fingerprint differs are fetched entirely
+    :param itersize: If given, the rows are fetched from server side cursors this many at once
+    :param jobs: Maximum number of extractions running at the same time
+    :param cache: If given (a cache.SnapshotCache), the data of the original database is read
+        from the snapshot taken by a previous run if its tables did not change since then
+    :param incremental: If given (a cache.IncrementalStore), both databases are extracted
+        incrementally: only the rows written since the last run are fetched
+    :param copy: If True, the views, translations and fields are transferred with COPY
+    :param modules: If given, only the records of these modules are compared (see
+        changed_modules)
+    :param langs: If given, only the translations to these languages are compared
+    :param types: If given, only the translations of these types are compared
+    :return: dict with the views, menus, translations, fields and branches reports, or with
+        many modified databases an OrderedDict with that dict for each one
+    """
+    if isinstance(modified_database, (list, tuple)):
+        # The candidates of every domain are compared in parallel, the domains one after the
+        # other so the original is extracted once per domain
+        states = dict((domain, function(original_database, modified_database, fingerprint,
+                                        itersize, cache, incremental, jobs, copy, modules))
+                      for domain, function in (
+                          ('views', get_views_diff),
+                          ('translations', partial(get_translations_diff, langs=langs,
+                                                   types=types)),
+                          ('fields', get_fields_diff)))
+        states['menus'] = get_menus_diff(original_database, modified_database, cache, jobs,
+                                         modules)
+        with phase('branches'):
+            branches = get_branches()
+        return OrderedDict((database, dict(
+            [(domain, states[domain][database]) for domain in states] +
+            [('branches', branches)])) for database in modified_database)
+    databases = (original_database, modified_database)
+    filters = {'translations': {'lang': langs, 'type': types}}
+
+    def task(database, domain, extract, keys=None):
+        # The phase of the menus includes their hierarchy, the fingerprints of both databases
+        # are measured together
+        name, dummy, qualifier = domain.partition('.')
+        name += '.fingerprints' if qualifier == 'fingerprints' else \
+            '.original' if database == original_database else '.modified'
+        if incremental is not None and domain in KEYED_DOMAINS:
+            return profiled(name, incremental_extract), (incremental, database, domain, itersize,
+                                                         copy, modules, filters.get(domain))
+        if database == original_database:
+            return profiled(name, original_snapshot), (cache, database, domain, extract, keys,
+                                                       modules, filters.get(domain.split('.')[0]))
+        return profiled(name, extract), ()
+
+    keys = dict.fromkeys(('views', 'translations', 'fields'))
+    if fingerprint and incremental is None:
+        fingerprints = run_parallel(
+            [task(database, 'views.fingerprints',
+                  partial(get_views_fingerprints, database, modules))
+             for database in databases] +
+            [task(database, 'translations.fingerprints',
+                  partial(get_translations_fingerprints, database, modules, langs, types))
+             for database in databases] +
+            [task(database, 'fields.fingerprints',
+                  partial(get_fields_fingerprints, database, modules))
+             for database in databases], jobs)
+        keys['views'] = changed_keys(*fingerprints[0:2])
+        keys['translations'] = changed_keys(*fingerprints[2:4])
+        keys['fields'] = changed_keys(*fingerprints[4:6])
+    tasks = list()
+    for database in databases:
+        tasks.extend([
+            task(database, 'views', partial(extract_all, get_views, database, keys['views'],
+                                            itersize, copy, modules), keys['views']),
+            task(database, 'translations',
+                 partial(extract_all, partial(get_translations, langs=langs, types=types),
+                         database, keys['translations'], itersize, copy, modules),
+                 keys['translations']),
+            task(database, 'fields', partial(extract_all, get_fields, database, keys['fields'],
+                                             itersize, copy, modules), keys['fields']),
+            task(database, 'menus', partial(get_menus, database, modules)),
+            task(database, 'menus.hierarchy', partial(menus_hierarchy, database)),
+        ])
+    tasks.append((profiled('branches', get_branches), ()))
+    extracted = run_parallel(tasks, jobs)
+    original, modified, branches = extracted[0:5], extracted[5:10], extracted[10]
+    res = {'branches': branches}
+    with phase('views.compare'):
+        res['views'] = compare_views(original[0], modified[0])
+    with phase('translations.compare'):
+        res['translations'] = compare_translations(original[1], modified[1])
+    with phase('fields.compare'):
+        res['fields'] = compare_fields(original[2], modified[2])
+    with phase('menus.compare'):
+        res['menus'] = compare_menus(original[3], modified[3], original[4], modified[4])
     return res
 
 
-def diff_to_screen(views_states, title):
-    for state, values in views_states.iteritems():
-        click.secho('+ {state} {title}'.format(state=state.title(), title=title), fg='yellow')
-        for view in values:
-            if state == 'updated':
-                diff = difflib.unified_diff(
-                    view['original'].split('\n'),
-                    view['modified'].split('\n')
-                )
-            elif title == 'Translations':
-                diff = view.get('value').split('\\n')
+def candidates_diff(domain, original_database, modified_databases, fingerprint=False,
+                    itersize=None, cache=None, incremental=None, jobs=4, copy=False,
+                    modules=None, filters=None):
+    """
+    Compare the original database with many modified ones (candidates) for one of the
+    KEYED_DOMAINS. The original is extracted and indexed once and shared by all the comparisons,
+    the candidates are extracted and compared in parallel. With *fingerprint* the original rows
+    changed in any candidate are fetched at once and every candidate is compared with its own
+    changed ones
+    :param domain: Name of one of the KEYED_DOMAINS
+    :param original_database: The name of the unmodified database
+    :param modified_databases: The names of the updated databases
+    :param jobs: Maximum number of candidates extracted and compared at the same time
+    :return: OrderedDict with the result of every candidate by database name
+    """
+    table = KEYED_DOMAINS[domain]
+    extractor = partial(table.extract, filters=filters)
+    get_fingerprints = partial(table.fingerprints, filters=filters)
+    record_key = table.record_key
+    keys = dict.fromkeys(modified_databases)
+    if incremental is not None:
+        with phase(domain + '.original'):
+            original = incremental_extract(incremental, original_database, domain, itersize,
+                                           copy, modules, filters)
+    else:
+        all_keys = None
+        if fingerprint:
+            with phase(domain + '.fingerprints'):
+                original_fingerprints = original_snapshot(
+                    cache, original_database, domain + '.fingerprints',
+                    partial(get_fingerprints, original_database, modules), modules=modules,
+                    filters=filters)
+                fingerprints = run_parallel([(get_fingerprints, (database, modules))
+                                             for database in modified_databases], jobs)
+            for database, modified_fingerprints in zip(modified_databases, fingerprints):
+                keys[database] = changed_keys(original_fingerprints, modified_fingerprints)
+            all_keys = set().union(*keys.values())
+        with phase(domain + '.original'):
+            original = original_snapshot(
+                cache, original_database, domain,
+                partial(extract_all, extractor, original_database, all_keys, itersize, copy,
+                        modules), all_keys, modules, filters)
+    index = original_index(None if incremental is not None else cache, table, original)
+
+    def candidate(database):
+        with phase(domain + '.modified'):
+            if incremental is not None:
+                modified = incremental_extract(incremental, database, domain, itersize, copy,
+                                               modules, filters)
             else:
-                diff = view.get('arch' if 'arch' in view else 'name').split('\\n')
-            xml_id = view.get('xml_id' if 'xml_id' in view else 'name')
-            click.secho('+++ {title} {xml_id}'.format(title=title, xml_id=xml_id),
-                        fg='yellow')
-            if 'hierarchypath' in view:
-                click.secho('++++ Check it in: {hi}'.format(hi=view.get('hierarchypath')),
-                            fg='yellow')
-            for line in diff:
-                if line.startswith('+'):
-                    click.secho(line, fg='green')
-                elif line.startswith('-'):
-                    click.secho(line, fg='red')
-                else:
-                    click.secho(line)
-
-
-def fields_to_screen(fields_states, title):
-    show_model_field = dict()
-    for state, values in fields_states.iteritems():
-        click.secho('+ {state} {title}'.
-                    format(state=state.title(), title=title), fg='yellow')
-        for field in values:
-            if state == 'updated':
-                diff = {'type': list(difflib.unified_diff(
-                        field['original'].get('type', '').split('\n'),
-                        field['modified'].get('type', '').split('\n'))),
-                        'description': list(difflib.unified_diff(
-                            field['original']
-                            .get('description', '').split('\n'),
-                            field['modified']
-                            .get('description', '').split('\n'))), }
+                modified = extractor(database, keys[database], itersize, copy, modules)
+        with phase(domain + '.compare'):
+            candidate_original = original
+            if keys[database] is not None:
+                candidate_original = [record for record in original
+                                      if record_key(record) in keys[database]]
+            return table.compare(candidate_original, modified, index)
+    return OrderedDict(zip(modified_databases, run_parallel(
+        [(candidate, (database,)) for database in modified_databases], jobs)))
+
+
+def extract_all(extractor, database, keys, itersize, copy=False, modules=None):
+    """
+    Call the extractor and make sure all the records are fetched (streams are consumed)
+    :return: List of records
+    """
+    return list(extractor(database, keys, itersize, copy, modules))
+
+
+def active_filters(filters):
+    """
+    Get the filters that restrict the records, as a sorted list of (column, sorted values) so it
+    can be part of a cache key
+    """
+    return sorted((column, sorted(values)) for column, values in (filters or dict()).items()
+                  if values is not None)
+
+
+def partitioned_diff(domain, partition, original_database, modified_database, fingerprint=False,
+                     itersize=None, cache=None, incremental=None, jobs=4, copy=False,
+                     modules=None, filters=None):
+    """
+    Extract and compare the records of one of the KEYED_DOMAINS one partition at a time, a
+    partition being the records with the same value in one of its filter columns (e.g. the
+    translations to one language). Only the records of *jobs* partitions are in memory at the
+    same time, with jobs=1 the peak memory is bounded by the biggest partition instead of the
+    whole table. A record moved to another partition (e.g. its module changed) is reported as
+    deleted from one and added to the other
+    :param domain: Name of one of the KEYED_DOMAINS
+    :param partition: Name of the filter column the records are partitioned by, e.g. lang
+    :param jobs: Maximum number of partitions extracted and compared at the same time
+    The other parameters are the ones of get_keyed_diff
+    :return: The result of get_keyed_diff with the records of all the partitions
+    """
+    table = KEYED_DOMAINS[domain]
+    candidates = isinstance(modified_database, (list, tuple))
+    databases = [original_database] + (list(modified_database) if candidates else
+                                       [modified_database])
+    with phase(domain + '.partitions'):
+        values = set().union(*run_parallel(
+            [(table.partition_values, (database, partition, modules, filters))
+             for database in databases], jobs))
+    # None can not be sorted with the strings on Python 3
+    values = sorted(values, key=lambda value: (value is not None, value))
+    results = run_parallel(
+        [(get_keyed_diff, (domain, original_database, modified_database, fingerprint, itersize,
+                           cache, incremental, 1, copy, modules,
+                           dict(filters or dict(), **{partition: [value]})))
+         for value in values], jobs)
+
+    def merge(partition_results):
+        res = {
+            'updated': list(),
+            'added': list(),
+            'deleted': list()
+        }
+        for result in partition_results:
+            for state, records in result.items():
+                res[state].extend(records)
+        return res
+    if candidates:
+        return OrderedDict((database, merge(result[database] for result in results))
+                           for database in modified_database)
+    return merge(results)
+
+
+def original_snapshot(cache, database, domain, extract, keys=None, modules=None, filters=None):
+    """
+    Call *extract* through the snapshot cache, if there is one, so the data of the original
+    database is extracted only when the tables of the domain changed since the last run
+    :param cache: A cache.SnapshotCache or None to always extract
+    :param database: The name of the original database
+    :param domain: What is extracted, a key of SNAPSHOT_TABLES optionally followed by a dot and
+        a qualifier (e.g. views.fingerprints)
+    :param extract: Callable without arguments that returns the data
+    :param keys: The keys the extraction is filtered by, if any
+    :param modules: The modules the extraction is filtered by, if any
+    :param filters: The filters the extraction is filtered by, if any
+    :return: The extracted or cached data
+    """
+    if cache is None:
+        return extract()
+    tables = SNAPSHOT_TABLES[domain.split('.')[0]]
+    key = (domain, sorted(keys) if keys is not None else None)
+    if modules is not None:
+        key += (sorted(modules),)
+    if active_filters(filters):
+        key += (active_filters(filters),)
+    return cache.snapshot(database, tables, key, extract)
+
+
+def original_index(cache, table, records):
+    """
+    Index the original records by key, through the cache if there is one so a long running
+    process (see cache.MemorySnapshotCache) indexes the snapshot kept in memory only once
+    :param cache: A cache.SnapshotCache or None
+    :param table: The tables.KeyedTable of the records
+    :param records: The original records, as returned by original_snapshot
+    :return: dict with the records by key
+    """
+    def build(data):
+        return dict((table.record_key(record), record) for record in data)
+    if cache is None:
+        return build(records)
+    return cache.index(records, build)
+
+
+def transaction_horizon(database):
+    """
+    Get the start of the oldest transaction running on the database, or now() if there is none.
+    Odoo writes now() (the start of the transaction) as write_date, so the rows a transaction
+    still running will commit have a write_date at least this old. Only the transactions of
+    the connected role are seen unless it is superuser or member of pg_read_all_stats
+    :param database: database name to query on
+    :return: naive UTC datetime, as the write_date of the records
+    """
+    with PostgresConnector({'dbname': database}) as conn:
+        res = conn.execute_select(
+            """SELECT least(now(), min(xact_start)) AT TIME ZONE 'UTC' FROM pg_stat_activity
+            WHERE datname = current_database()""").fetchone()[0]
+    return res
+
+
+def incremental_extract(store, database, domain, itersize=None, copy=False, modules=None,
+                        filters=None):
+    """
+    Get all the records of the domain fetching only the ones written since the last run. The
+    key and write date of every row are probed first: the rows written after the stored
+    high-water mark or whose key is new are fetched, the keys that are gone are removed, and the
+    result is merged with the records stored by the last run (the first run fetches everything).
+    The mark is never later than the start of the oldest transaction running at the probe (see
+    transaction_horizon), so the rows it commits afterwards are not missed. Only when it is
+    that start the rows written at the mark itself are fetched again
+    :param store: A cache.IncrementalStore
+    :param database: database name to query on
+    :param domain: Name of one of the KEYED_DOMAINS, its table must have write and create dates
+    :param itersize: If given, the changed rows are fetched with a server side cursor
+    :param copy: If True, the changed rows are transferred with COPY
+    :param modules: If given, only the records of these modules are returned. The records of
+        other modules are dropped from the store and fetched again by a later run without filter
+    :param filters: If given, only the records allowed by these filters are returned. Every
+        combination of filters (e.g. every partition) has its own state in the store
+    :return: List of records sorted by key, as the extractor would return them
+    """
+    table = KEYED_DOMAINS[domain]
+    # Taken before the probe: a transaction not committed yet may commit rows dated before the
+    # max write_date seen, the next run must fetch them again
+    horizon = transaction_horizon(database)
+    write_dates = table.write_dates(database, modules, filters)
+    name = (domain, active_filters(filters)) if active_filters(filters) else domain
+    state = store.state(database, name) or {'hwm': None, 'records': dict()}
+    hwm, records = state['hwm'], state['records']
+    # A mark below the horizon is the write date of rows all committed at the last run (a
+    # transaction running then started after it), the rows written at it are not fetched again.
+    # A mark capped at the horizon may have rows written in that same instant committed later
+    strict = state.get('strict', False)
+    for key in set(records).difference(write_dates):
+        del records[key]
+    changed = None
+    if records:
+        changed = set(key for key, write_date in write_dates.items()
+                      if key not in records or hwm is None or write_date is None or
+                      write_date > hwm or (write_date == hwm and not strict))
+    for record in table.extract(database, changed, itersize, copy, modules, filters):
+        records[table.record_key(record)] = record
+    dates = [write_date for write_date in write_dates.values() if write_date is not None]
+    if dates:
+        hwm = min(max(dates), horizon)
+        strict = max(dates) < horizon
+    store.save(database, name, {'hwm': hwm, 'strict': strict, 'records': records})
+    return [records[key] for key in sorted(records)]
+
+
+VIEWS = KeyedTable(
+    'views', 'ir_ui_view', key=('xml_id',), compared=('arch',), model='ir.ui.view',
+    columns=[('arch', 'ir_ui_view.arch')], ordered=True, canonical={'arch': canonical_arch})
+
+TRANSLATIONS = KeyedTable(
+    'translations', 'ir_translation', key=('id',), compared=('value',), labels=('name', 'module'),
+    columns=[('value', 'ir_translation.value'), ('id', 'ir_translation.id'),
+             ('name', 'ir_translation.name'), ('module', 'ir_translation.module')],
+    interned=('name', 'module'), module_filter='ir_translation.module = ANY(%s)',
+    filters={'lang': 'ir_translation.lang', 'type': 'ir_translation.type',
+             'module': 'ir_translation.module'})
+
+FIELDS = KeyedTable(
+    'fields', 'ir_model_fields', key=('model', 'name'), compared=('type', 'description'),
+    columns=[('model', 'ir_model_fields.model'), ('name', 'ir_model_fields.name'),
+             ('description', 'ir_model_fields.field_description'),
+             ('type', 'ir_model_fields.ttype')],
+    interned=('model', 'type'), depends=('ir_model_data',),
+    # Every module that defines or extends a field has an xml_id for it
+    module_filter="EXISTS (SELECT 1 FROM ir_model_data AS field_data "
+                  "WHERE field_data.model = 'ir.model.fields' "
+                  "AND field_data.res_id = ir_model_fields.id AND field_data.module = ANY(%s))")
+
+# The menus are compared by compare_menus, their hierarchy is needed to report them
+MENUS = KeyedTable(
+    'menus', 'ir_ui_menu', key=('xml_id',), compared=('name', 'parent_xml_id'), model='ir.ui.menu',
+    columns=[('res_id', 'ir_model_data.res_id'), ('name', 'ir_ui_menu.name'),
+             ('parent_id', 'ir_ui_menu.parent_id'),
+             ('parent_xml_id', "parent_data.module || '.' || parent_data.name")],
+    joins="LEFT JOIN ir_model_data AS parent_data ON parent_data.model = 'ir.ui.menu' "
+          "AND parent_data.res_id = ir_ui_menu.parent_id")
+
+PERMISSIONS = ('perm_read', 'perm_write', 'perm_create', 'perm_unlink')
+
+ACCESS = KeyedTable(
+    'access', 'ir_model_access', key=('xml_id',),
+    compared=('name', 'model', 'group') + PERMISSIONS + ('active',), model='ir.model.access',
+    columns=[('name', 'ir_model_access.name'),
+             ('model', '(SELECT ir_model.model FROM ir_model '
+                       'WHERE ir_model.id = ir_model_access.model_id)'),
+             ('group', xml_id_of('res.groups', 'ir_model_access.group_id'))] +
+    [(permission, 'ir_model_access.' + permission) for permission in PERMISSIONS] +
+    [('active', 'ir_model_access.active')],
+    interned=('model', 'group'), depends=('ir_model',))
+
+RULES = KeyedTable(
+    'rules', 'ir_rule', key=('xml_id',),
+    compared=('name', 'model', 'domain_force', 'groups') + PERMISSIONS + ('active',),
+    model='ir.rule',
+    columns=[('name', 'ir_rule.name'),
+             ('model', '(SELECT ir_model.model FROM ir_model '
+                       'WHERE ir_model.id = ir_rule.model_id)'),
+             ('domain_force', 'ir_rule.domain_force'),
+             ('groups', "array_to_string(ARRAY(SELECT reference.module || '.' || reference.name "
+                        "FROM rule_group_rel JOIN ir_model_data AS reference "
+                        "ON reference.model = 'res.groups' "
+                        "AND reference.res_id = rule_group_rel.group_id "
+                        "WHERE rule_group_rel.rule_group_id = ir_rule.id ORDER BY 1), ',')")] +
+    [(permission, 'ir_rule.' + permission) for permission in PERMISSIONS] +
+    [('active', 'ir_rule.active')],
+    interned=('model',), depends=('ir_model', 'rule_group_rel'))
+
+# The names are cast because they are translatable (jsonb) in the latest versions
+ACTIONS = KeyedTable(
+    'actions', 'ir_act_window', key=('xml_id',),
+    compared=('name', 'res_model', 'view_mode', 'view', 'domain', 'context', 'target'),
+    model='ir.actions.act_window',
+    columns=[('name', 'ir_act_window.name::text'), ('res_model', 'ir_act_window.res_model'),
+             ('view_mode', 'ir_act_window.view_mode'),
+             ('view', xml_id_of('ir.ui.view', 'ir_act_window.view_id')),
+             ('domain', 'ir_act_window.domain'), ('context', 'ir_act_window.context'),
+             ('target', 'ir_act_window.target')],
+    interned=('res_model', 'view_mode', 'target'))
+
+REPORTS = KeyedTable(
+    'reports', 'ir_act_report_xml', key=('xml_id',),
+    compared=('name', 'model', 'report_name', 'report_type', 'report_file'),
+    model=('ir.actions.report', 'ir.actions.report.xml'),
+    columns=[('name', 'ir_act_report_xml.name::text'), ('model', 'ir_act_report_xml.model'),
+             ('report_name', 'ir_act_report_xml.report_name'),
+             ('report_type', 'ir_act_report_xml.report_type'),
+             ('report_file', 'ir_act_report_xml.report_file')],
+    interned=('model', 'report_type'))
+
+# The parameters are created by code as well, they are identified by their key
+# The system parameters that hold credentials or identify the database, only the md5 of their
+# value is compared and reported
+SECRET_PARAMETERS = r'secret|password|passwd|token|api_?key|^database\.uuid$'
+
+PARAMETERS = KeyedTable(
+    'parameters', 'ir_config_parameter', key=('key',), compared=('value',),
+    columns=[('key', 'ir_config_parameter.key'),
+             ('value', masked('ir_config_parameter.value', 'ir_config_parameter.key',
+                              SECRET_PARAMETERS))])
+
+# The domains compared record by record (see get_keyed_diff)
+KEYED_DOMAINS = OrderedDict((table.name, table) for table in (
+    VIEWS, TRANSLATIONS, FIELDS, ACCESS, RULES, ACTIONS, REPORTS, PARAMETERS))
+
+# Tables each domain reads from, a write in any of them invalidates its snapshots
+SNAPSHOT_TABLES = dict((table.name, table.tables)
+                       for table in list(KEYED_DOMAINS.values()) + [MENUS])
+
+
+class ScreenRenderer(object):
+    """ Write the diffs to the screen (or any stream) through a buffer, written once it holds
+    *buffer_size* characters instead of once per line. The ANSI colors are added only when the
+    stream is a terminal unless *color* says otherwise, with *pager* the whole output goes
+    through the pager (less, more, $PAGER) and *max_lines* limits the lines shown for each
+    entry. The diffs of the updated entries are built by *differ* (a diff.Differ).
+
+    Use it as a context manager so the last buffer is written on exit.
+    """
+
+    colors = {'yellow': '\x1b[33m', 'green': '\x1b[32m', 'red': '\x1b[31m'}
+    reset = '\x1b[0m'
+
+    def __init__(self, stream=None, color=None, pager=False, max_lines=None,
+                 buffer_size=64 * 1024, differ=None):
+        self.stream = stream or click.get_text_stream('stdout')
+        self.differ = differ or Differ()
+        # With the pager, None lets click strip the colors if it can not show them
+        self.pager_color = color
+        if color is None:
+            color = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.color = color
+        self.pager = pager
+        self.max_lines = max_lines
+        self.buffer_size = buffer_size
+        self.buffer = list()
+        self.size = 0
+        self.pages = list()
+
+    def line(self, text, fg=None):
+        """ Add a line to the buffer
+
+        :param text: The line without the new line character
+        :param fg: Color for the line (yellow, green, red)
+        """
+        if fg and self.color:
+            text = self.colors[fg] + text + self.reset
+        self.buffer.append(text)
+        self.size += len(text) + 1
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def diff(self, lines):
+        """ Add the lines of a diff, the added ones in green and the removed ones in red. Only the
+        first *max_lines* are added followed by the number of omitted ones
+
+        :param lines: Iterable of lines
+        """
+        omitted = 0
+        if self.max_lines is not None:
+            lines = list(lines)
+            omitted = len(lines) - self.max_lines
+            lines = lines[:self.max_lines]
+        for line in lines:
+            if line.startswith('+'):
+                self.line(line, 'green')
+            elif line.startswith('-'):
+                self.line(line, 'red')
             else:
-                diff = {'type': field['type'].split('\n'),
-                        'description':
-                            field['description'].split('\n'), }
-            if field.get('model') not in show_model_field:
-                show_model_field[field.get('model')] = []
-                click.secho('+++ {title} {model}'.
-                            format(title='model',
-                                   model=field.get('model')),
-                            fg='yellow')
-            if field.get('name') not in\
-               show_model_field[field.get('model')]:
-                show_model_field[field.get('model')].append(field.get('name'))
-                click.secho('+++ {title} {name}'.
-                            format(title='field name:',
-                                   name=field.get('name')),
-                            fg='yellow')
-
-            for colm in diff:
-                if diff[colm]:
-                    click.secho('++++field {column}'.format(column=colm),
-                                fg='yellow')
-                for line in diff[colm]:
-                    if line.startswith('+'):
-                        click.secho(line, fg='green')
-                    elif line.startswith('-'):
-                        click.secho(line, fg='red')
+                self.line(line)
+        if omitted > 0:
+            self.line('... {0} more lines'.format(omitted), 'yellow')
+
+    def flush(self):
+        if not self.buffer:
+            return
+        text = '\n'.join(self.buffer) + '\n'
+        self.buffer = list()
+        self.size = 0
+        if self.pager:
+            self.pages.append(text)
+        else:
+            click.echo(text, file=self.stream, nl=False, color=self.color)
+
+    def close(self):
+        self.flush()
+        if self.pager and self.pages:
+            click.echo_via_pager(''.join(self.pages), color=self.pager_color)
+            self.pages = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):  # pylint: disable=W0622
+        self.close()
+
+
+def diff_to_screen(views_states, title, renderer=None):
+    """ Show the changes, the updated and moved ones as an unified diff
+
+    :param views_states: The result of any of the *_diff functions but fields
+    :param title: Title of the changes
+    :param renderer: ScreenRenderer to use, the default one writes to stdout
+    """
+    with renderer or ScreenRenderer() as out:
+        for state, values in views_states.iteritems():
+            out.line('+ {state} {title}'.format(state=state.title(), title=title), 'yellow')
+            for view in values:
+                if state in ('updated', 'moved'):
+                    diff = out.differ.unified_diff(
+                        view['original'].split('\n'),
+                        view['modified'].split('\n')
+                    )
+                elif title == 'Translations':
+                    diff = view.get('value').split('\\n')
+                else:
+                    diff = view.get('arch' if 'arch' in view else 'name').split('\\n')
+                xml_id = view.get('xml_id' if 'xml_id' in view else 'name')
+                out.line('+++ {title} {xml_id}'.format(title=title, xml_id=xml_id), 'yellow')
+                if 'hierarchypath' in view:
+                    out.line('++++ Check it in: {hi}'.format(hi=view.get('hierarchypath')),
+                             'yellow')
+                out.diff(diff)
+
+
+def fields_to_screen(fields_states, title, renderer=None):
+    """ Show the changes in the fields grouped by model
+
+    :param fields_states: The result of get_fields_diff
+    :param title: Title of the changes
+    :param renderer: ScreenRenderer to use, the default one writes to stdout
+    """
+    with renderer or ScreenRenderer() as out:
+        for state, values in fields_states.iteritems():
+            out.line('+ {state} {title}'.format(state=state.title(), title=title), 'yellow')
+            for model, model_fields in group_by_model(values).iteritems():
+                out.line('+++ {title} {model}'.format(title='model', model=model), 'yellow')
+                for field in model_fields:
+                    if state == 'updated':
+                        diff = {'type': out.differ.unified_diff(
+                                field['original'].get('type', '').split('\n'),
+                                field['modified'].get('type', '').split('\n')),
+                                'description': out.differ.unified_diff(
+                                    field['original']
+                                    .get('description', '').split('\n'),
+                                    field['modified']
+                                    .get('description', '').split('\n')), }
+                    else:
+                        diff = {'type': field['type'].split('\n'),
+                                'description':
+                                    field['description'].split('\n'), }
+                    out.line('+++ {title} {name}'.
+                             format(title='field name:', name=field.get('name')), 'yellow')
+                    for colm in diff:
+                        if diff[colm]:
+                            out.line('++++field {column}'.format(column=colm), 'yellow')
+                        out.diff(diff[colm])
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return value if isinstance(value, (str, type(u''))) else str(value)
+
+
+def keyed_to_screen(states, domain, renderer=None):
+    """ Show the changes of any of the KEYED_DOMAINS, every record with its labels and the diff
+    of each compared column
+
+    :param states: The result of get_keyed_diff
+    :param domain: Name of the domain (see KEYED_DOMAINS)
+    :param renderer: ScreenRenderer to use, the default one writes to stdout
+    """
+    table = KEYED_DOMAINS[domain]
+    with renderer or ScreenRenderer() as out:
+        for state, values in states.iteritems():
+            out.line('+ {state} {title}'.format(state=state.title(), title=domain), 'yellow')
+            for record in values:
+                out.line('+++ {title} {labels}'.format(title=domain, labels=' '.join(
+                    _text(record[label]) for label in table.labels)), 'yellow')
+                if state != 'updated':
+                    original, modified = None, record
+                elif len(table.compared) == 1:
+                    original = {table.compared[0]: record['original']}
+                    modified = {table.compared[0]: record['modified']}
+                else:
+                    original, modified = record['original'], record['modified']
+                for column in table.compared:
+                    if column in table.labels:
+                        continue
+                    value = _text(modified[column]).split('\n')
+                    if original is None:
+                        diff = value
                     else:
-                        click.secho(line)
+                        diff = out.differ.unified_diff(_text(original[column]).split('\n'),
+                                                       value)
+                    if not diff:
+                        continue
+                    out.line('++++{column}'.format(column=column), 'yellow')
+                    out.diff(diff)
 
 
 def branches_to_screen(branches):
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Collect the branch, commit and remotes of the git repositories of an instance reading the git
+metadata directly (HEAD, refs, packed-refs and config), without running git.
+"""
+
+import logging
+import os
+import re
+import threading
+from .utils import run_parallel
+
+logger = logging.getLogger('deployv')  # pylint: disable=C0103
+
+_remote_section = re.compile(r'^\s*\[\s*remote\s+"(?P<name>.*)"\s*\]')  # pylint: disable=C0103
+_section = re.compile(r'^\s*\[')  # pylint: disable=C0103
+_url = re.compile(r'^\s*url\s*=\s*(?P<url>.*?)\s*$')  # pylint: disable=C0103
+
+_cache = dict()  # pylint: disable=C0103
+_cache_lock = threading.Lock()  # pylint: disable=C0103
+
+
+def find_repositories(path):
+    """ Find the git repositories under the path, the repositories are not walked into so the
+    big ones (odoo itself) cost a single listdir
+
+    :param path: Directory to scan
+    :return: Sorted list with the path of every repository (its working tree)
+    """
+    res = list()
+    for root, dirnames, filenames in os.walk(path):
+        if '.git' in dirnames or '.git' in filenames:
+            res.append(root)
+            dirnames[:] = []
+            continue
+        # Hidden directories (virtualenvs, caches) have no repositories of the instance
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+    return sorted(res)
+
+
+def git_dirs(path):
+    """ Get the git directory of the working tree and the common one, they are different for
+    the worktrees and the same otherwise. A .git file (worktrees, submodules) is followed
+
+    :param path: The working tree
+    :return: Tuple with the git directory and the common directory
+    """
+    git_dir = os.path.join(path, '.git')
+    if os.path.isfile(git_dir):
+        with open(git_dir) as git_file:
+            content = git_file.read().strip()
+        if content.startswith('gitdir:'):
+            git_dir = os.path.normpath(os.path.join(path, content[len('gitdir:'):].strip()))
+    common_dir = git_dir
+    commondir_file = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_file):
+        with open(commondir_file) as commondir:
+            common_dir = os.path.normpath(os.path.join(git_dir, commondir.read().strip()))
+    return git_dir, common_dir
+
+
+def _read(filename):
+    try:
+        with open(filename) as ref_file:
+            return ref_file.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _mtime(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    # git replaces the files through a rename so the inode changes even if the mtime doesn't
+    return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+def head(git_dir):
+    """ Get the ref HEAD points to
+
+    :param git_dir: The git directory
+    :return: The ref (refs/heads/<branch>) or None if HEAD is detached
+    """
+    content = _read(os.path.join(git_dir, 'HEAD')) or ''
+    if content.startswith('ref:'):
+        return content[len('ref:'):].strip()
+    return None
+
+
+def resolve_ref(common_dir, ref):
+    """ Get the commit a ref points to, from its loose file or from packed-refs
+
+    :param common_dir: The common git directory (where the refs are)
+    :param ref: Full name of the ref, e.g. refs/heads/master
+    :return: The commit sha or None if the ref does not exist (an empty repository)
+    """
+    commit = _read(os.path.join(common_dir, ref))
+    if commit:
+        return commit
+    packed = _read(os.path.join(common_dir, 'packed-refs')) or ''
+    for line in packed.splitlines():
+        if line.startswith(('#', '^')):
+            continue
+        parts = line.split(' ', 1)
+        if len(parts) == 2 and parts[1] == ref:
+            return parts[0]
+    return None
+
+
+def remotes(common_dir):
+    """ Get the url of every remote from the git config
+
+    :param common_dir: The common git directory (where the config is)
+    :return: dict with the remote name as key and its url as value
+    """
+    res = dict()
+    remote = None
+    for line in (_read(os.path.join(common_dir, 'config')) or '').splitlines():
+        match = _remote_section.match(line)
+        if match:
+            remote = match.group('name')
+            continue
+        if _section.match(line):
+            remote = None
+            continue
+        match = _url.match(line)
+        if match and remote is not None:
+            res.setdefault(remote, match.group('url'))
+    return res
+
+
+def cache_key(path):
+    """ Get what identifies the state of the repository: the stat of its HEAD, the ref HEAD
+    points to, packed-refs and config. A checkout, commit, fetch or remote change modifies
+    at least one of them
+    """
+    git_dir, common_dir = git_dirs(path)
+    ref = head(git_dir)
+    files = [os.path.join(git_dir, 'HEAD'), os.path.join(common_dir, 'packed-refs'),
+             os.path.join(common_dir, 'config')]
+    if ref is not None:
+        files.append(os.path.join(common_dir, ref))
+    return tuple((filename, _mtime(filename)) for filename in files)
+
+
+def repository_info(path):
+    """ Read the branch, commit and remotes of the repository. The result is cached in memory
+    by path and only read again when the repository changed (see :func:`cache_key`)
+
+    :param path: The working tree of the repository
+    :return: dict with the path, name, branch, commit and repo_url (the url of every remote)
+    """
+    key = cache_key(path)
+    with _cache_lock:
+        cached = _cache.get(path)
+    if cached is not None and cached[0] == key:
+        return dict(cached[1], repo_url=dict(cached[1]['repo_url']))
+    git_dir, common_dir = git_dirs(path)
+    ref = head(git_dir)
+    if ref is None:
+        branch, commit = 'HEAD', _read(os.path.join(git_dir, 'HEAD'))
+    else:
+        branch = ref[len('refs/heads/'):] if ref.startswith('refs/heads/') else ref
+        commit = resolve_ref(common_dir, ref)
+    res = {
+        'path': path,
+        'name': os.path.basename(os.path.normpath(path)),
+        'branch': branch,
+        'commit': commit,
+        'repo_url': remotes(common_dir),
+    }
+    with _cache_lock:
+        _cache[path] = (key, res)
+    return dict(res, repo_url=dict(res['repo_url']))
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def scan(path, jobs=4):
+    """ Get the information of every repository under the path, the repositories are read on a
+    pool of *jobs* threads
+
+    :param path: Directory to scan
+    :param jobs: Maximum number of repositories read at the same time
+    :return: List of dicts (see :func:`repository_info`) sorted by path, empty if the path does
+        not exist
+    """
+    if not os.path.isdir(path):
+        logger.debug('No repositories to scan in %s', path)
+        return list()
+    return run_parallel([(repository_info, (repository,))
+                         for repository in find_repositories(path)], jobs)
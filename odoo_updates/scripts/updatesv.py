@@ -1,47 +1,196 @@
 # -*- coding: utf-8 -*-
 
 import click
+import sys
+from functools import partial
+from .. import metrics
 from .. import odoo_updates
 from .. import utils
+from ..cache import IncrementalStore, SnapshotCache
+from ..diff import ENGINES, Differ
 
 
 @click.group()
 @click.option('--original', '-o', required=True)
-@click.option('--updated', '-u', required=True)
+@click.option('--updated', '-u', required=True, multiple=True,
+              help='Updated database, may be given many times to compare each one with the '
+                   'original')
 @click.option('--screen', '-s', is_flag=True, default=False)
 @click.option('--queue', '-q', envvar='AWS_BRANCH_QUEUE', default=False)
 @click.option('--customer', '-c', envvar='CUSTOMER', required=True)
 @click.option('--instance', '-i', envvar='INSTANCE_TYPE', required=True)
+@click.option('--fingerprint', '-f', is_flag=True, default=False,
+              help='Compare md5 fingerprints first and fetch only the changed records')
+@click.option('--itersize', type=int, default=None,
+              help='Stream the records with server side cursors fetching this many rows at once')
+@click.option('--copy', is_flag=True, default=False,
+              help='Transfer the views, translations and fields with COPY instead of a cursor')
+@click.option('--pool-size', type=int, default=4,
+              help='Maximum number of connections kept open for each database')
+@click.option('--cache-dir', envvar='ODOO_UPDATES_CACHE', default=None,
+              help='Keep snapshots of the original database here to skip unchanged extractions')
+@click.option('--cache-size', type=int, default=1024,
+              help='Maximum size of the snapshot cache in MB')
+@click.option('--incremental-dir', envvar='ODOO_UPDATES_INCREMENTAL', default=None,
+              help='Keep the state of each run here and fetch only the rows written since then')
+@click.option('--output', '-O', type=click.Path(dir_okay=False, allow_dash=True), default=None,
+              help='Write the result to this file (- for stdout) instead of sending it')
+@click.option('--format', 'output_format', type=click.Choice(['json', 'compact', 'ndjson']),
+              default='json', help='Format of the result written with --output')
+@click.option('--pager/--no-pager', default=False, help='Show the screen output in a pager')
+@click.option('--color/--no-color', default=None,
+              help='Color the screen output, by default only when writing to a terminal')
+@click.option('--max-lines', type=int, default=None,
+              help='Maximum number of diff lines shown on the screen for each change')
+@click.option('--diff-engine', type=click.Choice(sorted(ENGINES)), default='patience',
+              help='Algorithm used to diff the updated entries on the screen')
+@click.option('--diff-timeout', type=float, default=1.0,
+              help='Seconds allowed to diff each entry before showing it as replaced')
+@click.option('--split', is_flag=True, default=False,
+              help='With many updated databases send one message for each one')
+@click.option('--module', '-m', 'modules', multiple=True,
+              help='Compare only the records of this module, may be given many times')
+@click.option('--changed-modules', is_flag=True, default=False,
+              help='Compare only the records of the modules whose version or state changed')
+@click.option('--lang', 'langs', multiple=True,
+              help='Compare only the translations to this language, may be given many times')
+@click.option('--translation-type', 'translation_types', multiple=True,
+              help='Compare only the translations of this type (model, code, ...), may be given '
+                   'many times')
+@click.option('--profile', is_flag=True, default=False,
+              help='Record the time, queries, rows and memory of every phase in the metrics '
+                   'section of the result (a summary table with --screen)')
 @click.pass_context
-def cli(ctx, original, updated, screen, queue, customer, instance):
+def cli(ctx, original, updated, screen, queue, customer, instance, fingerprint, itersize, copy,
+        pool_size, cache_dir, cache_size, incremental_dir, output, output_format, pager, color,
+        max_lines, diff_engine, diff_timeout, split, modules, changed_modules, langs,
+        translation_types, profile):
     ctx.obj.update({'original': original})
-    ctx.obj['updated'] = updated
+    # With many updated databases the results are dicts by database name
+    ctx.obj['updated'] = updated[0] if len(updated) == 1 else list(updated)
+    ctx.obj['split'] = split
     ctx.obj['screen'] = screen
     ctx.obj['queue'] = queue
     ctx.obj['customer'] = customer
     ctx.obj['instance'] = instance
+    ctx.obj['fingerprint'] = fingerprint
+    ctx.obj['itersize'] = itersize
+    ctx.obj['copy'] = copy
+    ctx.obj['cache'] = cache_dir and SnapshotCache(cache_dir, cache_size * 1024 * 1024)
+    ctx.obj['incremental'] = incremental_dir and IncrementalStore(incremental_dir,
+                                                                  cache_size * 1024 * 1024)
+    ctx.obj['output'] = output
+    ctx.obj['format'] = output_format
+    ctx.obj['renderer'] = partial(odoo_updates.ScreenRenderer, color=color, pager=pager,
+                                  max_lines=max_lines,
+                                  differ=Differ(diff_engine, diff_timeout))
+    # All the extractors of this invocation share the same connections
+    utils.open_pool(pool_size)
+    ctx.call_on_close(utils.close_pool)
+    ctx.obj['profiler'] = None
+    if profile:
+        ctx.obj['profiler'] = metrics.start_profiling()
+        ctx.call_on_close(metrics.stop_profiling)
+    # The records of the other modules are filtered out by the extraction queries
+    ctx.obj['modules'] = list(modules) or None
+    ctx.obj['langs'] = list(langs) or None
+    ctx.obj['translation_types'] = list(translation_types) or None
+    if changed_modules:
+        with metrics.phase('modules'):
+            ctx.obj['modules'] = sorted(set(modules).union(odoo_updates.changed_modules(
+                ctx.obj['original'], ctx.obj['updated'])))
+
+
+def by_database(ctx, states):
+    """ Whether the result has the one of each updated database by name, the branches are the
+    same for all of them
+    """
+    return isinstance(ctx.obj['updated'], list) and isinstance(states, dict)
+
+
+def show(ctx, render, states, *args):
+    """ Render the result on the screen followed, with --profile, by the metrics table
+    """
+    with metrics.phase('render'):
+        if by_database(ctx, states):
+            for database, result in states.items():
+                click.secho('= {database}'.format(database=database), fg='yellow')
+                render(result, *args)
+        else:
+            render(states, *args)
+    if ctx.obj['profiler'] is not None:
+        click.echo('\n'.join(metrics.summary_lines(ctx.obj['profiler'].to_dict())))
+
+
+def report(ctx, states, command):
+    """ Send the result to the queue or, with --output, stream it to the file in the chosen
+    format without building the whole message in memory. With --profile the metrics collected
+    until the serialization starts are included.
+
+    With many updated databases the result has the one of each database by name, with --split
+    every database is sent in its own message (or written in its own envelope). In ndjson every
+    line has the name of its database (candidate)
+    """
+    results = [states]
+    if by_database(ctx, states) and ctx.obj['split']:
+        results = [{database: result} for database, result in states.items()]
+    if not ctx.obj['output']:
+        for result in results:
+            profile = ctx.obj['profiler'] and ctx.obj['profiler'].to_dict()
+            with metrics.phase('serialize'):
+                message = utils.jsonify(result, command, ctx.obj['customer'],
+                                        ctx.obj['instance'], profile)
+            with metrics.phase('publish'):
+                utils.send_message(message, ctx.obj['queue'])
+        return
+    profile = ctx.obj['profiler'] and ctx.obj['profiler'].to_dict()
+    stream = sys.stdout if ctx.obj['output'] == '-' else open(ctx.obj['output'], 'w')
+    try:
+        with metrics.phase('serialize'):
+            if ctx.obj['format'] == 'ndjson' and by_database(ctx, states):
+                for database, result in states.items():
+                    utils.dump_ndjson(result, command, ctx.obj['customer'],
+                                      ctx.obj['instance'], stream, candidate=database)
+                if profile:
+                    utils.dump_ndjson({}, command, ctx.obj['customer'], ctx.obj['instance'],
+                                      stream, profile)
+            elif ctx.obj['format'] == 'ndjson':
+                utils.dump_ndjson(states, command, ctx.obj['customer'], ctx.obj['instance'],
+                                  stream, profile)
+            else:
+                # With --split the envelopes are written one after the other
+                for result in results:
+                    utils.dump_json(result, command, ctx.obj['customer'], ctx.obj['instance'],
+                                    stream, indent=4 if ctx.obj['format'] == 'json' else None,
+                                    metrics=profile)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
 
 
 @cli.command()
 @click.pass_context
 def views(ctx):
-    views_states = odoo_updates.get_views_diff(ctx.obj['original'], ctx.obj['updated'])
+    views_states = odoo_updates.get_views_diff(ctx.obj['original'], ctx.obj['updated'],
+                                               ctx.obj['fingerprint'], ctx.obj['itersize'],
+                                               ctx.obj['cache'], ctx.obj['incremental'],
+                                               copy=ctx.obj['copy'],
+                                               modules=ctx.obj['modules'])
     if ctx.obj['screen']:
-        odoo_updates.diff_to_screen(views_states, 'views')
+        show(ctx, odoo_updates.diff_to_screen, views_states, 'views', ctx.obj['renderer']())
     else:
-        message = utils.jsonify(views_states, 'views', ctx.obj['customer'], ctx.obj['instance'])
-        utils.send_message(message, ctx.obj['queue'])
+        report(ctx, views_states, 'views')
 
 
 @cli.command()
 @click.pass_context
 def menus(ctx):
-    menus_states = odoo_updates.get_menus_diff(ctx.obj['original'], ctx.obj['updated'])
+    menus_states = odoo_updates.get_menus_diff(ctx.obj['original'], ctx.obj['updated'],
+                                               ctx.obj['cache'], modules=ctx.obj['modules'])
     if ctx.obj['screen']:
-        odoo_updates.diff_to_screen(menus_states, 'menus')
+        show(ctx, odoo_updates.diff_to_screen, menus_states, 'menus', ctx.obj['renderer']())
     else:
-        message = utils.jsonify(menus_states, 'menus', ctx.obj['customer'], ctx.obj['instance'])
-        utils.send_message(message, ctx.obj['queue'])
+        report(ctx, menus_states, 'menus')
 
 
 @cli.command()
@@ -49,53 +198,100 @@ def menus(ctx):
 def branches(ctx):
     branches_info = odoo_updates.get_branches()
     if ctx.obj['screen']:
-        odoo_updates.branches_to_screen(branches_info)
+        show(ctx, odoo_updates.branches_to_screen, branches_info)
     else:
-        message = utils.jsonify(branches_info, 'branches', ctx.obj['customer'], ctx.obj['instance'])
-        utils.send_message(message, ctx.obj['queue'])
+        report(ctx, branches_info, 'branches')
 
 
 @cli.command()
+@click.option('--partition', type=click.Choice(['lang', 'module']), default=None,
+              help='Extract and compare the translations one language or module at a time')
+@click.option('--jobs', '-j', type=int, default=4,
+              help='Maximum number of partitions or updated databases extracted at the same '
+                   'time, 1 keeps a single partition in memory')
 @click.pass_context
-def translations(ctx):
+def translations(ctx, partition, jobs):
     translation_states = odoo_updates.get_translations_diff(ctx.obj['original'],
-                                                            ctx.obj['updated'])
+                                                            ctx.obj['updated'],
+                                                            ctx.obj['fingerprint'],
+                                                            ctx.obj['itersize'],
+                                                            ctx.obj['cache'],
+                                                            ctx.obj['incremental'],
+                                                            jobs, ctx.obj['copy'],
+                                                            ctx.obj['modules'],
+                                                            ctx.obj['langs'],
+                                                            ctx.obj['translation_types'],
+                                                            partition)
     if ctx.obj['screen']:
-        odoo_updates.diff_to_screen(translation_states, 'Translations')
+        show(ctx, odoo_updates.diff_to_screen, translation_states, 'Translations',
+             ctx.obj['renderer']())
     else:
-        message = utils.jsonify(translation_states, 'translations', ctx.obj['customer'], ctx.obj['instance'])
-        utils.send_message(message, ctx.obj['queue'])
+        report(ctx, translation_states, 'translations')
 
 
 @cli.command()
 @click.pass_context
 def fields(ctx):
     fields_states = odoo_updates.get_fields_diff(ctx.obj['original'],
-                                                 ctx.obj['updated'])
+                                                 ctx.obj['updated'],
+                                                 ctx.obj['fingerprint'], ctx.obj['itersize'],
+                                                 ctx.obj['cache'], ctx.obj['incremental'],
+                                                 copy=ctx.obj['copy'],
+                                                 modules=ctx.obj['modules'])
     if ctx.obj['screen']:
-        odoo_updates.fields_to_screen(fields_states, 'Fields')
+        show(ctx, odoo_updates.fields_to_screen, fields_states, 'Fields', ctx.obj['renderer']())
     else:
-        message = utils.jsonify(fields_states, 'fields', ctx.obj['customer'], ctx.obj['instance'])
-        utils.send_message(message, ctx.obj['queue'])
+        report(ctx, fields_states, 'fields')
+
+
+def keyed_command(domain):
+    """ Register the command of one of the KEYED_DOMAINS that has no command of its own
+    """
+    @click.pass_context
+    def command(ctx):
+        states = odoo_updates.get_keyed_diff(domain, ctx.obj['original'], ctx.obj['updated'],
+                                             ctx.obj['fingerprint'], ctx.obj['itersize'],
+                                             ctx.obj['cache'], ctx.obj['incremental'],
+                                             copy=ctx.obj['copy'], modules=ctx.obj['modules'])
+        if ctx.obj['screen']:
+            show(ctx, odoo_updates.keyed_to_screen, states, domain, ctx.obj['renderer']())
+        else:
+            report(ctx, states, domain)
+    command.__doc__ = 'Changes in the {0} ({1})'.format(
+        domain, odoo_updates.KEYED_DOMAINS[domain].table)
+    return cli.command(domain)(command)
+
+
+for keyed_domain in ('access', 'rules', 'actions', 'reports', 'parameters'):
+    keyed_command(keyed_domain)
+
+
+def all_to_screen(states, renderer):
+    """ Show the result of getall, every domain as its own command shows it
+
+    :param renderer: Callable that returns a new ScreenRenderer
+    """
+    odoo_updates.diff_to_screen(states['views'], 'views', renderer())
+    odoo_updates.diff_to_screen(states['menus'], 'menus', renderer())
+    odoo_updates.diff_to_screen(states['translations'], 'Translations', renderer())
+    odoo_updates.fields_to_screen(states['fields'], 'Fields', renderer())
+    odoo_updates.branches_to_screen(states['branches'])
 
 
 @cli.command()
+@click.option('--jobs', '-j', type=int, default=4,
+              help='Maximum number of extractions running at the same time')
 @click.pass_context
-def getall(ctx):
-    states = dict()
-    views_states = odoo_updates.get_views_diff(ctx.obj['original'], ctx.obj['updated'])
-    menus_states = odoo_updates.get_menus_diff(ctx.obj['original'], ctx.obj['updated'])
-    translation_states = odoo_updates.get_translations_diff(ctx.obj['original'],
-                                                            ctx.obj['updated'])
-    branches_info = odoo_updates.get_branches()
-    fields_states = odoo_updates.get_fields_diff(ctx.obj['original'], ctx.obj['updated'])
+def getall(ctx, jobs):
     # One for each command views, models, menus, translations, etc
-    states.update({'views': views_states})
-    states.update({'menus': menus_states})
-    states.update({'branches': branches_info})
-    states.update({'translations': translation_states})
-    states.update({'fields': fields_states})
-    message = utils.jsonify(states, 'getall', ctx.obj['customer'], ctx.obj['instance'])
-    utils.send_message(message, ctx.obj['queue'])
+    states = odoo_updates.get_all_diff(ctx.obj['original'], ctx.obj['updated'],
+                                       ctx.obj['fingerprint'], ctx.obj['itersize'], jobs,
+                                       ctx.obj['cache'], ctx.obj['incremental'],
+                                       ctx.obj['copy'], ctx.obj['modules'], ctx.obj['langs'],
+                                       ctx.obj['translation_types'])
+    if ctx.obj['screen']:
+        show(ctx, all_to_screen, states, ctx.obj['renderer'])
+    else:
+        report(ctx, states, 'getall')
 
 cli(obj={})
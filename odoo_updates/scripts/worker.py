@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import click
+import signal
+from ..cache import IncrementalStore, MemorySnapshotCache
+from ..worker import DiffWorker
+
+
+@click.command()
+@click.option('--queue', '-q', envvar='ODOO_UPDATES_JOBS_QUEUE', required=True,
+              help='Queue the jobs are taken from')
+@click.option('--results-queue', envvar='AWS_BRANCH_QUEUE', default=None,
+              help='Queue the results are sent to when the job does not give one')
+@click.option('--pool-size', type=int, default=4,
+              help='Maximum number of connections kept open for each database')
+@click.option('--jobs', '-j', type=int, default=4,
+              help='Maximum number of extractions of a job running at the same time')
+@click.option('--cache-dir', envvar='ODOO_UPDATES_CACHE', default=None,
+              help='Keep snapshots of the original databases here, the last ones in memory too')
+@click.option('--cache-size', type=int, default=1024,
+              help='Maximum size of the snapshot cache in MB')
+@click.option('--cache-entries', type=int, default=16,
+              help='Number of snapshots kept in memory')
+@click.option('--incremental-dir', envvar='ODOO_UPDATES_INCREMENTAL', default=None,
+              help='Keep the state of each job here and fetch only the rows written since then')
+@click.option('--wait', type=int, default=20,
+              help='Seconds to wait for new jobs on each request to the queue')
+def main(queue, results_queue, pool_size, jobs, cache_dir, cache_size, cache_entries,
+         incremental_dir, wait):
+    """ Run the diff jobs sent to the queue until SIGTERM or SIGINT
+    """
+    cache = cache_dir and MemorySnapshotCache(cache_dir, cache_size * 1024 * 1024,
+                                              cache_entries)
+    incremental = incremental_dir and IncrementalStore(incremental_dir,
+                                                       cache_size * 1024 * 1024)
+    worker = DiffWorker(queue, results_queue, cache=cache, incremental=incremental,
+                        pool_size=pool_size, jobs=jobs, wait=wait)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: worker.stop())
+    worker.serve()
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=E1120
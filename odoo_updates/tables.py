@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative description of the Odoo tables that are compared record by record
+"""
+
+from operator import itemgetter
+from .utils import PostgresConnector, copy_list_records, copy_select, iter_records, \
+    stream_select
+
+XML_ID = "ir_model_data.module || '.' || ir_model_data.name"
+
+
+def xml_id_of(model, res_id):
+    """ Sql expression of the xml_id of the record of another model, e.g. the group of an
+    access right, so the records are compared by what they reference and not by their ids
+
+    :param model: The Odoo model of the referenced record
+    :param res_id: Sql expression of its id
+    """
+    return ("(SELECT reference.module || '.' || reference.name FROM ir_model_data AS reference "
+            "WHERE reference.model = '{0}' AND reference.res_id = {1} "
+            "ORDER BY reference.module, reference.name LIMIT 1)".format(model, res_id))
+
+
+def masked(value, key, pattern):
+    """ Sql expression of a value replaced by its md5 when the key matches the pattern, so a
+    secret is still compared but never leaves the database server
+
+    :param value: Sql expression of the value
+    :param key: Sql expression of the key
+    :param pattern: Case insensitive POSIX regular expression of the secret keys
+    """
+    return "CASE WHEN {0} ~* '{1}' THEN 'md5:' || md5({2}) ELSE {2} END".format(
+        key, pattern, value)
+
+
+class KeyedTable(object):
+    """ A domain whose records are identified by a key: its table, the columns selected, the key
+    and the columns compared. Everything else comes from the declaration: the extraction (with
+    a cursor, a server side cursor or COPY, optionally filtered by keys), the md5 fingerprints
+    and write dates computed by PostgreSQL, and the comparison through a hash index.
+
+    If an Odoo *model* is given only the records with an xml_id are selected (joined with
+    ir_model_data) and the *xml_id* column is available to be used as the key.
+
+    The comparison reports the added and deleted records with the *labels* and *compared*
+    columns, and the updated ones with the labels plus the original and modified values (the
+    value itself when a single column is compared, a dict otherwise)
+    """
+
+    def __init__(self, name, table, key, compared, columns=(), model=None, labels=None,
+                 interned=(), joins='', ordered=False, canonical=None, depends=(),
+                 module_filter=None, filters=None):
+        """
+        :param name: Name of the domain (views, translations, ...)
+        :param table: The table the records are read from
+        :param key: Tuple with the names of the columns that identify a record
+        :param compared: Tuple with the names of the columns whose changes are reported
+        :param columns: List of (name, sql expression) of the selected columns, xml_id excluded
+        :param model: The Odoo model (or a tuple of them) of the records, to join them with
+            ir_model_data
+        :param labels: The columns that identify a record in the report, the key by default
+        :param interned: The columns whose values are repeated a lot (modules, models)
+        :param joins: Additional joins needed by the column expressions
+        :param ordered: If True the records are sorted by key
+        :param canonical: dict with a function for the compared columns that must be compared
+            by a canonical form, it gets the value and returns the canonical form and a digest.
+            It is only called when the values differ
+        :param depends: Other tables the column expressions read from, a write in any of them
+            invalidates the snapshots of the domain (see cache.SnapshotCache)
+        :param module_filter: Sql condition, with a %s for the list of modules, that selects the
+            records of some modules. By default the module of the xml_id when there is a
+            *model*, without both the records can not be filtered by module
+        :param filters: dict with the sql expression of the columns the records can be filtered
+            and partitioned by, e.g. the language of the translations
+        """
+        self.name = name
+        self.table = table
+        self.key = tuple(key)
+        self.compared = tuple(compared)
+        self.model = model
+        self.columns = list(columns)
+        if model is not None:
+            self.columns.insert(0, ('xml_id', XML_ID))
+        self.expressions = dict(self.columns)
+        self.labels = tuple(labels or key)
+        self.interned = tuple(interned)
+        self.joins = joins
+        self.ordered = ordered
+        self.canonical = canonical or dict()
+        self.record_key = itemgetter(*self.key)
+        self.report_columns = self.labels + tuple(
+            column for column in self.compared if column not in self.labels)
+        self.tables = (('ir_model_data', table) if model is not None else (table,)) + \
+            tuple(depends)
+        if module_filter is None and model is not None:
+            module_filter = 'ir_model_data.module = ANY(%s)'
+        self.module_filter = module_filter
+        self.filters = filters or dict()
+
+    def select(self, columns, keys=None, order=True, modules=None, filters=None):
+        """ Build the select of the given sql expressions
+
+        :param columns: List of sql expressions (with their alias if any)
+        :param keys: If given, only the records with these keys are selected
+        :param order: If False the records are not sorted even if the table is *ordered*
+        :param modules: If given, only the records of these modules are selected (see
+            *module_filter*)
+        :param filters: dict with the values allowed for some of the *filters* columns, a None
+            value allows them all
+        :return: Tuple with the sql and its arguments
+        """
+        sql = 'SELECT {0} FROM '.format(', '.join(columns))
+        where = list()
+        if self.model is not None:
+            models = self.model if isinstance(self.model, tuple) else (self.model,)
+            sql += 'ir_model_data JOIN {0} ON ir_model_data.res_id = {0}.id'.format(self.table)
+            where.append('ir_model_data.model IN ({0})'.format(
+                ', '.join("'{0}'".format(model) for model in models)))
+        else:
+            sql += self.table
+        if self.joins:
+            sql += ' ' + self.joins
+        args = tuple()
+        if modules is not None and self.module_filter is not None:
+            where.append(self.module_filter)
+            args += (sorted(modules),)
+        for name, values in sorted((filters or dict()).items()):
+            if values is not None:
+                where.append(self.filter_condition(name, values))
+                args += ([value for value in values if value is not None],)
+        if keys is not None:
+            where.append(self.key_condition())
+            args += (list(keys) if len(self.key) == 1 else tuple(keys),)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if self.ordered and order:
+            sql += ' ORDER BY ' + ', '.join(self.expressions[column] for column in self.key)
+        return sql, args
+
+    def filter_condition(self, name, values):
+        """ The condition of one of the *filters* columns, its argument is the list of the
+        values that are not None
+
+        :param name: Name of the column in *filters*
+        :param values: The values allowed, None included to allow the records without value
+        """
+        if name not in self.filters:
+            raise ValueError('The {0} can not be filtered by {1}'.format(self.name, name))
+        condition = '{0} = ANY(%s)'.format(self.filters[name])
+        if None in values:
+            # NULL never matches ANY
+            condition = '({0} OR {1} IS NULL)'.format(condition, self.filters[name])
+        return condition
+
+    def key_condition(self):
+        """ The condition that selects the records by key, its argument is the list of the keys
+        (or a tuple of the key tuples for a composite key)
+        """
+        if len(self.key) == 1:
+            return '{0} = ANY(%s)'.format(self.expressions[self.key[0]])
+        return '({0}) IN %s'.format(', '.join(self.expressions[column] for column in self.key))
+
+    def filtered_out(self, modules, filters=None):
+        """ Whether the module filter or any of the filters leaves no record to select
+        """
+        if modules is not None and not modules and self.module_filter is not None:
+            return True
+        return any(values is not None and not values for values in (filters or dict()).values())
+
+    def extract(self, database, keys=None, itersize=None, copy=False, modules=None,
+                filters=None):
+        """ Select the records of the domain
+
+        :param database: database name to query on
+        :param keys: If given, only the records with these keys are selected
+        :param itersize: If given, the rows are streamed from a server side cursor fetching this
+            many rows per round-trip and a generator is returned instead of a list
+        :param copy: If True, the rows are transferred with COPY ... TO STDOUT and parsed
+            straight into records (*itersize* is ignored)
+        :param modules: If given, only the records of these modules are selected
+        :param filters: dict with the values allowed for some of the *filters* columns
+        :return: List of records (see utils.Record)
+        """
+        if (keys is not None and not keys) or self.filtered_out(modules, filters):
+            return list()
+        sql, args = self.select(['{0} AS "{1}"'.format(expression, name)
+                                 for name, expression in self.columns], keys, modules=modules,
+                                filters=filters)
+        if copy:
+            return copy_select({'dbname': database}, sql, args, self.interned)
+        if itersize:
+            return iter_records(
+                stream_select({'dbname': database, 'itersize': itersize}, sql, *args),
+                self.interned)
+        with PostgresConnector({'dbname': database}) as conn:
+            cursor = conn.execute_select(sql, *args)
+            res = copy_list_records(cursor, self.interned)
+        return res
+
+    def _keyed(self, database, expression, modules=None, filters=None):
+        """ Get a dict with the key of every record and the value of the sql expression
+        """
+        if self.filtered_out(modules, filters):
+            return dict()
+        sql, args = self.select([self.expressions[column] for column in self.key] +
+                                [expression], order=False, modules=modules, filters=filters)
+        size = len(self.key)
+        with PostgresConnector({'dbname': database}) as conn:
+            cursor = conn.execute_select(sql, *args)
+            if size == 1:
+                res = dict((row[0], row[1]) for row in cursor)
+            else:
+                res = dict((tuple(row[:size]), row[size]) for row in cursor)
+        return res
+
+    def fingerprints(self, database, modules=None, filters=None):
+        """ Get the md5 of the compared columns of every record, the hash is computed by
+        PostgreSQL so the values never leave the database server
+
+        :param database: database name to query on
+        :param modules: If given, only the records of these modules are selected
+        :param filters: dict with the values allowed for some of the *filters* columns
+        :return: dict with the key as key and the md5 as value
+        """
+        if len(self.compared) == 1:
+            return self._keyed(database, 'md5({0})'.format(self.expressions[self.compared[0]]),
+                               modules, filters)
+        return self._keyed(database, 'md5(row({0})::text)'.format(
+            ', '.join(self.expressions[column] for column in self.compared)), modules, filters)
+
+    def write_dates(self, database, modules=None, filters=None):
+        """ Get the last write date of every record, used as a cheap probe by the incremental
+        mode
+
+        :param database: database name to query on
+        :param modules: If given, only the records of these modules are selected
+        :param filters: dict with the values allowed for some of the *filters* columns
+        :return: dict with the key as key and the write date as value
+        """
+        return self._keyed(database, 'coalesce({0}.write_date, {0}.create_date)'.format(
+            self.table), modules, filters)
+
+    def partition_values(self, database, column, modules=None, filters=None):
+        """ Get the distinct values of one of the *filters* columns, the partitions the records
+        can be extracted and compared by
+
+        :param database: database name to query on
+        :param column: Name of the column in *filters*
+        :param modules: If given, only the records of these modules are considered
+        :param filters: dict with the values allowed for some of the *filters* columns
+        :return: set with the values (None included if there are records without value)
+        """
+        if column not in self.filters:
+            raise ValueError('The {0} can not be partitioned by {1}'.format(self.name, column))
+        if self.filtered_out(modules, filters):
+            return set()
+        sql, args = self.select(['DISTINCT ' + self.filters[column]], order=False,
+                                modules=modules, filters=filters)
+        with PostgresConnector({'dbname': database}) as conn:
+            cursor = conn.execute_select(sql, *args)
+            res = set(row[0] for row in cursor)
+        return res
+
+    def report(self, record):
+        """ The record as reported when added or deleted
+        """
+        if len(record) == len(self.report_columns):
+            return record
+        return dict((column, record[column]) for column in self.report_columns)
+
+    def changes(self, original, modified):
+        """ Compare the compared columns of two records with the same key
+
+        :return: None if they are the same, otherwise a tuple with the original and modified
+            values (or their canonical form)
+        """
+        if all(original[column] == modified[column] for column in self.compared):
+            return None
+        original_values = list()
+        modified_values = list()
+        same = True
+        for column in self.compared:
+            original_value, modified_value = original[column], modified[column]
+            if original_value != modified_value and column in self.canonical:
+                original_value, original_digest = self.canonical[column](original_value)
+                modified_value, modified_digest = self.canonical[column](modified_value)
+                same = same and original_digest == modified_digest
+            else:
+                same = same and original_value == modified_value
+            original_values.append(original_value)
+            modified_values.append(modified_value)
+        if same:
+            return None
+        if len(self.compared) == 1:
+            return original_values[0], modified_values[0]
+        return (dict(zip(self.compared, original_values)),
+                dict(zip(self.compared, modified_values)))
+
+    def compare(self, original_records, modified_records, original_index=None):
+        """ Compare the records of two databases. Both sides are walked once, the original
+        records are indexed by key so every lookup is O(1); the modified ones can be a stream
+
+        :param original_records: The records of the original database
+        :param modified_records: The records of the updated database
+        :param original_index: The original records by key, if given it is used instead of
+            indexing them again (the same original compared with many databases)
+        :return: dict with the added, updated and deleted records
+        """
+        res = {
+            'updated': list(),
+            'added': list(),
+            'deleted': list()
+        }
+        if original_index is None:
+            original_index = dict((self.record_key(record), record)
+                                  for record in original_records)
+        record_key = self.record_key
+        modified_keys = set()
+        for modified in modified_records:
+            key = record_key(modified)
+            modified_keys.add(key)
+            original = original_index.get(key)
+            if original is None:
+                res['added'].append(self.report(modified))
+                continue
+            changes = self.changes(original, modified)
+            if changes is not None:
+                updated = dict((column, original[column]) for column in self.labels)
+                updated['original'], updated['modified'] = changes
+                res['updated'].append(updated)
+        for original in original_records:
+            if record_key(original) not in modified_keys:
+                res['deleted'].append(self.report(original))
+        return res
@@ -1,31 +1,157 @@
 # -*- coding: utf-8 -*-
 
+import base64
 import boto3
+import hashlib
+import itertools
 import logging
+import os
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+import re
+import threading
+from multiprocessing.pool import ThreadPool
+import time
+import uuid
+import zlib
 from datetime import datetime
 import json
+from .metrics import current_profiler, payload_size
 
 logger = logging.getLogger('deployv')  # pylint: disable=C0103
 
 
-def jsonify(states, command, customer_id, instance):
+def jsonify(states, command, customer_id, instance, metrics=None):
     """
 
     :param command:
     :param message:
+    :param metrics: If given (see metrics.Profiler.to_dict), added as the metrics section
     :return:
     """
-    message = {
+    message = envelope(command, customer_id, instance)
+    message['result'] = states
+    if metrics is not None:
+        message['metrics'] = metrics
+    return json.dumps(message, indent=4, sort_keys=True, default=json_default)
+
+
+def envelope(command, customer_id, instance):
+    """
+    Build the fields that go along with every result
+
+    :return: dict with the instance, customer_id, generated_at and command
+    """
+    return {
         'instance': instance,
         'customer_id': customer_id,
         'generated_at': datetime.now().strftime("%Y%m%d %H%M%S"),
         'command': command,
-        'result': states
     }
 
-    return json.dumps(message, indent=4, sort_keys=True)
+
+def dump_json(states, command, customer_id, instance, stream, indent=None, metrics=None):
+    """
+    Same as :func:`jsonify` but the message is written to the stream piece by piece: the
+    envelope and every dict/list of the result are written incrementally and each change record
+    is encoded on its own, so the whole message is never held in memory. The keys of the
+    envelope and of the result dicts are sorted. Without *indent* the output is compact (no
+    whitespace) and every record is encoded by the C encoder, its keys are left unsorted
+
+    :param stream: A file like object opened for writing text
+    :param indent: Number of spaces to indent with, None for the compact output
+    :param metrics: If given (see metrics.Profiler.to_dict), added as the metrics section
+    """
+    message = envelope(command, customer_id, instance)
+    message['result'] = states
+    if metrics is not None:
+        message['metrics'] = metrics
+    _write_json(message, stream, indent, 0)
+    stream.write('\n')
+
+
+def _write_json(value, stream, indent, level):
+    separator = ': ' if indent is not None else ':'
+    if isinstance(value, dict) and value:
+        stream.write('{')
+        for index, key in enumerate(sorted(value)):
+            stream.write(',' if index else '')
+            _write_indent(stream, indent, level + 1)
+            stream.write(json.dumps(key) + separator)
+            _write_json(value[key], stream, indent, level + 1)
+        _write_indent(stream, indent, level)
+        stream.write('}')
+    elif isinstance(value, list) and value:
+        stream.write('[')
+        for index, item in enumerate(value):
+            stream.write(',' if index else '')
+            _write_indent(stream, indent, level + 1)
+            stream.write(_encode(item, indent, level + 1))
+        _write_indent(stream, indent, level)
+        stream.write(']')
+    else:
+        stream.write(_encode(value, indent, level))
+
+
+def _write_indent(stream, indent, level):
+    if indent is not None:
+        stream.write('\n' + ' ' * indent * level)
+
+
+def _encode(value, indent=None, level=0):
+    if indent is None:
+        # Without sort_keys (nor indent) json uses its C encoder
+        return json.dumps(value, separators=(',', ':'), default=json_default)
+    res = json.dumps(value, indent=indent, sort_keys=True, separators=(',', ': '),
+                     default=json_default)
+    return res.replace('\n', '\n' + ' ' * indent * level)
+
+
+def dump_ndjson(states, command, customer_id, instance, stream, metrics=None, candidate=None):
+    """
+    Write the result as newline delimited JSON: one line per change record with the envelope
+    fields plus the *domain* (views, menus, ...), the *state* (added, updated, ...) and the
+    *record* itself. Every line is flushed as soon as it is written so the consumers can start
+    processing before the whole result is written. The branches have no state (null)
+
+    :param states: The result of a command, for getall a dict with the result of each domain
+    :param stream: A file like object opened for writing text
+    :param metrics: If given (see metrics.Profiler.to_dict), written in a last line with the
+        envelope fields and the metrics
+    :param candidate: If given, the name of the updated database the result belongs to, added
+        to every line
+    """
+    header = envelope(command, customer_id, instance)
+    if candidate is not None:
+        header['candidate'] = candidate
+    domains = states if command == 'getall' else {command: states}
+    for domain in sorted(domains):
+        domain_states = domains[domain]
+        if not isinstance(domain_states, dict):
+            domain_states = {None: domain_states}
+        for state in sorted(domain_states, key=lambda state: state or ''):
+            for record in domain_states[state]:
+                line = dict(header, domain=domain, state=state, record=record)
+                stream.write(_encode(line) + '\n')
+                stream.flush()
+    if metrics is not None:
+        stream.write(_encode(dict(header, metrics=metrics)) + '\n')
+        stream.flush()
+
+
+def json_default(obj):
+    """
+    Fallback used by json.dumps for the objects it can't serialize, records are converted to
+    dicts here so they are kept compact until the very end
+
+    :param obj: The object json could not serialize
+    :return: A serializable version of the object
+    """
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError('{0!r} is not JSON serializable'.format(obj))
 
 
 def copy_list_dicts(lines):
@@ -37,7 +163,7 @@ def copy_list_dicts(lines):
     :return: A list of dictionaries
     """
     res = list()
-    for line in lines:
+    for line in _measured(lines):
         dict_t = dict()
         for keys in line.keys():
             dict_t.update({keys: line[keys]})
@@ -45,18 +171,362 @@ def copy_list_dicts(lines):
     return res
 
 
+def _measured(lines):
+    """ Add the size of the rows of a client side cursor to the query that fetched them while
+    profiling, the rows of the streams and COPY are measured as they are transferred
+    """
+    profiler = current_profiler()
+    if profiler is None or not isinstance(lines, psycopg2.extensions.cursor):
+        return lines
+    return _measure_rows(profiler, lines)
+
+
+def _measure_rows(profiler, lines):
+    size = 0
+    for line in lines:
+        size += payload_size(line)
+        yield line
+    profiler.fetched(size)
+
+
+class Record(object):
+    """ Compact representation of a row, the values are stored in slots (no dict per row) and
+    the column names are shared by all the rows of the same query through the class. It supports
+    the read only part of the dict protocol so it can be used wherever a row dict was used.
+    Use :func:`record_class` to get the class for a set of columns.
+    """
+    __slots__ = ()
+    _columns = ()
+
+    def __init__(self, *values):
+        for column, value in zip(self._columns, values):
+            setattr(self, column, value)
+
+    def __getitem__(self, key):
+        if key not in self._columns:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self._columns
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        return res if res is NotImplemented else not res
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self.to_dict())
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self._columns else default
+
+    def keys(self):
+        return list(self._columns)
+
+    def values(self):
+        return [getattr(self, column) for column in self._columns]
+
+    def items(self):
+        return [(column, getattr(self, column)) for column in self._columns]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __reduce__(self):
+        # The classes are built at runtime so they are pickled as their columns
+        return make_record, (self._columns, tuple(self.values()))
+
+
+_record_classes = dict()
+
+
+def record_class(columns):
+    """
+    Get the Record subclass for the given columns, the classes are cached so all the rows with
+    the same columns share it
+
+    :param columns: Iterable with the column names
+    :return: A Record subclass with one slot per column
+    """
+    columns = tuple(columns)
+    if columns not in _record_classes:
+        _record_classes[columns] = type(
+            'Record', (Record,), {'__slots__': columns, '_columns': columns})
+    return _record_classes[columns]
+
+
+def make_record(columns, values):
+    """
+    Build a record for the given columns and values, used to unpickle records
+
+    :param columns: Tuple with the column names
+    :param values: Tuple with the values, in the same order
+    :return: A record
+    """
+    return record_class(columns)(*values)
+
+
+def iter_records(lines, interned=()):
+    """
+    Convert the rows of a psycopg2 cursor (or any iterable of dict like rows) to compact records
+    lazily. The values of the interned columns are deduplicated, so repeated strings such as
+    module and model names are stored only once
+
+    :param lines: The psycopg2 cursor, a stream or a list of dicts
+    :param interned: The names of the columns whose values must be interned
+    :return: A generator of records
+    """
+    cls = None
+    interned_columns = list()
+    strings = dict()
+    for line in _measured(lines):
+        if cls is None:
+            cls = record_class(line.keys())
+            interned_columns = [column for column in cls._columns if column in interned]
+        record = cls(*[line[column] for column in cls._columns])
+        for column in interned_columns:
+            value = getattr(record, column)
+            setattr(record, column, strings.setdefault(value, value))
+        yield record
+
+
+def copy_list_records(lines, interned=()):
+    """
+    Convert a lazy cursor from psycopg2 to a list of compact records, see :func:`iter_records`
+
+    :param lines: The psycopg2 cursor with the query result
+    :param interned: The names of the columns whose values must be interned
+    :return: A list of records
+    """
+    return list(iter_records(lines, interned))
+
+
+# Backslash sequences of the text format of COPY
+_COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+_copy_escape = re.compile(  # pylint: disable=C0103
+    r'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))', re.S)
+
+# Types whose text representation is already the value returned by psycopg2: text, varchar,
+# bpchar and name
+COPY_TEXT_TYPES = (25, 1043, 1042, 19)
+
+
+def _copy_unescape(match):
+    octal, hexadecimal, char = match.groups()
+    if octal:
+        return chr(int(octal, 8))
+    if hexadecimal:
+        return chr(int(hexadecimal, 16))
+    return _COPY_ESCAPES.get(char, char)
+
+
+class CopyParser(object):
+    """ File like object that receives the output of a *COPY ... TO STDOUT* in text format and
+    parses every line into a compact record (see :class:`Record`) as it arrives, no row object
+    or dict is created by psycopg2 in between.
+
+    The columns that are not text are converted with the psycopg2 typecaster of their type, so
+    the records are the same the cursor would return. The values of the interned columns are
+    deduplicated as :func:`iter_records` does.
+    """
+
+    def __init__(self, columns, casts=(), interned=(), encoding='utf-8', cursor=None):
+        """
+        :param columns: The column names
+        :param casts: List of (column index, psycopg2 typecaster) for the non text columns
+        :param interned: The names of the columns whose values must be interned
+        :param encoding: Python name of the encoding of the connection, used on Python 3
+        :param cursor: The cursor passed to the typecasters
+        """
+        self.cls = record_class(columns)
+        self.casts = list(casts)
+        self.interned = [index for index, column in enumerate(columns) if column in interned]
+        self.encoding = encoding
+        self.cursor = cursor
+        self.strings = dict()
+        self.pending = ''
+        self.records = list()
+        self.size = 0
+
+    def write(self, data):
+        if not isinstance(data, str):
+            data = data.decode(self.encoding)
+        self.size += len(data)
+        # The server sends one line per row, but be ready for them to be split anyhow
+        lines = (self.pending + data if self.pending else data).split('\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.records.append(self.parse(line))
+
+    def parse(self, line):
+        values = line.split('\t')
+        if '\\' in line:
+            for index, value in enumerate(values):
+                if value == '\\N':
+                    values[index] = None
+                elif '\\' in value:
+                    values[index] = _copy_escape.sub(_copy_unescape, value)
+        for index, cast in self.casts:
+            if values[index] is not None:
+                values[index] = cast(values[index], self.cursor)
+        for index in self.interned:
+            values[index] = self.strings.setdefault(values[index], values[index])
+        return self.cls(*values)
+
+
+class ConnectionPool(object):
+    """ Keeps the psycopg2 connections open between PostgresConnector instances, so the
+    connection cost (TCP, authentication, backend fork) is paid once per database instead of
+    once per query. Connections are keyed by their connection string, at most *maxconn*
+    connections are opened for each key (further requests wait until one is returned) and the
+    idle ones are checked with a *SELECT 1* before being reused if they were idle longer than
+    *check_interval* seconds.
+    """
+
+    def __init__(self, maxconn=4, check_interval=30, timeout=None):
+        self.maxconn = maxconn
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.__idle = dict()
+        self.__used = dict()
+        self.__lock = threading.Condition(threading.RLock())
+
+    def getconn(self, str_conn):
+        """ Get a healthy connection for the connection string, a new one is opened if there is
+        no idle one and the limit has not been reached
+
+        :param str_conn: psycopg2 connection string
+        :return: An open psycopg2 connection
+        """
+        deadline = self.timeout and time.time() + self.timeout
+        with self.__lock:
+            while True:
+                idle = self.__idle.get(str_conn, [])
+                while idle:
+                    conn, since = idle.pop()
+                    if self._check(conn, since):
+                        self.__used[str_conn] = self.__used.get(str_conn, 0) + 1
+                        return conn
+                if self.__used.get(str_conn, 0) < self.maxconn:
+                    break
+                remaining = deadline and deadline - time.time()
+                if deadline and remaining <= 0:
+                    raise psycopg2.pool.PoolError('connection pool exhausted')
+                self.__lock.wait(remaining or None)
+            self.__used[str_conn] = self.__used.get(str_conn, 0) + 1
+        try:
+            logger.debug('Pool: opening a new connection')
+            return psycopg2.connect(str_conn)
+        except Exception:
+            self._release(str_conn)
+            raise
+
+    def putconn(self, str_conn, conn):
+        """ Return a connection to the pool, broken connections are discarded and the ones with
+        an open transaction are rolled back
+
+        :param str_conn: psycopg2 connection string used to get the connection
+        :param conn: The connection
+        """
+        if not conn.closed:
+            try:
+                conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                conn.close()
+        with self.__lock:
+            if not conn.closed:
+                self.__idle.setdefault(str_conn, []).append((conn, time.time()))
+            self._release(str_conn)
+
+    def closeall(self):
+        """ Close all the idle connections, the ones in use are closed when returned
+        """
+        with self.__lock:
+            for idle in self.__idle.values():
+                for conn, dummy in idle:
+                    conn.close()
+            self.__idle.clear()
+
+    def _check(self, conn, since):
+        if conn.closed:
+            return False
+        if time.time() - since < self.check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+        except psycopg2.Error:
+            logger.debug('Pool: discarding a broken connection')
+            conn.close()
+            return False
+        return True
+
+    def _release(self, str_conn):
+        with self.__lock:
+            self.__used[str_conn] -= 1
+            self.__lock.notify()
+
+
+_shared_pool = None
+
+
+def open_pool(maxconn=4, check_interval=30, timeout=None):
+    """ Open the pool shared by every PostgresConnector (and so every extractor) until
+    :func:`close_pool` is called, if it is already open the existing one is returned
+
+    :return: The shared ConnectionPool
+    """
+    global _shared_pool  # pylint: disable=W0603
+    if _shared_pool is None:
+        _shared_pool = ConnectionPool(maxconn, check_interval, timeout)
+    return _shared_pool
+
+
+def close_pool():
+    """ Close the shared pool and its connections, connectors created afterwards will open
+    their own connection again
+    """
+    global _shared_pool  # pylint: disable=W0603
+    if _shared_pool is not None:
+        _shared_pool.closeall()
+        _shared_pool = None
+
+
 class PostgresConnector(object):
-    """ A simple helper to perform a postgres connection, execute simple sql sentences
+    """ A simple helper to perform a postgres connection, execute simple sql sentences.
+    If a pool was opened (see :func:`open_pool`) or one is given in the *pool* config key the
+    connection is borrowed from it and returned on disconnect instead of being closed.
     """
     __conn = None
     __cursor = None
+    __pool = None
+    __released = False
     __allowed_keys = ['host', 'port', 'dbname', 'user', 'password']
     __str_conn = ''
+    __itersize = 2000
+    __stream_names = itertools.count()
 
     def __init__(self, config=None):
         if config is None:
             config = {}
-        for key, value in config.items():
+        for key, value in sorted(config.items()):
             if value is not None and key in self.__allowed_keys:
                 self.__str_conn = '%s %s=%s' % (self.__str_conn, key, value)
             elif key == 'dbname' and value is None:
@@ -65,9 +535,15 @@ class PostgresConnector(object):
         logger.debug('Connection string: %s', self.__str_conn)
         try:
             logger.debug('Stabilishing connection with db server')
-            self.__conn = psycopg2.connect(self.__str_conn)
+            self.__pool = config.get('pool', _shared_pool)
+            if self.__pool is not None:
+                self.__conn = self.__pool.getconn(self.__str_conn)
+            else:
+                self.__conn = psycopg2.connect(self.__str_conn)
             if config.get('isolation_level', False):
                 self.__conn.set_isolation_level(0)
+            if config.get('itersize'):
+                self.__itersize = config['itersize']
             self.__cursor = self.__conn.cursor(
                 cursor_factory=psycopg2.extras.DictCursor)
         except Exception as e:
@@ -78,7 +554,14 @@ class PostgresConnector(object):
             self.disconnect()
             raise
 
+    def _check_released(self):
+        if self.__released:
+            raise psycopg2.InterfaceError('connection already returned to the pool')
+
     def _execute(self, sql_str, *args):
+        self._check_released()
+        profiler = current_profiler()
+        start = time.time()
         try:
             logger.debug('SQL: %s', sql_str)
             self.__cursor.execute(sql_str, *args)
@@ -87,6 +570,10 @@ class PostgresConnector(object):
             raise
         else:
             self.__conn.commit()
+        if profiler is not None:
+            # The bytes are added by whoever reads the rows (see iter_records)
+            rows = self.__cursor.rowcount if self.__cursor.description is not None else 0
+            profiler.query(sql_str, time.time() - start, rows, 0)
 
     def execute_select(self, sql_str, *args):
         """ This method basically wraps *execute* cursor method from psycopg2,
@@ -100,6 +587,95 @@ class PostgresConnector(object):
         self._execute(sql_str, args)
         return self.__cursor
 
+    def execute_stream(self, sql_str, *args):
+        """ Execute the query in a named (server side) cursor and yield the rows lazily, only
+        *itersize* rows (see the config) are transferred and kept in memory at once.
+        The rows are plain dicts (RealDictCursor) so they don't need to be copied afterwards.
+
+        :param sql_str: Sql to be executed
+        :param args: Args, all will be passed to
+            `cursor.execute <http://initd.org/psycopg/docs/cursor.html#cursor.execute>`_
+        :return: A generator of dicts, one per row
+        """
+        self._check_released()
+        name = 'odoo_updates_stream_%s' % next(self.__stream_names)
+        cursor = self.__conn.cursor(name, cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.itersize = self.__itersize
+        try:
+            logger.debug('SQL (stream %s): %s', name, sql_str)
+            profiler = current_profiler()
+            if profiler is None:
+                cursor.execute(sql_str, args)
+                for row in cursor:
+                    yield row
+            else:
+                # Only the time spent in the database and fetching is measured, not the time
+                # the consumer takes with every row
+                start = time.time()
+                cursor.execute(sql_str, args)
+                seconds = time.time() - start
+                rows = size = 0
+                rows_iter = iter(cursor)
+                while True:
+                    start = time.time()
+                    row = next(rows_iter, None)
+                    seconds += time.time() - start
+                    if row is None:
+                        break
+                    rows += 1
+                    size += payload_size(row.values())
+                    yield row
+                profiler.query(sql_str, seconds, rows, size)
+        except Exception:
+            cursor.close()
+            self.__conn.rollback()
+            raise
+        finally:
+            if not cursor.closed:
+                cursor.close()
+        self.__conn.commit()
+
+    def execute_copy(self, sql_str, args=(), interned=()):
+        """ Transfer the result of the query with *COPY (query) TO STDOUT* and parse it into
+        compact records (see :class:`CopyParser`). There is a single round-trip for the rows and
+        no per row overhead in psycopg2, which makes it two to three times faster than the
+        cursors on big tables. The columns and their types are read first with an empty
+        (LIMIT 0) select.
+
+        :param sql_str: Select to be executed, without a trailing semicolon if possible
+        :param args: Args of the select, they are bound client side
+        :param interned: The names of the columns whose values must be interned
+        :return: A list of records
+        """
+        self._check_released()
+        sql_str = sql_str.strip().rstrip(';')
+        self._execute('SELECT * FROM ({0}) AS copy_source LIMIT 0'.format(sql_str), args)
+        columns = [column[0] for column in self.__cursor.description]
+        casts = [(index, psycopg2.extensions.string_types[column[1]])
+                 for index, column in enumerate(self.__cursor.description)
+                 if column[1] not in COPY_TEXT_TYPES and
+                 column[1] in psycopg2.extensions.string_types]
+        parser = CopyParser(columns, casts, interned,
+                            psycopg2.extensions.encodings.get(self.__conn.encoding, 'utf-8'),
+                            self.__cursor)
+        sql_select = self.__cursor.mogrify(sql_str, args) if args else sql_str
+        if not isinstance(sql_select, str):
+            sql_select = sql_select.decode(parser.encoding)
+        sql_copy = 'COPY ({0}) TO STDOUT'.format(sql_select)
+        start = time.time()
+        try:
+            logger.debug('SQL (copy): %s', sql_str)
+            self.__cursor.copy_expert(sql_copy, parser)
+        except Exception:
+            self.__conn.rollback()
+            raise
+        else:
+            self.__conn.commit()
+        profiler = current_profiler()
+        if profiler is not None:
+            profiler.query(sql_str, time.time() - start, len(parser.records), parser.size)
+        return parser.records
+
     def execute_change(self, sql_str, *args):
         self._execute(sql_str, args)
         return True
@@ -119,11 +695,31 @@ class PostgresConnector(object):
             return False
         return True
 
+    def server_address(self):
+        """ Get the host and port the connection was made to, with the libpq defaults applied.
+        The host is the socket directory for a Unix socket connection
+
+        :return: A (host, port) tuple of strings
+        """
+        self._check_released()
+        try:
+            params = self.__conn.get_dsn_parameters()
+        except AttributeError:
+            # psycopg2 < 2.7, only the parameters given and the environment are known
+            params = dict(item.split('=', 1) for item in self.__str_conn.split())
+        return (params.get('host') or os.environ.get('PGHOST', ''),
+                params.get('port') or os.environ.get('PGPORT', '5432'))
+
     def disconnect(self):
         if self.__cursor:
             logger.debug('disconnect: closing cursor')
             self.__cursor.close()
-        if self.__conn:
+        if self.__conn and self.__pool is not None:
+            if not self.__released:
+                logger.debug('disconnect: returning connection to the pool')
+                self.__released = True
+                self.__pool.putconn(self.__str_conn, self.__conn)
+        elif self.__conn:
             logger.debug('disconnect: closing connection')
             self.__conn.close()
 
@@ -137,8 +733,306 @@ class PostgresConnector(object):
         return self
 
 
-def send_message(message, queue_name):
-    resource = boto3.resource('sqs')
-    queue = resource.get_queue_by_name(QueueName=queue_name)
-    response = queue.send_message(MessageBody=message)
-    return response
+def run_parallel(tasks, jobs=4):
+    """ Run the tasks on a pool of at most *jobs* threads, the database extractions are I/O bound
+    so threads are enough. If any task fails its exception is raised once all are finished
+
+    :param tasks: List of (function, args) tuples
+    :param jobs: Maximum number of tasks running at the same time, 1 runs them sequentially
+    :return: List with the result of each task, in the same order
+    """
+    if jobs <= 1 or len(tasks) <= 1:
+        return [function(*args) for function, args in tasks]
+    workers = ThreadPool(min(jobs, len(tasks)))
+    try:
+        return workers.map(lambda task: task[0](*task[1]), tasks)
+    finally:
+        workers.close()
+        workers.join()
+
+
+def stream_select(config, sql_str, *args):
+    """ Open a connection with the given config and lazily yield the rows of the query using a
+    server side cursor, the connection is closed once all the rows are consumed
+
+    :param config: PostgresConnector config, may include the *itersize*
+    :param sql_str: Sql to be executed
+    :param args: Args to be passed to the query
+    :return: A generator of dicts, one per row
+    """
+    with PostgresConnector(config) as conn:
+        for row in conn.execute_stream(sql_str, *args):
+            yield row
+
+
+def copy_select(config, sql_str, args=(), interned=()):
+    """ Open a connection with the given config and get the records of the query transferred
+    with COPY, see :meth:`PostgresConnector.execute_copy`
+
+    :return: A list of records
+    """
+    with PostgresConnector(config) as conn:
+        return conn.execute_copy(sql_str, args, interned)
+
+
+SQS_MAX_SIZE = 256 * 1024
+SQS_MAX_BATCH = 10
+
+_sqs_client = None  # pylint: disable=C0103
+_queue_urls = dict()  # pylint: disable=C0103
+_sqs_lock = threading.Lock()  # pylint: disable=C0103
+
+
+class PublishError(Exception):
+    """ Raised when some messages could not be sent to the queue
+    """
+
+
+def sqs_client():
+    """ Get the SQS client shared by all the publishers, it is created only once
+
+    :return: A boto3 SQS client
+    """
+    global _sqs_client  # pylint: disable=W0603,C0103
+    with _sqs_lock:
+        if _sqs_client is None:
+            _sqs_client = boto3.client('sqs')
+        return _sqs_client
+
+
+class QueuePublisher(object):
+    """ Send messages to a SQS queue. The client and the queue url are looked up once and reused.
+
+    The message is zlib compressed and base64 encoded, then split in chunks small enough that
+    *max_batch* of them fit in one batch request. Each message sent is a json object with the
+    *id* of the whole message and a *type*:
+
+    - message: the message fits in one chunk, *data* has all of it
+    - manifest: the message was split, *parts* has the number of chunks, *size* and *sha1* the
+      length and digest of the original message so the consumer can verify it
+    - chunk: the part number *part* of the message with its piece of *data*
+
+    :class:`MessageAssembler` rebuilds the original messages from them. Without compression a
+    message that fits in one SQS message is sent as is.
+    """
+
+    overhead = 256
+
+    def __init__(self, queue_name, client=None, compress=True, max_size=SQS_MAX_SIZE,
+                 max_batch=SQS_MAX_BATCH, retries=3):
+        self.queue_name = queue_name
+        self.client = client or sqs_client()
+        self.compress = compress
+        self.max_size = max_size
+        self.max_batch = max_batch
+        self.retries = retries
+
+    @property
+    def queue_url(self):
+        key = (id(self.client), self.queue_name)
+        with _sqs_lock:
+            if key not in _queue_urls:
+                _queue_urls[key] = self.client.get_queue_url(
+                    QueueName=self.queue_name)['QueueUrl']
+            return _queue_urls[key]
+
+    def encode(self, message):
+        """ Get the bodies to be sent for the message
+
+        :param message: The message, usually the output of :func:`jsonify`
+        :return: List of strings
+        """
+        if not isinstance(message, bytes):
+            message = message.encode('utf-8')
+        if not self.compress and len(message) <= self.max_size:
+            return [message.decode('utf-8')]
+        if self.compress:
+            encoding = 'zlib+base64'
+            data = base64.b64encode(zlib.compress(message)).decode('ascii')
+        else:
+            encoding = 'base64'
+            data = base64.b64encode(message).decode('ascii')
+        message_id = uuid.uuid4().hex
+        chunk_size = self.max_size // self.max_batch - self.overhead
+        if chunk_size < self.overhead:
+            # Too small to fill a batch, one chunk per message then
+            chunk_size = self.max_size - self.overhead
+        if len(data) <= chunk_size:
+            return [_encode({'id': message_id, 'type': 'message', 'encoding': encoding,
+                             'data': data})]
+        bodies = [_encode({'id': message_id, 'type': 'manifest', 'encoding': encoding,
+                           'parts': (len(data) + chunk_size - 1) // chunk_size,
+                           'size': len(message), 'sha1': hashlib.sha1(message).hexdigest()})]
+        for part, start in enumerate(range(0, len(data), chunk_size)):
+            bodies.append(_encode({'id': message_id, 'type': 'chunk', 'part': part,
+                                   'data': data[start:start + chunk_size]}))
+        return bodies
+
+    def batches(self, bodies):
+        """ Group the bodies in batches of at most *max_batch* messages and *max_size* bytes
+        """
+        batch = list()
+        size = 0
+        for body in bodies:
+            length = len(body.encode('utf-8'))
+            if batch and (len(batch) == self.max_batch or size + length > self.max_size):
+                yield batch
+                batch = list()
+                size = 0
+            batch.append(body)
+            size += length
+        if batch:
+            yield batch
+
+    def publish(self, message):
+        """ Send the message, the messages that fail are retried *retries* times
+
+        :param message: The message, usually the output of :func:`jsonify`
+        :return: The number of SQS messages sent
+        """
+        bodies = self.encode(message)
+        if len(bodies) == 1:
+            self.client.send_message(QueueUrl=self.queue_url, MessageBody=bodies[0])
+            return 1
+        for batch in self.batches(bodies):
+            entries = dict((str(index), body) for index, body in enumerate(batch))
+            for dummy in range(self.retries + 1):
+                response = self.client.send_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[{'Id': key, 'MessageBody': body}
+                             for key, body in sorted(entries.items())])
+                failed = response.get('Failed') or []
+                entries = dict((fail['Id'], entries[fail['Id']]) for fail in failed)
+                if not entries:
+                    break
+                logger.debug('Retrying %s messages: %s', len(entries), failed)
+            else:
+                raise PublishError('{0} messages could not be sent to {1}: {2}'.format(
+                    len(entries), self.queue_name, failed))
+        return len(bodies)
+
+
+class MessageAssembler(object):
+    """ Rebuild the messages sent by :class:`QueuePublisher`, the bodies may arrive in any order
+    and interleaved with the ones of other messages. The parts of a message that is not complete
+    after *ttl* seconds are discarded, one of its bodies was lost.
+    """
+
+    def __init__(self, ttl=3600):
+        self.pending = dict()
+        self.ttl = ttl
+
+    def expire(self):
+        """ Discard the incomplete messages whose first part arrived more than *ttl* seconds ago
+        """
+        limit = time.time() - self.ttl
+        for message_id, pending in list(self.pending.items()):
+            if pending['received'] < limit:
+                logger.warning('Discarding the incomplete message %s, %s of its parts arrived',
+                               message_id, len(pending['chunks']))
+                del self.pending[message_id]
+
+    def add(self, body):
+        """ Add a received body
+
+        :param body: The body of a SQS message
+        :return: The original message once all its parts are received, None otherwise
+        """
+        self.expire()
+        try:
+            content = json.loads(body)
+        except ValueError:
+            return body
+        if not isinstance(content, dict) or \
+                content.get('type') not in ('message', 'manifest', 'chunk'):
+            return body
+        if content['type'] == 'message':
+            return self.decode(content['encoding'], content['data'])
+        pending = self.pending.setdefault(content['id'],
+                                          {'chunks': dict(), 'received': time.time()})
+        if content['type'] == 'manifest':
+            pending['manifest'] = content
+        else:
+            pending['chunks'][content['part']] = content['data']
+        manifest = pending.get('manifest')
+        if not manifest or len(pending['chunks']) < manifest['parts']:
+            return None
+        del self.pending[content['id']]
+        data = ''.join(pending['chunks'][part] for part in range(manifest['parts']))
+        message = self.decode(manifest['encoding'], data)
+        if len(message) != manifest['size'] or \
+                hashlib.sha1(message).hexdigest() != manifest['sha1']:
+            raise ValueError('Message {0} is corrupted'.format(content['id']))
+        return message
+
+    @staticmethod
+    def decode(encoding, data):
+        message = base64.b64decode(data)
+        if encoding == 'zlib+base64':
+            message = zlib.decompress(message)
+        return message
+
+
+class LocalQueueClient(object):
+    """ In memory stand-in for the boto3 SQS client, implements the calls used by this package
+    with the same arguments and limits so the publisher can be used without AWS (tests, local
+    runs). Received messages are removed right away, there is no visibility timeout.
+    """
+
+    def __init__(self, max_size=SQS_MAX_SIZE):
+        self.max_size = max_size
+        self.queues = dict()
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+
+    def get_queue_url(self, QueueName):  # pylint: disable=C0103
+        with self.condition:
+            self.queues.setdefault(QueueName, list())
+        return {'QueueUrl': QueueName}
+
+    def send_message(self, QueueUrl, MessageBody):  # pylint: disable=C0103
+        if len(MessageBody.encode('utf-8')) > self.max_size:
+            raise ValueError('Message must be shorter than {0} bytes'.format(self.max_size))
+        with self.condition:
+            message_id = str(next(self.counter))
+            self.queues.setdefault(QueueUrl, list()).append(
+                {'MessageId': message_id, 'ReceiptHandle': message_id, 'Body': MessageBody})
+            self.condition.notify_all()
+        return {'MessageId': message_id}
+
+    def send_message_batch(self, QueueUrl, Entries):  # pylint: disable=C0103
+        if len(Entries) > SQS_MAX_BATCH:
+            raise ValueError('Too many entries in the batch')
+        if sum(len(entry['MessageBody'].encode('utf-8')) for entry in Entries) > self.max_size:
+            raise ValueError('Batch requests must be shorter than {0} bytes'.format(
+                self.max_size))
+        return {'Successful': [
+            {'Id': entry['Id'],
+             'MessageId': self.send_message(QueueUrl, entry['MessageBody'])['MessageId']}
+            for entry in Entries]}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1,  # pylint: disable=C0103
+                        WaitTimeSeconds=0):
+        deadline = time.time() + WaitTimeSeconds
+        with self.condition:
+            queue = self.queues.setdefault(QueueUrl, list())
+            while not queue and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            messages = queue[:MaxNumberOfMessages]
+            del queue[:MaxNumberOfMessages]
+        return {'Messages': messages} if messages else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):  # pylint: disable=C0103,W0613
+        return {}
+
+
+def send_message(message, queue_name, client=None):
+    """ Send the message to the queue, compressed and chunked if needed (see
+    :class:`QueuePublisher`)
+
+    :param message: The message, usually the output of :func:`jsonify`
+    :param queue_name: The name of the SQS queue
+    :param client: SQS client to use instead of the shared boto3 one
+    :return: The number of SQS messages sent
+    """
+    return QueuePublisher(queue_name, client).publish(message)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Long running worker that takes the diff jobs from a queue and sends their results, so the
+connections, the snapshots of the original databases and the imports are reused by all the
+jobs instead of being set up by every invocation of updatesv.
+
+A job is a json object with the *command* (views, translations, menus, fields, getall,
+branches or any of the KEYED_DOMAINS), the *original* and *updated* databases (a list to
+compare many of them), the *customer* and *instance* of the message and, optionally, the
+*queue* the result is sent to and the *options* of the command line: fingerprint, itersize,
+copy, modules, changed_modules, langs, translation_types, partition, split and profile.
+"""
+
+import json
+import logging
+import threading
+from . import metrics
+from . import odoo_updates
+from . import utils
+
+logger = logging.getLogger('deployv')  # pylint: disable=C0103
+
+
+def submit(job, queue_name, client=None):
+    """ Send a job to the queue of the workers
+
+    :param job: dict with the job (see the module documentation)
+    :param queue_name: The name of the queue the workers take the jobs from
+    :param client: SQS client to use instead of the shared boto3 one
+    :return: The number of SQS messages sent
+    """
+    return utils.send_message(json.dumps(job), queue_name, client)
+
+
+class DiffWorker(object):
+    """ Take the jobs from the *queue_name* queue, run them one after the other and send every
+    result with :func:`utils.jsonify` and :func:`utils.send_message`, as updatesv does.
+
+    The connection pool is opened once for all the jobs and the *cache* (usually a
+    cache.MemorySnapshotCache) and *incremental* store are shared by them. The messages are
+    deleted once received: a job that fails is answered with its error, it is not retried, and
+    a message that can not be read or answered is logged and discarded.
+    """
+
+    def __init__(self, queue_name, results_queue=None, client=None, cache=None,
+                 incremental=None, pool_size=4, jobs=4, wait=20):
+        """
+        :param queue_name: The queue the jobs are taken from
+        :param results_queue: The queue the results are sent to if the job does not say
+        :param client: SQS client (or utils.LocalQueueClient) for both queues, the shared boto3
+            one by default
+        :param cache: cache.SnapshotCache for the original databases
+        :param incremental: cache.IncrementalStore to extract the databases incrementally
+        :param pool_size: Maximum number of connections kept open for each database
+        :param jobs: Maximum number of extractions of a job running at the same time
+        :param wait: Seconds to wait for new jobs on each request to the queue
+        """
+        self.queue_name = queue_name
+        self.results_queue = results_queue
+        self.client = client or utils.sqs_client()
+        self.cache = cache
+        self.incremental = incremental
+        self.pool_size = pool_size
+        self.jobs = jobs
+        self.wait = wait
+        self.assembler = utils.MessageAssembler()
+        self.stopped = threading.Event()
+
+    def stop(self):
+        """ Stop once the job running, if any, is finished
+        """
+        self.stopped.set()
+
+    def serve(self, max_jobs=None):
+        """ Take and run the jobs until :meth:`stop` is called
+
+        :param max_jobs: If given, stop after this many jobs
+        :return: The number of jobs run
+        """
+        queue_url = utils.QueuePublisher(self.queue_name, self.client).queue_url
+        utils.open_pool(self.pool_size)
+        done = 0
+        try:
+            while not self.stopped.is_set() and (max_jobs is None or done < max_jobs):
+                response = self.client.receive_message(
+                    QueueUrl=queue_url, MaxNumberOfMessages=utils.SQS_MAX_BATCH,
+                    WaitTimeSeconds=self.wait)
+                for message in response.get('Messages', []):
+                    self.client.delete_message(QueueUrl=queue_url,
+                                               ReceiptHandle=message['ReceiptHandle'])
+                    # The message is already deleted, whatever fails only loses this job
+                    try:
+                        body = self.assembler.add(message['Body'])
+                        if body is None:
+                            continue
+                        self.handle(body)
+                    except Exception:  # pylint: disable=W0703
+                        logger.exception('Discarding the message %s',
+                                         message.get('MessageId'))
+                    done += 1
+        finally:
+            utils.close_pool()
+        return done
+
+    def handle(self, body):
+        """ Run the job of a message and send its result, or its error if it failed
+
+        :param body: The message with the job
+        """
+        try:
+            job = json.loads(body)
+        except ValueError:
+            job = None
+        if not isinstance(job, dict):
+            logger.error('Discarding a message that is not a job: %r', body[:200])
+            return
+        queue = job.get('queue') or self.results_queue
+        options = job.get('options') or dict()
+        profiler = metrics.start_profiling() if options.get('profile') else None
+        try:
+            states = self.run(job)
+        except Exception as error:  # pylint: disable=W0703
+            logger.exception('Job %s failed', job.get('command'))
+            states = {'error': '{0}: {1}'.format(type(error).__name__, error)}
+        finally:
+            if profiler is not None:
+                metrics.stop_profiling()
+        if not queue:
+            logger.error('No queue to send the result of %s', job.get('command'))
+            return
+        results = [states]
+        if options.get('split') and isinstance(job.get('updated'), list) and \
+                isinstance(states, dict) and 'error' not in states:
+            results = [{database: result} for database, result in states.items()]
+        profile = profiler and profiler.to_dict()
+        for result in results:
+            message = utils.jsonify(result, job.get('command'), job.get('customer'),
+                                    job.get('instance'), profile)
+            utils.send_message(message, queue, self.client)
+
+    def run(self, job):
+        """ Run a job
+
+        :param job: dict with the job (see the module documentation)
+        :return: The result of the command
+        """
+        command = job['command']
+        options = job.get('options') or dict()
+        # Every job is a run: the tables of the snapshots are probed again
+        for store in (self.cache, self.incremental):
+            if store is not None:
+                store.reset()
+        original = job.get('original')
+        updated = job.get('updated')
+        # As the command line, many updated databases give a result by database name
+        if isinstance(updated, list) and len(updated) == 1:
+            updated = updated[0]
+        modules = options.get('modules') or None
+        if options.get('changed_modules'):
+            with metrics.phase('modules'):
+                modules = sorted(set(modules or ()).union(
+                    odoo_updates.changed_modules(original, updated)))
+        fingerprint = options.get('fingerprint', False)
+        itersize = options.get('itersize')
+        copy = options.get('copy', False)
+        langs = options.get('langs') or None
+        types = options.get('translation_types') or None
+        if command == 'branches':
+            return odoo_updates.get_branches(jobs=self.jobs)
+        if command == 'getall':
+            return odoo_updates.get_all_diff(original, updated, fingerprint, itersize,
+                                             self.jobs, self.cache, self.incremental, copy,
+                                             modules, langs, types)
+        if command == 'menus':
+            return odoo_updates.get_menus_diff(original, updated, self.cache, self.jobs,
+                                               modules)
+        if command == 'translations':
+            return odoo_updates.get_translations_diff(
+                original, updated, fingerprint, itersize, self.cache, self.incremental,
+                self.jobs, copy, modules, langs, types, options.get('partition'))
+        if command in odoo_updates.KEYED_DOMAINS:
+            return odoo_updates.get_keyed_diff(command, original, updated, fingerprint,
+                                               itersize, self.cache, self.incremental,
+                                               self.jobs, copy, modules)
+        raise ValueError('Unknown command {0}'.format(command))
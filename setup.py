@@ -59,5 +59,6 @@ setup(
     entry_points='''
         [console_scripts]
         updatesv=odoo_updates.scripts.updatesv:cli
+        updatesv-worker=odoo_updates.scripts.worker:main
     ''',
 )
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from unittest2 import TestCase
+from odoo_updates import metrics
+from odoo_updates import utils
+from odoo_updates.cache import MemorySnapshotCache, SnapshotCache
+import os
+import shutil
+import tempfile
+
+
+class TestCache(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = tempfile.mkdtemp()
+        with utils.PostgresConnector({'dbname': 'tests'}) as conn:
+            conn.execute_change('CREATE TABLE cache_test (id integer, value varchar)')
+            conn.execute_change("INSERT INTO cache_test VALUES (1, 'one')")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+        with utils.PostgresConnector({'dbname': 'tests'}) as conn:
+            conn.execute_change('DROP TABLE cache_test')
+
+    def extract(self):
+        self.calls += 1
+        with utils.PostgresConnector({'dbname': 'tests'}) as conn:
+            return utils.copy_list_records(conn.execute_select('SELECT * FROM cache_test'))
+
+    def setUp(self):
+        self.calls = 0
+        self.cache = SnapshotCache(self.path)
+        self.cache.clear()
+
+    def test_01_snapshot(self):
+        res = self.cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        self.assertEquals(res, [{'id': 1, 'value': 'one'}])
+        cached = self.cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        self.assertEquals(cached, res)
+        self.assertIsInstance(cached[0], utils.Record)
+        self.assertEquals(self.calls, 1)
+        self.cache.snapshot('tests', ('cache_test',), 'other_key', self.extract)
+        self.assertEquals(self.calls, 2)
+
+    def test_02_snapshot_invalidated(self):
+        self.cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        with utils.PostgresConnector({'dbname': 'tests'}) as conn:
+            conn.execute_change("UPDATE cache_test SET value = 'uno'")
+        self.cache.reset()
+        res = self.cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        self.assertEquals(self.calls, 2)
+        self.assertEquals(res, [{'id': 1, 'value': 'uno'}])
+
+    def test_03_evict(self):
+        self.cache.max_size = 0
+        self.cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        self.assertEquals(os.listdir(self.path), [])
+        self.cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        self.assertEquals(self.calls, 2)
+
+    def test_04_memory_snapshot(self):
+        cache = MemorySnapshotCache(self.path, entries=1)
+        res = cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        # Served from memory even without the file
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+        self.assertIs(cache.snapshot('tests', ('cache_test',), 'key', self.extract), res)
+        self.assertEquals(self.calls, 1)
+        cache.snapshot('tests', ('cache_test',), 'other_key', self.extract)
+        self.assertEquals(len(cache.memory), 1)
+        cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        self.assertEquals(self.calls, 3)
+        with utils.PostgresConnector({'dbname': 'tests'}) as conn:
+            conn.execute_change('UPDATE cache_test SET value = value')
+        cache.reset()
+        self.assertEquals(cache.snapshot('tests', ('cache_test',), 'key', self.extract), res)
+        self.assertEquals(self.calls, 4)
+
+    def test_05_untracked_change(self):
+        # The statistics counters do not see this change, the rows do
+        self.cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        with utils.PostgresConnector({'dbname': 'tests'}) as conn:
+            conn.execute_change("SET track_counts = off; UPDATE cache_test SET value = 'one'")
+        self.cache.reset()
+        res = self.cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        self.assertEquals(self.calls, 2)
+        self.assertEquals(res, [{'id': 1, 'value': 'one'}])
+
+    def test_06_identity(self):
+        with utils.PostgresConnector({'dbname': 'tests'}) as conn:
+            address = conn.server_address()
+        self.assertEquals(self.cache.identity('tests')[-2:], address)
+        self.assertEquals(self.cache.probe('tests', ('cache_test', 'missing'))[1][0][:2],
+                          ('cache_test', 1))
+
+    def test_07_memory_index(self):
+        cache = MemorySnapshotCache(self.path, entries=1)
+        builds = list()
+
+        def build(data):
+            builds.append(data)
+            return dict((record['id'], record) for record in data)
+        res = cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        index = cache.index(res, build)
+        self.assertIs(cache.index(cache.snapshot('tests', ('cache_test',), 'key', self.extract),
+                                  build), index)
+        self.assertEquals(len(builds), 1)
+        # Data that is not kept in memory is indexed every time
+        self.assertEquals(cache.index(list(res), build), index)
+        self.assertEquals(len(builds), 2)
+        cache.snapshot('tests', ('cache_test',), 'other_key', self.extract)
+        self.assertEquals(cache.indexes, {})
+        self.assertEquals(self.cache.index(res, build), index)
+        self.assertEquals(len(builds), 3)
+
+    def test_08_probe_once_per_run(self):
+        profiler = metrics.start_profiling()
+        try:
+            for key in ('key', 'other_key'):
+                self.cache.snapshot('tests', ('cache_test',), key, self.extract)
+            self.cache.reset()
+            self.cache.snapshot('tests', ('cache_test',), 'key', self.extract)
+        finally:
+            metrics.stop_profiling()
+        # The table is scanned once by run, whatever the number of snapshots that read it
+        self.assertEquals(len([query for query in profiler.queries
+                               if 'xmin' in query['sql']]), 2)
+        self.assertEquals(self.calls, 2)
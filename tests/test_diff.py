@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from unittest2 import TestCase
+from odoo_updates import diff
+import difflib
+import random
+
+
+class TestDiff(TestCase):
+
+    def test_01_engines(self):
+        rand = random.Random(7)
+        for dummy in range(200):
+            a = [rand.choice('abcdef') for dummy in range(rand.randint(0, 20))]
+            b = [rand.choice('abcdef') for dummy in range(rand.randint(0, 20))]
+            for name, engine in diff.ENGINES.items():
+                blocks = engine(a, b)
+                for i, j, size in blocks:
+                    self.assertEquals(a[i:i + size], b[j:j + size], name)
+                original = list()
+                modified = list()
+                for dummy, i1, i2, j1, j2 in diff.get_opcodes(blocks, len(a), len(b)):
+                    original.extend(a[i1:i2])
+                    modified.extend(b[j1:j2])
+                self.assertEquals((original, modified), (a, b), name)
+
+    def test_02_unified_diff(self):
+        a = ['<form>', '<field name="a"/>', '<field name="b"/>', '</form>']
+        b = ['<form>', '<field name="a"/>', '<field name="c"/>', '</form>']
+        expected = list(difflib.unified_diff(a, b, lineterm=''))
+        for name in diff.ENGINES:
+            self.assertEquals(diff.Differ(name).unified_diff(a, b), expected)
+        self.assertEquals(diff.Differ().unified_diff(a, a), [])
+
+    def test_03_patience(self):
+        # The unique line is matched first even if it moved across the repeated blocks
+        a = ['<div>', '<span/>', '</div>'] * 3 + ['<p>unique</p>']
+        b = ['<p>unique</p>'] + ['<div>', '<span/>', '</div>'] * 3
+        self.assertIn(' <p>unique</p>', diff.Differ('patience').unified_diff(a, b))
+        self.assertNotIn(' <p>unique</p>', diff.Differ('myers').unified_diff(a, b))
+
+    def test_04_budget(self):
+        a = [str(index) for index in range(1000)]
+        b = list(reversed(a))
+        res = diff.Differ('myers', timeout=0).unified_diff(a, b)
+        self.assertEquals(res[2], '@@ -1,1000 +1,1000 @@ replaced')
+        self.assertEquals(res[3:], ['-' + line for line in a] + ['+' + line for line in b])
+        res = diff.Differ(max_lines=10).unified_diff(a[:6], b[:6])
+        self.assertEquals(res[2], '@@ -1,6 +1,6 @@ replaced')
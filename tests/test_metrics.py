@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from functools import partial
+from unittest2 import TestCase
+from odoo_updates import metrics
+from odoo_updates import utils
+import simplejson as json
+
+
+class TestMetrics(TestCase):
+
+    def tearDown(self):
+        metrics.stop_profiling()
+
+    def test_01_phase_without_profiler(self):
+        self.assertIsNone(metrics.current_profiler())
+        with metrics.phase('nothing'):
+            pass
+        self.assertEquals(metrics.profiled('nothing', len)([1, 2]), 2)
+        self.assertEquals(metrics.profiled('nothing', partial(len, [1]))(), 1)
+
+    def test_02_queries(self):
+        profiler = metrics.start_profiling()
+        with metrics.phase('select'):
+            with utils.PostgresConnector({'dbname': 'tests'}) as conn:
+                res = utils.copy_list_records(
+                    conn.execute_select("SELECT 'abc' AS name, 1 AS number"))
+        self.assertEquals(res, [{'name': 'abc', 'number': 1}])
+        with metrics.phase('stream'):
+            rows = list(utils.stream_select({'dbname': 'tests', 'itersize': 2},
+                                            'SELECT generate_series(1, 5) AS number'))
+        self.assertEquals(len(rows), 5)
+        res = profiler.to_dict()
+        self.assertEquals(list(res['phases']), ['select', 'stream'])
+        self.assertEquals(res['phases']['select']['queries'], 1)
+        self.assertEquals(res['phases']['select']['rows'], 1)
+        self.assertEquals(res['phases']['select']['bytes'], 11)
+        self.assertEquals(res['phases']['stream']['rows'], 5)
+        self.assertEquals(res['phases']['stream']['bytes'], 40)
+        self.assertGreaterEqual(res['phases']['stream']['peak_memory'], 0)
+        self.assertEquals([query['phase'] for query in res['queries']], ['select', 'stream'])
+        self.assertEquals(len(metrics.summary_lines(res)), 4)
+        self.assertIs(metrics.stop_profiling(), profiler)
+
+    def test_03_jsonify_metrics(self):
+        profiler = metrics.start_profiling()
+        with metrics.phase('compare'):
+            pass
+        res = json.loads(utils.jsonify({}, 'test', 'test', 'updates', profiler.to_dict()))
+        self.assertEquals(res['metrics']['phases']['compare']['calls'], 1)
+        self.assertNotIn('metrics', json.loads(utils.jsonify({}, 'test', 'test', 'updates')))
+
+    def test_04_peak_memory_by_phase(self):
+        profiler = metrics.start_profiling()
+        size = 64 * 1024 * 1024
+        with metrics.phase('outer'):
+            with metrics.phase('allocate'):
+                data = ' ' * size
+                del data
+            with metrics.phase('small'):
+                data = ' ' * 1024
+                del data
+        res = profiler.to_dict()['phases']
+        self.assertGreater(res['allocate']['peak_memory'], size / 2)
+        # The peak of an earlier phase is not reported by the next ones, only by the ones open
+        self.assertLess(res['small']['peak_memory'], size / 2)
+        self.assertGreater(res['outer']['peak_memory'], size / 2)
+
+    def test_05_equal_spans(self):
+        tracker = metrics.MemoryTracker()
+        first = tracker.start()
+        second = tracker.start()
+        second[:] = first
+        tracker.stop(second)
+        self.assertIs(tracker.spans[0], first)
+        tracker.stop(first)
+        self.assertEquals(tracker.spans, [])
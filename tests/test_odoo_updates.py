@@ -1,6 +1,15 @@
 from unittest2 import TestCase
+from odoo_updates import metrics
 from odoo_updates import odoo_updates
+from odoo_updates import utils
+from odoo_updates.cache import IncrementalStore, SnapshotCache
+import hashlib
+import os
+import psycopg2
 import shlex
+import shutil
+import tempfile
+from StringIO import StringIO
 import spur
 import simplejson as json
 from jsonschema import validate
@@ -39,13 +48,16 @@ class TestOdooUpdates(TestCase):
         self.assertEquals(len(res['updated']), 1)
         self.assertEquals(res['updated'][0]['original'], 'test_menu_1')
         self.assertNotEqual(res['updated'][0]['original'], res['updated'][0]['modified'])
+        self.assertEquals(res['added'][0]['hierarchypath'], 'test_menu_2->test_menu_4')
+        self.assertEquals(res['deleted'][0]['hierarchypath'], 'test_menu_2->test_menu_3')
+        self.assertEquals(res['moved'], [])
 
     def test_04_get_translations(self):
         res = odoo_updates.get_translations('test_original')
         self.assertEquals(len(res), 2)
         self.assertIsInstance(res, list)
         for record in res:
-            self.assertIsInstance(record, dict)
+            self.assertIsInstance(record, utils.Record)
 
     def test_05_compare_translations(self):
         original = odoo_updates.get_translations('test_original')
@@ -82,7 +94,7 @@ class TestOdooUpdates(TestCase):
         self.assertEquals(len(res), 2)
         self.assertIsInstance(res, list)
         for record in res:
-            self.assertIsInstance(record, dict)
+            self.assertIsInstance(record, utils.Record)
 
     def test_08_compare_views(self):
         original = odoo_updates.get_views('test_original')
@@ -94,6 +106,8 @@ class TestOdooUpdates(TestCase):
         self.assertEquals(len(res['updated']), 1)
         self.assertEquals(res['updated'][0]['xml_id'], 'test_module.test_model_5')
         self.assertNotEqual(res['updated'][0]['original'], res['updated'][0]['modified'])
+        self.assertEquals(len(res['deleted']), 1)
+        self.assertEquals(res['deleted'][0]['xml_id'], 'test_module.test_model_6')
 
     def test_09_get_views_diff(self):
         res = odoo_updates.get_views_diff('test_original', 'test_updated')
@@ -103,13 +117,24 @@ class TestOdooUpdates(TestCase):
         self.assertEquals(len(res['updated']), 1)
         self.assertEquals(res['updated'][0]['xml_id'], 'test_module.test_model_5')
         self.assertNotEqual(res['updated'][0]['original'], res['updated'][0]['modified'])
+        self.assertEquals(len(res['deleted']), 1)
+        self.assertEquals(res['deleted'][0]['xml_id'], 'test_module.test_model_6')
 
     def test_10_get_branches(self):
-        res = odoo_updates.get_branches()
+        instance = tempfile.mkdtemp()
+        path = os.path.join(instance, 'backupws')
+        shell = spur.LocalShell()
+        shell.run(['git', 'init', '-q', path])
+        shell.run(['git', 'remote', 'add', 'origin', 'https://github.com/Vauxoo/backupws.git'],
+                  cwd=path)
+        res = odoo_updates.get_branches(instance)
         self.assertIsInstance(res, list)
         self.assertEquals(len(res), 1)
         self.assertIsInstance(res[0], dict)
         self.assertEquals(res[0]['name'], 'backupws')
+        self.assertEquals(res[0]['repo_url'], {'origin': 'https://github.com/Vauxoo/backupws.git'})
+        odoo_updates.branches_to_screen(res)
+        shutil.rmtree(instance)
 
     def test_11_diff_to_screen(self):
         views = odoo_updates.get_views_diff('test_original', 'test_updated')
@@ -120,6 +145,24 @@ class TestOdooUpdates(TestCase):
         odoo_updates.diff_to_screen(menus, 'test_menus')
         # TODO how to test this functions?
 
+    def test_11_screen_renderer(self):
+        views = odoo_updates.get_views_diff('test_original', 'test_updated')
+        stream = StringIO()
+        odoo_updates.diff_to_screen(views, 'test_views', odoo_updates.ScreenRenderer(stream))
+        self.assertNotIn('\x1b[', stream.getvalue())
+        self.assertIn('+++ test_views test_module.test_model_7', stream.getvalue())
+        stream = StringIO()
+        with odoo_updates.ScreenRenderer(stream, color=True, max_lines=2,
+                                         buffer_size=10) as out:
+            out.diff(['+added', '-removed', ' same', ' other'])
+        self.assertEquals(stream.getvalue().splitlines(),
+                          ['\x1b[32m+added\x1b[0m', '\x1b[31m-removed\x1b[0m',
+                           '\x1b[33m... 2 more lines\x1b[0m'])
+        stream = StringIO()
+        fields = odoo_updates.get_fields_diff('test_original', 'test_updated')
+        odoo_updates.fields_to_screen(fields, 'test_fields', odoo_updates.ScreenRenderer(stream))
+        self.assertIn('+++ field name: test_field_5', stream.getvalue())
+
     def test_12_branches_to_screen(self):
         branches = odoo_updates.get_branches()
         odoo_updates.branches_to_screen(branches)
@@ -130,7 +173,7 @@ class TestOdooUpdates(TestCase):
         self.assertEquals(len(res), 4)
         self.assertIsInstance(res, list)
         for record in res:
-            self.assertIsInstance(record, dict)
+            self.assertIsInstance(record, utils.Record)
 
     def test_14_compare_fields(self):
         original = odoo_updates.get_fields('test_original')
@@ -166,6 +209,411 @@ class TestOdooUpdates(TestCase):
         fields = odoo_updates.get_fields_diff('test_original', 'test_updated')
         odoo_updates.fields_to_screen(fields, 'test_fields')
 
+    def test_17_group_by_model(self):
+        fields = odoo_updates.get_fields_diff('test_original', 'test_updated')
+        res = odoo_updates.group_by_model(fields['updated'])
+        self.assertEquals(res.keys(), ['test_module1', 'test_module2'])
+        self.assertEquals([field['name'] for field in res['test_module1']],
+                          ['test_field_1', 'test_field_2'])
+        self.assertEquals([field['name'] for field in res['test_module2']],
+                          ['test_field_3'])
+
+    def test_18_menus_hierarchy(self):
+        res = odoo_updates.menus_hierarchy('test_original')
+        self.assertEquals(res, {
+            1: 'test_menu_2->test_menu_1',
+            2: 'test_menu_2',
+            3: 'test_menu_2->test_menu_3',
+        })
+
+    def test_19_changed_keys(self):
+        res = odoo_updates.changed_keys({'a': '1', 'b': '2', 'c': None},
+                                        {'a': '1', 'b': '3', 'c': None, 'd': '4'})
+        self.assertEquals(res, set(['b', 'd']))
+
+    def test_20_get_diff_fingerprint(self):
+        for get_diff in (odoo_updates.get_views_diff, odoo_updates.get_translations_diff,
+                         odoo_updates.get_fields_diff):
+            res = get_diff('test_original', 'test_updated', fingerprint=True)
+            validate(res, self.schema)
+            self.assertEquals(res, get_diff('test_original', 'test_updated'))
+
+    def test_21_get_diff_stream(self):
+        for get_diff in (odoo_updates.get_views_diff, odoo_updates.get_translations_diff,
+                         odoo_updates.get_fields_diff):
+            res = get_diff('test_original', 'test_updated', itersize=1)
+            validate(res, self.schema)
+            self.assertEquals(res, get_diff('test_original', 'test_updated'))
+
+    def test_22_get_all_diff(self):
+        res = odoo_updates.get_all_diff('test_original', 'test_updated', jobs=3)
+        self.assertEquals(res['views'], odoo_updates.get_views_diff('test_original',
+                                                                    'test_updated'))
+        self.assertEquals(res['translations'], odoo_updates.get_translations_diff(
+            'test_original', 'test_updated'))
+        self.assertEquals(res['fields'], odoo_updates.get_fields_diff('test_original',
+                                                                      'test_updated'))
+        self.assertEquals(res['menus'], odoo_updates.get_menus_diff('test_original',
+                                                                    'test_updated'))
+        self.assertEquals(res['branches'], odoo_updates.get_branches())
+        res = odoo_updates.get_all_diff('test_original', 'test_updated', fingerprint=True,
+                                        itersize=1, jobs=1)
+        self.assertEquals(res['views'], odoo_updates.get_views_diff('test_original',
+                                                                    'test_updated'))
+
+    def test_23_get_diff_cache(self):
+        cache = SnapshotCache(tempfile.mkdtemp())
+        for get_diff in (odoo_updates.get_views_diff, odoo_updates.get_translations_diff,
+                         odoo_updates.get_fields_diff):
+            for dummy in range(2):
+                res = get_diff('test_original', 'test_updated', cache=cache)
+                self.assertEquals(res, get_diff('test_original', 'test_updated'))
+                res = get_diff('test_original', 'test_updated', fingerprint=True, cache=cache)
+                self.assertEquals(res, get_diff('test_original', 'test_updated'))
+        for dummy in range(2):
+            res = odoo_updates.get_menus_diff('test_original', 'test_updated', cache=cache)
+            self.assertEquals(res, odoo_updates.get_menus_diff('test_original', 'test_updated'))
+        shutil.rmtree(cache.path)
+
+    def test_24_get_diff_incremental(self):
+        for database in ('test_original', 'test_updated'):
+            with utils.PostgresConnector({'dbname': database}) as conn:
+                for table in ('ir_translation', 'ir_ui_view', 'ir_model_fields'):
+                    conn.execute_change('ALTER TABLE {0} ADD COLUMN create_date timestamp, '
+                                        'ADD COLUMN write_date timestamp'.format(table))
+                    conn.execute_change('UPDATE {0} SET create_date = now(), '
+                                        'write_date = now()'.format(table))
+        store = IncrementalStore(tempfile.mkdtemp())
+        for get_diff in (odoo_updates.get_views_diff, odoo_updates.get_translations_diff,
+                         odoo_updates.get_fields_diff):
+            for dummy in range(2):
+                res = get_diff('test_original', 'test_updated', incremental=store)
+                self.assertEquals(res, get_diff('test_original', 'test_updated'))
+        with utils.PostgresConnector({'dbname': 'test_updated'}) as conn:
+            conn.execute_change("UPDATE ir_translation SET value = 'changed', "
+                                "write_date = now() + interval '1 hour' WHERE id = 1")
+            conn.execute_change("DELETE FROM ir_translation WHERE id = 3")
+        res = odoo_updates.get_translations_diff('test_original', 'test_updated',
+                                                 incremental=store)
+        self.assertEquals(res, odoo_updates.get_translations_diff('test_original',
+                                                                  'test_updated'))
+        self.assertEquals(res['updated'][0]['modified'], 'changed')
+        self.assertEquals(res['added'], [])
+        shutil.rmtree(store.path)
+
+    def test_25_canonical_arch(self):
+        arch, digest = odoo_updates.canonical_arch(
+            '<form string="Test" version="7.0"><field name="name"></field>'
+            '<!-- comment -->\n   some   text<group/></form>')
+        self.assertEquals(arch, '<form string="Test" version="7.0">\n'
+                                '    <field name="name"/>\n'
+                                '    some text\n'
+                                '    <group/>\n'
+                                '</form>')
+        same = odoo_updates.canonical_arch(
+            '<form version="7.0"  string="Test">\n    <field name="name"/>some text\n'
+            '    <group></group>\n</form>')
+        self.assertEquals(same, (arch, digest))
+        self.assertEquals(odoo_updates.canonical_arch(' <form>')[0], '<form>')
+        original = [{'xml_id': 'module.same', 'arch': '<tree><field name="a"/></tree>'},
+                    {'xml_id': 'module.changed', 'arch': '<tree><field name="a"/></tree>'}]
+        modified = [{'xml_id': 'module.same',
+                     'arch': '<tree>\n  <field name="a"></field>\n</tree>'},
+                    {'xml_id': 'module.changed', 'arch': '<tree><field name="b"/></tree>'}]
+        res = odoo_updates.compare_views(original, modified)
+        self.assertEquals(res['updated'], [{
+            'xml_id': 'module.changed',
+            'original': '<tree>\n    <field name="a"/>\n</tree>',
+            'modified': '<tree>\n    <field name="b"/>\n</tree>'}])
+
+    def test_25_canonical_arch_cache(self):
+        size = odoo_updates.CANONICAL_CACHE_BYTES
+        # Room for the canonical forms of two of these archs
+        odoo_updates.CANONICAL_CACHE_BYTES = 2 * len('<form>\n    <field name="a"/>\n</form>')
+        try:
+            first = odoo_updates.canonical_arch('<form><field name="a"/></form>')
+            odoo_updates.canonical_arch('<form><field name="b"/></form>')
+            # The first is used again, so the second is the least recently used one
+            self.assertIs(odoo_updates.canonical_arch('<form><field name="a"/></form>'), first)
+            odoo_updates.canonical_arch('<form><field name="c"/></form>')
+            self.assertIs(odoo_updates.canonical_arch('<form><field name="a"/></form>'), first)
+            self.assertEquals(sorted(arch for arch, dummy in
+                                     odoo_updates._canonical_archs.values()),
+                              ['<form>\n    <field name="a"/>\n</form>',
+                               '<form>\n    <field name="c"/>\n</form>'])
+        finally:
+            odoo_updates.CANONICAL_CACHE_BYTES = size
+
+    def test_26_get_diff_candidates(self):
+        candidates = ['test_updated', 'test_original']
+        for get_diff in (odoo_updates.get_views_diff, odoo_updates.get_translations_diff,
+                         odoo_updates.get_fields_diff):
+            for fingerprint in (False, True):
+                res = get_diff('test_original', candidates, fingerprint, jobs=2)
+                self.assertEquals(list(res), candidates)
+                self.assertEquals(res['test_updated'],
+                                  get_diff('test_original', 'test_updated'))
+                self.assertEquals(res['test_original'],
+                                  get_diff('test_original', 'test_original'))
+                self.assertFalse(any(res['test_original'].values()))
+        res = odoo_updates.get_menus_diff('test_original', candidates)
+        self.assertEquals(res['test_updated'],
+                          odoo_updates.get_menus_diff('test_original', 'test_updated'))
+        self.assertFalse(any(res['test_original'].values()))
+
+    def test_27_get_diff_copy(self):
+        for get_data in (odoo_updates.get_views, odoo_updates.get_translations,
+                         odoo_updates.get_fields):
+            self.assertEquals(get_data('test_updated', copy=True), get_data('test_updated'))
+        self.assertEquals(odoo_updates.get_translations('test_updated', [1, 2], copy=True),
+                          odoo_updates.get_translations('test_updated', [1, 2]))
+        for get_diff in (odoo_updates.get_views_diff, odoo_updates.get_translations_diff,
+                         odoo_updates.get_fields_diff):
+            res = get_diff('test_original', 'test_updated', fingerprint=True, copy=True)
+            validate(res, self.schema)
+            self.assertEquals(res, get_diff('test_original', 'test_updated'))
+
+    def test_28_get_keyed_diff(self):
+        tables = """
+            CREATE TABLE ir_model (id integer, model varchar);
+            CREATE TABLE ir_model_access (id integer, name varchar, model_id integer,
+                group_id integer, perm_read boolean, perm_write boolean, perm_create boolean,
+                perm_unlink boolean, active boolean, create_date timestamp,
+                write_date timestamp);
+            CREATE TABLE ir_config_parameter (id integer, key varchar, value text,
+                create_date timestamp, write_date timestamp);
+            INSERT INTO ir_model VALUES (1, 'res.partner');
+            INSERT INTO ir_model_data VALUES ('group_user', 'res.groups', 1, 'base'),
+                ('access_partner', 'ir.model.access', 1, 'base');
+        """
+        with utils.PostgresConnector({'dbname': 'test_original'}) as conn:
+            conn.execute_change(tables + """
+                INSERT INTO ir_model_data VALUES ('access_partner_2', 'ir.model.access', 2,
+                    'base');
+                INSERT INTO ir_model_access VALUES
+                    (1, 'partner', 1, 1, true, false, false, false, true, now(), now()),
+                    (2, 'partner 2', 1, NULL, true, true, true, true, true, now(), now());
+                INSERT INTO ir_config_parameter VALUES (1, 'web.base.url', 'http://localhost',
+                    now(), now()), (2, 'database.uuid', 'uuid', now(), now());
+            """)
+        with utils.PostgresConnector({'dbname': 'test_updated'}) as conn:
+            conn.execute_change(tables + """
+                INSERT INTO ir_model_data VALUES ('access_partner_3', 'ir.model.access', 3,
+                    'base');
+                INSERT INTO ir_model_access VALUES
+                    (1, 'partner', 1, 1, true, true, false, false, true, now(), now()),
+                    (3, 'partner 3', 1, 1, true, false, false, false, true, now(), now());
+                INSERT INTO ir_config_parameter VALUES (1, 'web.base.url', 'https://erp',
+                    now(), now()), (2, 'database.uuid', 'uuid', now(), now()),
+                    (3, 'database.secret', 'secret', now(), now());
+            """)
+        res = odoo_updates.get_keyed_diff('access', 'test_original', 'test_updated')
+        validate(res, self.schema)
+        self.assertEquals([access['xml_id'] for access in res['added']],
+                          ['base.access_partner_3'])
+        self.assertEquals([access['xml_id'] for access in res['deleted']],
+                          ['base.access_partner_2'])
+        self.assertEquals(len(res['updated']), 1)
+        self.assertEquals(res['updated'][0]['xml_id'], 'base.access_partner')
+        self.assertEquals(res['updated'][0]['original']['group'], 'base.group_user')
+        self.assertEquals(res['updated'][0]['original']['model'], 'res.partner')
+        self.assertEquals((res['updated'][0]['original']['perm_write'],
+                           res['updated'][0]['modified']['perm_write']), (False, True))
+        self.assertEquals(res, odoo_updates.get_keyed_diff(
+            'access', 'test_original', 'test_updated', fingerprint=True))
+        res = odoo_updates.get_keyed_diff('parameters', 'test_original', 'test_updated',
+                                          fingerprint=True)
+        # The secrets are compared by their md5
+        secret = 'md5:' + hashlib.md5('secret').hexdigest()
+        self.assertEquals(res['added'], [{'key': 'database.secret', 'value': secret}])
+        self.assertEquals(res['deleted'], [])
+        self.assertEquals(res['updated'], [{'key': 'web.base.url', 'original': 'http://localhost',
+                                            'modified': 'https://erp'}])
+        self.assertEquals(res, odoo_updates.get_keyed_diff(
+            'parameters', 'test_original', 'test_updated', copy=True))
+        stream = StringIO()
+        odoo_updates.keyed_to_screen(res, 'parameters', odoo_updates.ScreenRenderer(stream))
+        output = stream.getvalue()
+        self.assertIn('+++ parameters web.base.url', output)
+        self.assertIn('+https://erp', output)
+        self.assertIn(secret, output)
+        with utils.PostgresConnector({'dbname': 'test_updated'}) as conn:
+            conn.execute_change("""
+                UPDATE ir_config_parameter SET value = 'other uuid' WHERE key = 'database.uuid';
+                INSERT INTO ir_config_parameter VALUES (4, 'mail.smtp.password', 'hunter2',
+                    now(), now());
+            """)
+        res = odoo_updates.get_keyed_diff('parameters', 'test_original', 'test_updated')
+        self.assertItemsEqual([parameter['key'] for parameter in res['updated']],
+                              ['web.base.url', 'database.uuid'])
+        message = utils.jsonify(res, 'parameters', 'test', 'test')
+        for value in ('secret', 'uuid', 'other uuid', 'hunter2'):
+            self.assertNotIn('"{0}"'.format(value), message)
+        self.assertIn('md5:' + hashlib.md5('hunter2').hexdigest(), message)
+
+    def test_29_modules(self):
+        sql = """
+            CREATE TABLE ir_module_module (name varchar, state varchar, latest_version varchar);
+            INSERT INTO ir_model_data VALUES ('field_1', 'ir.model.fields', 1, 'test_module');
+            INSERT INTO ir_module_module VALUES {0};
+        """
+        with utils.PostgresConnector({'dbname': 'test_original'}) as conn:
+            conn.execute_change(sql.format(
+                "('test_module', 'installed', '1.0'), ('sale', 'installed', '1.0'), "
+                "('crm', 'installed', '1.0'), ('stock', 'uninstalled', NULL)"))
+        with utils.PostgresConnector({'dbname': 'test_updated'}) as conn:
+            conn.execute_change(sql.format(
+                "('test_module', 'installed', '1.1'), ('sale', 'installed', '1.0'), "
+                "('crm', 'uninstalled', '1.0'), ('purchase', 'installed', '1.0')"))
+        self.assertEquals(odoo_updates.changed_modules('test_original', 'test_updated'),
+                          ['crm', 'purchase', 'stock', 'test_module'])
+        self.assertEquals(odoo_updates.changed_modules('test_original', ['test_original']), [])
+        for get_diff in (odoo_updates.get_views_diff, odoo_updates.get_translations_diff):
+            res = get_diff('test_original', 'test_updated', modules=['test_module', 'sale'])
+            self.assertEquals(res, get_diff('test_original', 'test_updated'))
+            self.assertEquals(res, get_diff('test_original', 'test_updated', fingerprint=True,
+                                            modules=['test_module'], copy=True))
+            res = get_diff('test_original', 'test_updated', modules=['sale'])
+            self.assertFalse(any(res.values()))
+            res = get_diff('test_original', 'test_updated', fingerprint=True, modules=[])
+            self.assertFalse(any(res.values()))
+        res = odoo_updates.get_fields_diff('test_original', 'test_updated',
+                                           modules=['test_module'])
+        self.assertEquals([(field['model'], field['name']) for field in res['updated']],
+                          [('test_module1', 'test_field_1')])
+        self.assertEquals((res['added'], res['deleted']), ([], []))
+        res = odoo_updates.get_menus_diff('test_original', 'test_updated', modules=['sale'])
+        self.assertFalse(any(res.values()))
+        res = odoo_updates.get_all_diff('test_original', 'test_updated', modules=['sale'])
+        for domain in ('views', 'translations', 'fields', 'menus'):
+            self.assertFalse(any(res[domain].values()))
+        res = odoo_updates.get_all_diff('test_original', ['test_updated'], modules=['sale'])
+        self.assertFalse(any(res['test_updated']['views'].values()))
+        path = tempfile.mkdtemp()
+        try:
+            store = IncrementalStore(path)
+            res = odoo_updates.get_views_diff('test_original', 'test_updated',
+                                              incremental=store, modules=['sale'])
+            self.assertFalse(any(res.values()))
+            self.assertEquals(odoo_updates.get_views_diff('test_original', 'test_updated',
+                                                          incremental=store),
+                              odoo_updates.get_views_diff('test_original', 'test_updated'))
+        finally:
+            shutil.rmtree(path)
+
+    def test_30_translations_partitions(self):
+        sql = """
+            ALTER TABLE ir_translation ADD COLUMN lang varchar, ADD COLUMN type varchar;
+            UPDATE ir_translation SET lang = 'es_MX', type = 'model' WHERE id = 1;
+            UPDATE ir_translation SET lang = 'fr_FR', type = 'code' WHERE id IN (2, 3);
+            INSERT INTO ir_translation (value, id, name, module, lang, type)
+                VALUES ('{0}', 4, 'name', NULL, 'es_MX', 'model');
+        """
+        with utils.PostgresConnector({'dbname': 'test_original'}) as conn:
+            conn.execute_change(sql.format('user translation'))
+        with utils.PostgresConnector({'dbname': 'test_updated'}) as conn:
+            conn.execute_change(sql.format('modified user translation') + """
+                INSERT INTO ir_translation (value, id, name, module, lang, type)
+                    VALUES ('added translation', 3, 'name', 'test_module', 'fr_FR', 'code');
+            """)
+        res = odoo_updates.get_translations('test_updated', langs=['es_MX'])
+        self.assertEquals(sorted(record['id'] for record in res), [1, 4])
+        res = odoo_updates.get_translations_diff('test_original', 'test_updated',
+                                                 langs=['es_MX'], types=['model'])
+        self.assertEquals(sorted(record['modified'] for record in res['updated']),
+                          ['changed', 'modified user translation'])
+        self.assertEquals((res['added'], res['deleted']), ([], []))
+        res = odoo_updates.get_translations_diff('test_original', 'test_updated', types=['code'])
+        self.assertEquals([record['value'] for record in res['added']], ['added translation'])
+        self.assertEquals([record['value'] for record in res['deleted']],
+                          ['translation number two'])
+        self.assertEquals(odoo_updates.TRANSLATIONS.partition_values('test_updated', 'module'),
+                          set(['test_module', None]))
+        with self.assertRaises(ValueError):
+            odoo_updates.VIEWS.partition_values('test_updated', 'lang')
+        expected = odoo_updates.get_translations_diff('test_original', 'test_updated')
+        self.assertEquals(len(expected['updated']), 2)
+        for partition, jobs in (('lang', 1), ('module', 2)):
+            res = odoo_updates.get_translations_diff('test_original', 'test_updated',
+                                                     fingerprint=True, jobs=jobs, copy=True,
+                                                     partition=partition)
+            for state in expected:
+                self.assertItemsEqual(res[state], expected[state])
+        res = odoo_updates.get_translations_diff('test_original', ['test_updated'],
+                                                 langs=['fr_FR'], partition='lang')
+        self.assertEquals([record['value'] for record in res['test_updated']['added']],
+                          ['added translation'])
+        path = tempfile.mkdtemp()
+        try:
+            store = IncrementalStore(path)
+            for dummy in range(2):
+                res = odoo_updates.get_translations_diff('test_original', 'test_updated',
+                                                         incremental=store, partition='lang')
+                for state in expected:
+                    self.assertItemsEqual(res[state], expected[state])
+        finally:
+            shutil.rmtree(path)
+        res = odoo_updates.get_all_diff('test_original', 'test_updated', langs=['fr_FR'])
+        self.assertEquals([record['value'] for record in res['translations']['added']],
+                          ['added translation'])
+        self.assertEquals(res['translations']['updated'], [])
+
+    def test_31_incremental_pending_transaction(self):
+        # Odoo dates the rows with the start of the transaction, a transaction that started
+        # before a run and commits after it leaves rows older than the stored high-water mark
+        pending = psycopg2.connect(dbname='test_updated')
+        path = tempfile.mkdtemp()
+        try:
+            pending.cursor().execute(
+                "UPDATE ir_translation SET value = 'pending', "
+                "write_date = now() AT TIME ZONE 'UTC' WHERE id = 4")
+            with utils.PostgresConnector({'dbname': 'test_updated'}) as conn:
+                conn.execute_change("UPDATE ir_translation SET value = 'committed', "
+                                    "write_date = now() AT TIME ZONE 'UTC' WHERE id = 1")
+            store = IncrementalStore(path)
+            res = odoo_updates.get_translations_diff('test_original', 'test_updated',
+                                                     incremental=store)
+            self.assertNotIn('pending', [record['modified'] for record in res['updated']])
+            pending.commit()
+            res = odoo_updates.get_translations_diff('test_original', 'test_updated',
+                                                     incremental=store)
+            expected = odoo_updates.get_translations_diff('test_original', 'test_updated')
+            for state in expected:
+                self.assertItemsEqual(res[state], expected[state])
+            self.assertItemsEqual([record['modified'] for record in res['updated']],
+                                  ['committed', 'pending'])
+        finally:
+            pending.close()
+            shutil.rmtree(path)
+
+    def test_32_incremental_upgrade_batch(self):
+        # An upgrade writes all its rows with the date of its transaction, once committed they
+        # are not fetched again
+        with utils.PostgresConnector({'dbname': 'test_updated'}) as conn:
+            conn.execute_change("UPDATE ir_translation SET write_date = '2020-01-01'")
+        path = tempfile.mkdtemp()
+        try:
+            store = IncrementalStore(path)
+            odoo_updates.incremental_extract(store, 'test_updated', 'translations')
+            profiler = metrics.start_profiling()
+            try:
+                res = odoo_updates.incremental_extract(store, 'test_updated', 'translations')
+            finally:
+                metrics.stop_profiling()
+            self.assertEquals(res, sorted(odoo_updates.get_translations('test_updated'),
+                                          key=lambda record: record['id']))
+            # Only the horizon and the write dates are queried, no record is fetched again
+            self.assertFalse([query for query in profiler.queries
+                              if 'ir_translation.value' in query['sql']])
+            with utils.PostgresConnector({'dbname': 'test_updated'}) as conn:
+                conn.execute_change("UPDATE ir_translation SET value = 'later', "
+                                    "write_date = now() AT TIME ZONE 'UTC' WHERE id = 3")
+            res = odoo_updates.incremental_extract(store, 'test_updated', 'translations')
+            self.assertEquals([record['value'] for record in res if record['id'] == 3],
+                              ['later'])
+        finally:
+            shutil.rmtree(path)
+
     def test_99_cleanup(self):
         self.shell.run(shlex.split('dropdb test_original'))
         self.shell.run(shlex.split('dropdb test_updated'))
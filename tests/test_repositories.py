@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from unittest2 import TestCase
+from odoo_updates import repositories
+import os
+import shutil
+import spur
+import tempfile
+
+
+def git(path, *args):
+    shell = spur.LocalShell()
+    return shell.run(['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com'] +
+                     list(args), cwd=path).output.strip()
+
+
+def make_repository(path, remote=None):
+    os.makedirs(path)
+    git(path, 'init', '-q', '-b', 'master')
+    with open(os.path.join(path, 'README'), 'w') as readme:
+        readme.write('test')
+    git(path, 'add', 'README')
+    git(path, 'commit', '-q', '-m', 'Initial')
+    if remote:
+        git(path, 'remote', 'add', 'origin', remote)
+    return git(path, 'rev-parse', 'HEAD')
+
+
+class TestRepositories(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        repositories.clear_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_01_find_repositories(self):
+        make_repository(os.path.join(self.path, 'odoo'))
+        make_repository(os.path.join(self.path, 'extra_addons', 'addons_a'))
+        make_repository(os.path.join(self.path, 'odoo', 'nested'))
+        make_repository(os.path.join(self.path, '.hidden', 'repo'))
+        self.assertEquals(repositories.find_repositories(self.path),
+                          [os.path.join(self.path, 'extra_addons', 'addons_a'),
+                           os.path.join(self.path, 'odoo')])
+
+    def test_02_repository_info(self):
+        path = os.path.join(self.path, 'addons_a')
+        commit = make_repository(path, 'git@github.com:Vauxoo/addons_a.git')
+        git(path, 'remote', 'add', 'upstream', 'https://github.com/OCA/addons_a.git')
+        self.assertEquals(repositories.repository_info(path), {
+            'path': path, 'name': 'addons_a', 'branch': 'master', 'commit': commit,
+            'repo_url': {'origin': 'git@github.com:Vauxoo/addons_a.git',
+                         'upstream': 'https://github.com/OCA/addons_a.git'}})
+        # Packed refs, a new branch and a detached HEAD
+        git(path, 'pack-refs', '--all')
+        self.assertEquals(repositories.repository_info(path)['commit'], commit)
+        git(path, 'checkout', '-q', '-b', 'feature')
+        git(path, 'commit', '-q', '--allow-empty', '-m', 'Feature')
+        res = repositories.repository_info(path)
+        self.assertEquals(res['branch'], 'feature')
+        self.assertEquals(res['commit'], git(path, 'rev-parse', 'HEAD'))
+        git(path, 'checkout', '-q', commit)
+        res = repositories.repository_info(path)
+        self.assertEquals((res['branch'], res['commit']), ('HEAD', commit))
+
+    def test_03_worktree(self):
+        path = os.path.join(self.path, 'main')
+        commit = make_repository(path, 'https://github.com/Vauxoo/main.git')
+        worktree = os.path.join(self.path, 'worktree')
+        git(path, 'worktree', 'add', '-q', '-b', 'other', worktree)
+        res = repositories.repository_info(worktree)
+        self.assertEquals((res['branch'], res['commit']), ('other', commit))
+        self.assertEquals(res['repo_url'], {'origin': 'https://github.com/Vauxoo/main.git'})
+
+    def test_04_cache(self):
+        path = os.path.join(self.path, 'repo')
+        make_repository(path)
+        key = repositories.cache_key(path)
+        res = repositories.repository_info(path)
+        res['repo_url']['changed'] = 'url'
+        self.assertEquals(repositories.repository_info(path)['repo_url'], {})
+        self.assertEquals(repositories.cache_key(path), key)
+        git(path, 'commit', '-q', '--allow-empty', '-m', 'Second')
+        self.assertNotEquals(repositories.cache_key(path), key)
+        self.assertEquals(repositories.repository_info(path)['commit'],
+                          git(path, 'rev-parse', 'HEAD'))
+
+    def test_05_scan(self):
+        for name in ('b', 'a', 'c'):
+            make_repository(os.path.join(self.path, name))
+        res = repositories.scan(self.path, jobs=2)
+        self.assertEquals([repository['name'] for repository in res], ['a', 'b', 'c'])
+        self.assertEquals(repositories.scan(os.path.join(self.path, 'missing')), [])
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from unittest2 import TestCase
+from odoo_updates.tables import KeyedTable
+
+
+def canonical_upper(value):
+    return value.upper(), value.upper()
+
+
+class TestTables(TestCase):
+
+    def setUp(self):
+        self.table = KeyedTable(
+            'items', 'item', key=('code', 'company'), compared=('name', 'price'),
+            columns=[('code', 'item.code'), ('company', 'item.company_id'),
+                     ('name', 'item.name'), ('price', 'item.price')],
+            labels=('code',), canonical={'name': canonical_upper})
+
+    def test_01_select(self):
+        sql, args = self.table.select(['item.code'])
+        self.assertEquals(sql, 'SELECT item.code FROM item')
+        self.assertEquals(args, ())
+        sql, args = self.table.select(['item.code'], keys=[('a', 1)])
+        self.assertEquals(sql, 'SELECT item.code FROM item WHERE (item.code, item.company_id) '
+                               'IN %s')
+        self.assertEquals(args, ((('a', 1),),))
+        table = KeyedTable('views', 'ir_ui_view', ('xml_id',), ('arch',),
+                           [('arch', 'ir_ui_view.arch')], model=('ir.ui.view', 'ir.view'),
+                           ordered=True)
+        self.assertEquals(table.columns[0][0], 'xml_id')
+        self.assertEquals(table.tables, ('ir_model_data', 'ir_ui_view'))
+        sql, args = table.select(['ir_ui_view.arch'], keys=['base.view'])
+        self.assertEquals(
+            sql, "SELECT ir_ui_view.arch FROM ir_model_data JOIN ir_ui_view "
+                 "ON ir_model_data.res_id = ir_ui_view.id "
+                 "WHERE ir_model_data.model IN ('ir.ui.view', 'ir.view') "
+                 "AND ir_model_data.module || '.' || ir_model_data.name = ANY(%s) "
+                 "ORDER BY ir_model_data.module || '.' || ir_model_data.name")
+        self.assertEquals(args, (['base.view'],))
+        sql, args = table.select(['ir_ui_view.arch'], keys=['base.view'], order=False,
+                                 modules=['sale', 'base'])
+        self.assertIn("WHERE ir_model_data.model IN ('ir.ui.view', 'ir.view') "
+                      "AND ir_model_data.module = ANY(%s) AND ", sql)
+        self.assertEquals(args, (['base', 'sale'], ['base.view']))
+        # Without a module filter the modules are ignored
+        self.assertEquals(self.table.select(['item.code'], modules=['sale']),
+                          ('SELECT item.code FROM item', ()))
+        self.assertEquals(table.extract('unused', modules=[]), [])
+
+    def test_02_filters(self):
+        table = KeyedTable('translations', 'ir_translation', ('id',), ('value',),
+                           [('id', 'ir_translation.id'), ('value', 'ir_translation.value')],
+                           filters={'lang': 'ir_translation.lang',
+                                    'module': 'ir_translation.module'})
+        sql, args = table.select(['ir_translation.id'], filters={
+            'lang': ['es_MX'], 'module': [None, 'base'], 'ignored': None})
+        self.assertEquals(sql, "SELECT ir_translation.id FROM ir_translation "
+                               "WHERE ir_translation.lang = ANY(%s) AND "
+                               "(ir_translation.module = ANY(%s) "
+                               "OR ir_translation.module IS NULL)")
+        self.assertEquals(args, (['es_MX'], ['base']))
+        with self.assertRaises(ValueError):
+            table.select(['ir_translation.id'], filters={'type': ['code']})
+        self.assertEquals(table.fingerprints('unused', filters={'lang': []}), {})
+
+    def test_03_compare(self):
+        original = [{'code': 'a', 'company': 1, 'name': 'Chair', 'price': 10},
+                    {'code': 'b', 'company': 1, 'name': 'Table', 'price': 20},
+                    {'code': 'c', 'company': 1, 'name': 'Lamp', 'price': 5}]
+        modified = [{'code': 'a', 'company': 1, 'name': 'CHAIR', 'price': 10},
+                    {'code': 'b', 'company': 1, 'name': 'Table', 'price': 25},
+                    {'code': 'c', 'company': 2, 'name': 'Lamp', 'price': 5}]
+        res = self.table.compare(original, modified)
+        self.assertEquals(res['added'], [{'code': 'c', 'name': 'Lamp', 'price': 5}])
+        self.assertEquals(res['deleted'], [{'code': 'c', 'name': 'Lamp', 'price': 5}])
+        self.assertEquals(res['updated'], [{'code': 'b',
+                                            'original': {'name': 'Table', 'price': 20},
+                                            'modified': {'name': 'Table', 'price': 25}}])
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from unittest2 import TestCase
+import json
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+import spur
+
+
+class TestUpdatesv(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.shell = spur.LocalShell()
+        # The branches are the repositories of ~/instance
+        cls.home = tempfile.mkdtemp()
+        path = os.path.join(cls.home, 'instance', 'backupws')
+        cls.shell.run(['git', 'init', '-q', path])
+        cls.shell.run(['git', 'remote', 'add', 'origin',
+                       'https://github.com/Vauxoo/backupws.git'], cwd=path)
+        for database, dump in (('updatesv_original', 'original'),
+                               ('updatesv_updated', 'updated')):
+            cls.shell.run(['createdb', database])
+            cls.shell.run(shlex.split(
+                'psql {0} -f tests/files/{1}_test_db.sql'.format(database, dump)))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.home)
+        for database in ('updatesv_original', 'updatesv_updated'):
+            cls.shell.run(['dropdb', database])
+
+    def updatesv(self, *args):
+        return self.shell.run(
+            [sys.executable, '-m', 'odoo_updates.scripts.updatesv', '-c', 'customer',
+             '-i', 'updates'] + list(args), update_env={'HOME': self.home}).output
+
+    def test_01_branches_many_updated(self):
+        updated = ('-o', 'original', '-u', 'first', '-u', 'second')
+        # The branches are not by updated database
+        self.assertIn('backupws', self.updatesv(*updated + ('-s', 'branches')))
+        res = json.loads(self.updatesv(*updated + ('--split', '-O', '-', 'branches')))
+        self.assertEquals([branch['name'] for branch in res['result']], ['backupws'])
+        lines = [json.loads(line) for line in self.updatesv(
+            *updated + ('-O', '-', '--format', 'ndjson', 'branches')).splitlines()]
+        self.assertEquals([(line['domain'], line['record']['name']) for line in lines],
+                          [('branches', 'backupws')])
+        self.assertNotIn('candidate', lines[0])
+
+    def test_02_getall_screen(self):
+        output = self.updatesv('-o', 'updatesv_original', '-u', 'updatesv_updated', '-s',
+                               '--no-color', '--profile', 'getall')
+        for title in ('+++ views', '+++ Translations', 'Repositories:'):
+            self.assertIn(title, output)
+        # Followed by the metrics table
+        self.assertIn('views.compare', output)
+        self.assertEquals(output.rstrip().splitlines()[-1].split()[0], 'total')
@@ -3,7 +3,9 @@ from unittest2 import TestCase
 from odoo_updates import utils
 import simplejson as json
 import psycopg2
+import psycopg2.pool
 import os
+from StringIO import StringIO
 
 
 class TestUtils(TestCase):
@@ -30,6 +32,114 @@ class TestUtils(TestCase):
         self.assertIsInstance(res, list)
         self.assertEquals(res, dict_list)
 
+    def test_02_copy_list_records(self):
+        dict_list = [{'module': 'base', 'name': 'name_1'},
+                     {'module': ''.join(['ba', 'se']), 'name': 'name_2'}]
+        res = utils.copy_list_records(dict_list, ('module',))
+        self.assertIsInstance(res, list)
+        self.assertEquals(res, dict_list)
+        self.assertIs(res[0]['module'], res[1]['module'])
+        self.assertIs(type(res[0]), type(res[1]))
+        self.assertFalse(hasattr(res[0], '__dict__'))
+        self.assertEquals(res[0].get('name'), 'name_1')
+        self.assertIsNone(res[0].get('value'))
+        self.assertIn('name', res[0])
+        with self.assertRaises(KeyError):
+            res[0]['value']  # pylint: disable=W0104
+
+    def test_02_jsonify_records(self):
+        records = utils.copy_list_records([{'xml_id': 'module.view', 'arch': '<form/>'}])
+        res = json.loads(utils.jsonify({'added': records}, 'test', 'test', 'updates'))
+        self.assertEquals(res['result']['added'], [{'xml_id': 'module.view', 'arch': '<form/>'}])
+
+    def test_02_dump_json(self):
+        records = utils.copy_list_records([{'xml_id': 'module.view', 'arch': '<form/>'},
+                                           {'xml_id': 'module.other', 'arch': '<tree/>'}])
+        states = {'views': {'added': records, 'deleted': []}, 'branches': [{'name': 'x'}]}
+        expected = json.loads(utils.jsonify(states, 'getall', 'test', 'updates'))
+        for indent in (None, 4):
+            stream = StringIO()
+            utils.dump_json(states, 'getall', 'test', 'updates', stream, indent)
+            self.assertEquals(json.loads(stream.getvalue()), expected)
+        self.assertNotIn(' ', stream.getvalue().splitlines()[0])
+        self.assertEquals(stream.getvalue().splitlines()[1], '    "command": "getall",')
+
+    def test_02_dump_ndjson(self):
+        records = utils.copy_list_records([{'xml_id': 'module.view', 'arch': '<form/>'}])
+        states = {'views': {'added': records, 'deleted': []}, 'branches': [{'name': 'x'}]}
+        stream = StringIO()
+        utils.dump_ndjson(states, 'getall', 'test', 'updates', stream)
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEquals(len(lines), 2)
+        self.assertEquals(lines[0]['domain'], 'branches')
+        self.assertIsNone(lines[0]['state'])
+        self.assertEquals(lines[1]['state'], 'added')
+        self.assertEquals(lines[1]['record'], {'xml_id': 'module.view', 'arch': '<form/>'})
+        self.assertEquals(lines[1]['customer_id'], 'test')
+
+    def test_02_send_message(self):
+        client = utils.LocalQueueClient()
+        assembler = utils.MessageAssembler()
+        message = utils.jsonify({'added': [{'arch': '<form/>'}]}, 'test', 'test', 'updates')
+        self.assertEquals(utils.send_message(message, 'queue', client), 1)
+        body = client.receive_message(QueueUrl='queue')['Messages'][0]['Body']
+        self.assertEquals(json.loads(body)['type'], 'message')
+        self.assertEquals(assembler.add(body), message)
+
+    def test_02_send_message_chunks(self):
+        client = utils.LocalQueueClient(max_size=8 * 1024)
+        publisher = utils.QueuePublisher('queue', client, max_size=8 * 1024)
+        message = json.dumps([os.urandom(8).encode('hex') for dummy in range(2000)])
+        sent = publisher.publish(message)
+        self.assertGreater(sent, publisher.max_batch)
+        bodies = [body['Body'] for body in
+                  client.receive_message(QueueUrl='queue', MaxNumberOfMessages=sent)['Messages']]
+        self.assertEquals(len(bodies), sent)
+        self.assertEquals(json.loads(bodies[0])['type'], 'manifest')
+        assembler = utils.MessageAssembler()
+        res = [assembler.add(body) for body in reversed(bodies)]
+        self.assertEquals(res[:-1], [None] * (sent - 1))
+        self.assertEquals(res[-1], message)
+        self.assertEquals(assembler.pending, {})
+
+    def test_02_message_assembler_ttl(self):
+        client = utils.LocalQueueClient(max_size=8 * 1024)
+        publisher = utils.QueuePublisher('queue', client, max_size=8 * 1024)
+        sent = publisher.publish(json.dumps([os.urandom(8).encode('hex')
+                                             for dummy in range(2000)]))
+        bodies = [body['Body'] for body in
+                  client.receive_message(QueueUrl='queue', MaxNumberOfMessages=sent)['Messages']]
+        assembler = utils.MessageAssembler()
+        self.assertIsNone(assembler.add(bodies[0]))
+        for pending in assembler.pending.values():
+            pending['received'] -= assembler.ttl + 1
+        # The chunk of the expired message starts a new pending one
+        self.assertIsNone(assembler.add(bodies[1]))
+        self.assertEquals([pending.get('manifest') for pending in assembler.pending.values()],
+                          [None])
+
+    def test_02_send_message_retry(self):
+        client = utils.LocalQueueClient()
+        send_message_batch = client.send_message_batch
+        calls = list()
+
+        def flaky_batch(QueueUrl, Entries):  # pylint: disable=C0103
+            calls.append(len(Entries))
+            if len(calls) > 1:
+                return send_message_batch(QueueUrl, Entries)
+            send_message_batch(QueueUrl, Entries[1:])
+            return {'Failed': [{'Id': Entries[0]['Id'], 'SenderFault': False}]}
+        client.send_message_batch = flaky_batch
+        publisher = utils.QueuePublisher('retry', client, compress=False, max_size=4096)
+        sent = publisher.publish('x' * 6000)
+        self.assertEquals(calls[1], 1)
+        self.assertEquals(len(client.queues['retry']), sent)
+        publisher.retries = 0
+        client.send_message_batch = lambda QueueUrl, Entries: {
+            'Failed': [{'Id': Entries[0]['Id']}]}
+        with self.assertRaises(utils.PublishError):
+            publisher.publish('x' * 6000)
+
     def test_03_postgres_connector_exception(self):
         with self.assertRaises(psycopg2.OperationalError):
             utils.PostgresConnector({'dbname': 'wrong_name'})
@@ -52,6 +162,71 @@ class TestUtils(TestCase):
         res = self.connector.check_config()
         self.assertTrue(res)
 
+    def test_06_execute_stream(self):
+        connector = utils.PostgresConnector({'dbname': 'tests', 'itersize': 2})
+        res = connector.execute_stream('SELECT generate_series(1, %s) AS num', 5)
+        self.assertNotIsInstance(res, list)
+        self.assertEquals([row['num'] for row in res], [1, 2, 3, 4, 5])
+        with self.assertRaises(psycopg2.ProgrammingError):
+            list(connector.execute_stream('wrong query'))
+        self.assertTrue(connector.check_config())
+        connector.disconnect()
+
+    def test_06_stream_select(self):
+        res = utils.stream_select({'dbname': 'tests'}, 'SELECT 1 AS num')
+        self.assertEquals(list(res), [{'num': 1}])
+
+    def test_06_execute_copy(self):
+        sql = ("SELECT %s AS text, NULL::text AS empty, 5 AS number, 1.5::float AS float, "
+               "true AS bool, mod(value, 2)::text AS interned FROM generate_series(1, 3) value;")
+        text = 'tab\there\nnew line \\N back\\slash \xc3\xb1'
+        res = self.connector.execute_copy(sql, (text,), ('interned',))
+        self.assertEquals(res, utils.copy_list_dicts(self.connector.execute_select(sql, text)))
+        self.assertEquals(res[0], {'text': text, 'empty': None, 'number': 5, 'float': 1.5,
+                                   'bool': True, 'interned': '1'})
+        self.assertIs(res[0]['interned'], res[2]['interned'])
+        self.assertEquals(self.connector.execute_copy('SELECT 1 AS num WHERE false'), [])
+        with self.assertRaises(psycopg2.ProgrammingError):
+            self.connector.execute_copy('wrong query')
+        self.assertTrue(self.connector.check_config())
+
+    def test_06_connection_pool(self):
+        pool = utils.ConnectionPool(maxconn=1, check_interval=0, timeout=0.1)
+        connector = utils.PostgresConnector({'dbname': 'tests', 'pool': pool})
+        conn = connector._PostgresConnector__conn  # pylint: disable=W0212
+        with self.assertRaises(psycopg2.pool.PoolError):
+            utils.PostgresConnector({'dbname': 'tests', 'pool': pool})
+        connector.disconnect()
+        self.assertFalse(conn.closed)
+        with self.assertRaises(psycopg2.InterfaceError):
+            connector.execute_select('SELECT 1')
+        with utils.PostgresConnector({'dbname': 'tests', 'pool': pool}) as other:
+            self.assertIs(other._PostgresConnector__conn, conn)  # pylint: disable=W0212
+            self.assertTrue(other.check_config())
+        conn.close()
+        with utils.PostgresConnector({'dbname': 'tests', 'pool': pool}) as other:
+            self.assertIsNot(other._PostgresConnector__conn, conn)  # pylint: disable=W0212
+            self.assertTrue(other.check_config())
+        pool.closeall()
+
+    def test_06_shared_pool(self):
+        pool = utils.open_pool()
+        self.assertIs(utils.open_pool(), pool)
+        with utils.PostgresConnector({'dbname': 'tests'}) as connector:
+            connector.execute_select('SELECT 1')
+        with utils.PostgresConnector({'dbname': 'tests'}) as connector:
+            self.assertTrue(connector.check_config())
+        utils.close_pool()
+        self.assertIsNot(utils.open_pool(), pool)
+        utils.close_pool()
+
+    def test_06_run_parallel(self):
+        tasks = [(pow, (2, exp)) for exp in range(10)]
+        self.assertEquals(utils.run_parallel(tasks, 3), [2 ** exp for exp in range(10)])
+        self.assertEquals(utils.run_parallel(tasks, 1), [2 ** exp for exp in range(10)])
+        with self.assertRaises(ZeroDivisionError):
+            utils.run_parallel([(divmod, (1, 0)), (divmod, (1, 1))], 2)
+
     def test_07_disconnect(self):
         self.connector.disconnect()
         with self.assertRaises(psycopg2.InterfaceError):
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from unittest2 import TestCase
+from odoo_updates import odoo_updates
+from odoo_updates import utils
+from odoo_updates import worker
+from odoo_updates.cache import MemorySnapshotCache
+import json
+import shlex
+import shutil
+import tempfile
+import spur
+
+
+class TestWorker(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.shell = spur.LocalShell()
+        for database, dump in (('worker_original', 'original'), ('worker_updated', 'updated')):
+            cls.shell.run(['createdb', database])
+            cls.shell.run(shlex.split(
+                'psql {0} -f tests/files/{1}_test_db.sql'.format(database, dump)))
+        cls.path = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+        for database in ('worker_original', 'worker_updated'):
+            cls.shell.run(['dropdb', database])
+
+    def setUp(self):
+        self.client = utils.LocalQueueClient()
+        self.worker = worker.DiffWorker('jobs', 'results', self.client,
+                                        MemorySnapshotCache(self.path), wait=0)
+
+    def results(self):
+        assembler = utils.MessageAssembler()
+        res = list()
+        response = self.client.receive_message(QueueUrl='results', MaxNumberOfMessages=100)
+        for message in response.get('Messages', []):
+            body = assembler.add(message['Body'])
+            if body is not None:
+                res.append(json.loads(body))
+        return res
+
+    def expected(self, states):
+        return json.loads(utils.jsonify(states, 'test', 'test', 'test'))['result']
+
+    def test_01_serve(self):
+        job = {'command': 'views', 'original': 'worker_original', 'updated': ['worker_updated'],
+               'customer': 'customer', 'instance': 'updates'}
+        for dummy in range(2):
+            worker.submit(job, 'jobs', self.client)
+        worker.submit(dict(job, command='translations', queue='other',
+                           updated=['worker_updated', 'worker_original'],
+                           options={'fingerprint': True, 'split': True, 'profile': True}),
+                      'jobs', self.client)
+        self.assertEquals(self.worker.serve(max_jobs=3), 3)
+        res = self.results()
+        self.assertEquals(len(res), 2)
+        expected = self.expected(odoo_updates.get_views_diff('worker_original',
+                                                             'worker_updated'))
+        for message in res:
+            self.assertEquals((message['command'], message['customer_id'],
+                               message['instance']), ('views', 'customer', 'updates'))
+            self.assertEquals(message['result'], expected)
+        # The original views, translations and their fingerprints are kept in memory
+        self.assertEquals(len(self.worker.cache.memory), 3)
+        # And the original views and translations are indexed once
+        self.assertEquals(len(self.worker.cache.indexes), 2)
+        response = self.client.receive_message(QueueUrl='other', MaxNumberOfMessages=10)
+        res = [json.loads(utils.MessageAssembler().add(message['Body']))
+               for message in response['Messages']]
+        self.assertEquals([list(message['result']) for message in res],
+                          [['worker_updated'], ['worker_original']])
+        self.assertEquals(res[0]['result']['worker_updated'], self.expected(
+            odoo_updates.get_translations_diff('worker_original', 'worker_updated')))
+        self.assertFalse(any(res[1]['result']['worker_original'].values()))
+        self.assertIn('translations.compare', res[0]['metrics']['phases'])
+
+    def test_02_errors(self):
+        self.client.send_message(QueueUrl='jobs', MessageBody='not a job')
+        worker.submit({'command': 'unknown', 'original': 'worker_original',
+                       'updated': 'worker_updated', 'customer': 'customer',
+                       'instance': 'updates'}, 'jobs', self.client)
+        worker.submit({'command': 'parameters', 'original': 'worker_original',
+                       'updated': 'worker_updated', 'customer': 'customer',
+                       'instance': 'updates'}, 'jobs', self.client)
+        self.assertEquals(self.worker.serve(max_jobs=3), 3)
+        res = self.results()
+        self.assertEquals([message['command'] for message in res], ['unknown', 'parameters'])
+        self.assertEquals(res[0]['result'], {'error': 'ValueError: Unknown command unknown'})
+        self.assertIn('ir_config_parameter', res[1]['result']['error'])
+
+    def test_03_stop(self):
+        self.worker.stop()
+        self.assertEquals(self.worker.serve(), 0)
+
+    def test_04_bad_messages(self):
+        send_message = self.client.send_message
+
+        def broken_queue(QueueUrl, MessageBody):  # pylint: disable=C0103
+            if QueueUrl == 'broken':
+                raise ValueError('Queue is broken')
+            return send_message(QueueUrl, MessageBody)
+        self.client.send_message = broken_queue
+        self.client.send_message(QueueUrl='jobs', MessageBody='[1]')
+        manifest = {'id': 'corrupted', 'type': 'manifest', 'encoding': 'base64', 'parts': 1,
+                    'size': 4, 'sha1': 'wrong'}
+        chunk = {'id': 'corrupted', 'type': 'chunk', 'part': 0, 'data': 'am9iIQ=='}
+        for body in (manifest, chunk):
+            self.client.send_message(QueueUrl='jobs', MessageBody=json.dumps(body))
+        job = {'command': 'views', 'original': 'worker_original', 'updated': 'worker_updated',
+               'customer': 'customer', 'instance': 'updates'}
+        worker.submit(dict(job, queue='broken'), 'jobs', self.client)
+        worker.submit(dict(job, command='branches', updated=['worker_updated'],
+                           options={'split': True}), 'jobs', self.client)
+        worker.submit(job, 'jobs', self.client)
+        self.assertEquals(self.worker.serve(max_jobs=5), 5)
+        res = self.results()
+        self.assertEquals([message['command'] for message in res], ['branches', 'views'])
+        self.assertEquals(res[0]['result'], self.expected(odoo_updates.get_branches()))